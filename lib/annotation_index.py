@@ -0,0 +1,240 @@
+import hashlib
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+INDEX_VERSION = 1
+
+
+def _parse_annotation_file(json_path):
+    with open(json_path, 'r') as f:
+        annotations = json.load(f)['annotations']
+    boxes = [annotation['bbox'] for annotation in annotations]
+    keypoints = [annotation.get('keypoints', []) for annotation in annotations]
+    categories = [annotation.get('category_id', 0) for annotation in annotations]
+    return boxes, keypoints, categories
+
+
+def _scan_annotation_dir(annot_dir):
+    entries = [entry for entry in os.scandir(annot_dir) if entry.name.endswith('.json') and entry.is_file()]
+    entries.sort(key=lambda entry: entry.name)
+    return [entry.name for entry in entries], [entry.stat().st_mtime_ns for entry in entries]
+
+
+class AnnotationIndex:
+    """
+    Columnar index of all the annotations of a dataset directory.
+
+    There is one row per annotation. The columns are NumPy arrays:
+    - image_ids (N,): the position of the annotated image in file_names.
+    - boxes (N, 4): the boxes, always in xyxy format.
+    - keypoints (N, K, 3): the keypoints as (x, y, v) rows, zero-padded to the largest keypoint count.
+    - categories (N,): the category ids.
+    file_names and mtimes have one entry per annotation file.
+
+    Building the index parses every JSON file once, in parallel. The index is cached in the user cache directory
+    and, on the next build, only the files whose modification time changed are parsed again, so validation
+    and statistics over the whole dataset become array operations.
+
+    Usage:
+    index = AnnotationIndex.build(annot_dir, bbox_format="xyxy")
+    invalid_files = index.file_names[index.image_ids[index.invalid_boxes()]]
+    """
+
+    def __init__(self, file_names, mtimes, image_ids, boxes, keypoints, categories, bbox_format="xyxy"):
+        self.file_names = file_names
+        self.mtimes = mtimes
+        self.image_ids = image_ids
+        self.boxes = boxes
+        self.keypoints = keypoints
+        self.categories = categories
+        self.bbox_format = bbox_format
+        self._rows_by_file = None
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    @property
+    def num_images(self):
+        return len(self.file_names)
+
+    @staticmethod
+    def default_cache_path(annot_dir, bbox_format="xyxy"):
+        # In the user cache directory, keyed by the annotation directory, so that read-only dataset directories
+        # work and stay untouched
+        cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        key = hashlib.sha1(os.path.abspath(annot_dir).encode()).hexdigest()[:16]
+        return os.path.join(cache_dir, "roller_annotation_index", "annotation_index_{}_{}.npz".format(key, bbox_format))
+
+    @classmethod
+    def build(cls, annot_dir, bbox_format="xyxy", cache_path=None, num_workers=None):
+        """
+        Builds the index of a directory of per-image JSON annotations, reusing the cache when possible.
+
+        Parameters:
+        annot_dir (str): The directory containing the JSON annotation files.
+        bbox_format (str): The format of the 'bbox' field in the files: "xyxy" (as written by the augmentation)
+          or "xywh" (COCO, as in the raw dataset). Boxes are stored as xyxy in the index either way.
+        cache_path (str): Where the index is cached. Defaults to default_cache_path, in the user cache directory.
+          Pass False to disable caching. The cache is best-effort: the index is returned even if it cannot be written.
+        num_workers (int): The number of processes parsing the changed files. Defaults to the number of CPUs.
+
+        Returns:
+        AnnotationIndex: The index of the directory.
+        """
+        if bbox_format not in ("xyxy", "xywh"):
+            raise ValueError(f"bbox_format should be either 'xyxy' or 'xywh', got {bbox_format}")
+        if cache_path is None:
+            cache_path = cls.default_cache_path(annot_dir, bbox_format)
+        file_names, mtimes = _scan_annotation_dir(annot_dir)
+        mtimes = np.asarray(mtimes, dtype=np.int64)
+
+        cached = None
+        if cache_path and os.path.exists(cache_path):
+            cached = cls.load(cache_path)
+            if cached.bbox_format != bbox_format:
+                cached = None
+
+        # Reuse the rows of the files whose modification time did not change
+        reused = {}
+        if cached is not None:
+            cached_mtimes = dict(zip(cached.file_names.tolist(), cached.mtimes.tolist()))
+            for name, mtime in zip(file_names, mtimes.tolist()):
+                if cached_mtimes.get(name) == mtime:
+                    reused[name] = cached.rows_of(name)
+        to_parse = [name for name in file_names if name not in reused]
+        if cached is not None and not to_parse and len(reused) == cached.num_images:
+            return cached
+
+        paths = [os.path.join(annot_dir, name) for name in to_parse]
+        if len(paths) > 256 and (num_workers is None or num_workers > 1):
+            with multiprocessing.Pool(processes=num_workers) as pool:
+                parsed = pool.map(_parse_annotation_file, paths, chunksize=64)
+        else:
+            parsed = [_parse_annotation_file(path) for path in paths]
+        parsed = dict(zip(to_parse, parsed))
+
+        num_keypoints = max([len(k) // 3 for boxes, keypoints, _ in parsed.values() for k in keypoints], default=0)
+        if cached is not None:
+            num_keypoints = max(num_keypoints, cached.keypoints.shape[1])
+
+        image_ids, boxes, keypoints, categories = [], [], [], []
+        for image_id, name in enumerate(file_names):
+            if name in reused:
+                rows = reused[name]
+                image_ids.append(np.full(len(rows), image_id, dtype=np.int64))
+                boxes.append(cached.boxes[rows])
+                file_keypoints = np.zeros((len(rows), num_keypoints, 3), dtype=np.float32)
+                file_keypoints[:, : cached.keypoints.shape[1]] = cached.keypoints[rows]
+                keypoints.append(file_keypoints)
+                categories.append(cached.categories[rows])
+                continue
+            file_boxes, file_keypoints, file_categories = parsed[name]
+            file_boxes = np.asarray(file_boxes, dtype=np.float32).reshape(-1, 4)
+            if bbox_format == "xywh":
+                file_boxes[:, 2:] += file_boxes[:, :2]
+            padded_keypoints = np.zeros((len(file_keypoints), num_keypoints, 3), dtype=np.float32)
+            for i, k in enumerate(file_keypoints):
+                k = np.asarray(k, dtype=np.float32).reshape(-1, 3)
+                padded_keypoints[i, : len(k)] = k
+            image_ids.append(np.full(len(file_boxes), image_id, dtype=np.int64))
+            boxes.append(file_boxes)
+            keypoints.append(padded_keypoints)
+            categories.append(np.asarray(file_categories, dtype=np.int64))
+
+        index = cls(
+            np.asarray(file_names, dtype=str),
+            mtimes,
+            np.concatenate(image_ids) if image_ids else np.zeros(0, dtype=np.int64),
+            np.concatenate(boxes) if boxes else np.zeros((0, 4), dtype=np.float32),
+            np.concatenate(keypoints) if keypoints else np.zeros((0, num_keypoints, 3), dtype=np.float32),
+            np.concatenate(categories) if categories else np.zeros(0, dtype=np.int64),
+            bbox_format,
+        )
+        if cache_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+                index.save(cache_path)
+            except OSError as e:
+                print(f"Could not write the annotation index cache {cache_path}: {e}")
+        return index
+
+    def save(self, path):
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            version=INDEX_VERSION,
+            bbox_format=self.bbox_format,
+            file_names=self.file_names,
+            mtimes=self.mtimes,
+            image_ids=self.image_ids,
+            boxes=self.boxes,
+            keypoints=self.keypoints,
+            categories=self.categories,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                raise ValueError(f"Unsupported annotation index version in {path}")
+            return cls(
+                data["file_names"],
+                data["mtimes"],
+                data["image_ids"],
+                data["boxes"],
+                data["keypoints"],
+                data["categories"],
+                str(data["bbox_format"]),
+            )
+
+    def fingerprint(self):
+        """
+        Returns a SHA-256 hex digest of the content of the index, which changes whenever an annotation changes.
+        """
+        digest = hashlib.sha256(self.bbox_format.encode("utf-8"))
+        for array in (self.file_names, self.image_ids, self.boxes, self.keypoints, self.categories):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def rows_of(self, file_name):
+        """
+        Returns the row numbers of the annotations of one JSON file.
+        """
+        if self._rows_by_file is None:
+            order = np.argsort(self.image_ids, kind="stable")
+            starts = np.searchsorted(self.image_ids[order], np.arange(self.num_images + 1))
+            names = self.file_names.tolist()
+            self._rows_by_file = {names[i]: order[starts[i] : starts[i + 1]] for i in range(self.num_images)}
+        return self._rows_by_file.get(file_name, np.zeros(0, dtype=np.int64))
+
+    def invalid_boxes(self):
+        """
+        Returns a boolean mask of the annotations whose box has a non-positive width or height.
+        """
+        return (self.boxes[:, 0] >= self.boxes[:, 2]) | (self.boxes[:, 1] >= self.boxes[:, 3])
+
+    def areas(self):
+        return (self.boxes[:, 2] - self.boxes[:, 0]) * (self.boxes[:, 3] - self.boxes[:, 1])
+
+    def statistics(self):
+        """
+        Returns summary statistics of the dataset as a dict.
+        """
+        areas = self.areas()
+        visible = self.keypoints[..., 2] > 0
+        categories, counts = np.unique(self.categories, return_counts=True)
+        return {
+            "num_images": self.num_images,
+            "num_annotations": len(self),
+            "num_images_without_annotation": self.num_images - len(np.unique(self.image_ids)),
+            "num_invalid_boxes": int(self.invalid_boxes().sum()),
+            "area_min": float(areas.min()) if len(areas) else 0.0,
+            "area_mean": float(areas.mean()) if len(areas) else 0.0,
+            "area_max": float(areas.max()) if len(areas) else 0.0,
+            "visible_keypoints_per_annotation": float(visible.sum(axis=1).mean()) if len(self) else 0.0,
+            "annotations_per_category": dict(zip(categories.tolist(), counts.tolist())),
+        }
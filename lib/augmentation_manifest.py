@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import albumentations as A
+from augmentation_pipeline import get_augmentation_pipelines
+
+MANIFEST_VERSION = 1
+MANIFEST_FILE_NAME = "augmentation_manifest.json"
+
+
+def get_pipeline_fingerprints(transformations, base_seed=0, reduced_decoding=False):
+    """
+    Compute a fingerprint of the definition of every augmentation pipeline.
+
+    Parameters:
+    transformations (list): The augmentation type names, see get_augmentation_pipelines.
+    base_seed (int): The run-wide seed passed to seed_augmentation, which also changes the outputs.
+    reduced_decoding (bool): Whether the source images are decoded at a reduced resolution, which changes the
+      output pixels slightly. Off, the fingerprints are the same as before this option existed.
+
+    Returns:
+    dict: A dictionary mapping each augmentation type name to the SHA-256 hex digest of its serialized pipeline.
+
+    The full pipelines (shared resize included) are serialized with A.to_dict, so editing any parameter of a
+    pipeline changes its fingerprint and only the outputs of that augmentation type get rebuilt.
+    """
+    pipelines = get_augmentation_pipelines()
+    fingerprints = {}
+    for transformation in transformations:
+        definition = {"pipeline": A.to_dict(pipelines[transformation]), "base_seed": base_seed}
+        if reduced_decoding:
+            definition["reduced_decoding"] = True
+        serialized = json.dumps(definition, sort_keys=True, default=str)
+        fingerprints[transformation] = hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+    return fingerprints
+
+
+def compute_source_hash(image_path, json_path):
+    """
+    Compute the content hash of a source image and its annotation.
+
+    Parameters:
+    image_path (str): The path to the source image.
+    json_path (str): The path to the source JSON annotation.
+
+    Returns:
+    str: The SHA-256 hex digest of the image bytes followed by the annotation bytes.
+
+    Raises:
+    OSError: If one of the files cannot be read.
+    """
+    digest = hashlib.sha256()
+    for path in (image_path, json_path):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AugmentationManifest:
+    """
+    Record of the augmented outputs produced from each source file, used to make augmentation incremental.
+
+    Parameters:
+    path (str): The path of the manifest file. It is loaded if it exists. Keep it out of the augmented annotations
+      directory, since every ".json" file in there is read as an annotation.
+
+    Every output is keyed by the hash of the source image bytes, the annotation JSON and the pipeline definition.
+    A rerun only processes the (file, augmentation type) pairs whose key changed or whose outputs are missing,
+    and a crashed run resumes from the last saved manifest. The source hash is only recomputed when the
+    modification time or the size of the source files changed.
+
+    Usage:
+    manifest = AugmentationManifest(manifest_path)
+    manifest.prune(json_files, transformations)
+    jobs = manifest.plan(json_files, json_dir, image_dir, transformations, get_pipeline_fingerprints(transformations))
+    ... run the jobs, calling manifest.record(json_file, outputs) for every finished file ...
+    manifest.save()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sources = {}
+        self._planned = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.sources = data["sources"]
+
+    def prune(self, json_files, transformations=None):
+        """
+        Delete the outputs of the source files that are not part of the dataset anymore, and the outputs of the
+        augmentation types that are not applied anymore.
+
+        Parameters:
+        json_files (list): The JSON file names currently in the dataset.
+        transformations (list): The augmentation type names currently applied, or None to keep every type.
+
+        Returns:
+        list: The paths of the deleted output files.
+        """
+        current = set(json_files)
+        removed = []
+        for json_file in [json_file for json_file in self.sources if json_file not in current]:
+            for output in self.sources.pop(json_file)["outputs"].values():
+                removed.extend(self._remove_files(output["files"]))
+        if transformations is not None:
+            for entry in self.sources.values():
+                for transformation in [t for t in entry["outputs"] if t not in transformations]:
+                    removed.extend(self._remove_files(entry["outputs"].pop(transformation)["files"]))
+        return removed
+
+    def plan(self, json_files, json_dir, image_dir, transformations, fingerprints):
+        """
+        Find the augmentations that are missing or out of date.
+
+        Parameters:
+        json_files (list): The JSON file names to augment.
+        json_dir (str): The directory containing the JSON files.
+        image_dir (str): The directory containing the source images.
+        transformations (list): The augmentation type names to apply.
+        fingerprints (dict): The pipeline fingerprints, see get_pipeline_fingerprints.
+
+        Returns:
+        list: A list of (json_file, transformations) tuples with the augmentation types to (re)build, in the
+          format expected by run_parallel_augmentation.
+        """
+        jobs = []
+        self._planned = {}
+        for json_file in json_files:
+            json_path = os.path.join(json_dir, json_file)
+            image_path = os.path.join(image_dir, os.path.splitext(json_file)[0] + ".jpg")
+            try:
+                image_stat, json_stat = os.stat(image_path), os.stat(json_path)
+            except OSError:
+                # Let the augmentation itself report the missing file
+                jobs.append((json_file, list(transformations)))
+                continue
+            stat = [image_stat.st_mtime_ns, image_stat.st_size, json_stat.st_mtime_ns, json_stat.st_size]
+
+            entry = self.sources.get(json_file)
+            if entry is not None and entry["stat"] == stat:
+                source_hash = entry["hash"]
+            else:
+                source_hash = compute_source_hash(image_path, json_path)
+                if entry is not None and entry["hash"] == source_hash:
+                    entry["stat"] = stat
+
+            keys = {
+                transformation: hashlib.sha256((source_hash + fingerprints[transformation]).encode("utf-8")).hexdigest()
+                for transformation in transformations
+            }
+            self._planned[json_file] = (stat, source_hash, keys)
+            pending = [
+                transformation for transformation in transformations
+                if not self._is_up_to_date(entry, transformation, keys[transformation])
+            ]
+            if pending:
+                jobs.append((json_file, pending))
+        return jobs
+
+    def record(self, json_file, outputs):
+        """
+        Record the outputs written for a source file planned by plan.
+
+        Parameters:
+        json_file (str): The JSON file name of the source.
+        outputs (dict): A dictionary mapping each augmentation type to its written [json_path, image_path].
+
+        Returns:
+        list: The paths of the deleted output files: when the source changed, the outputs of the previous source
+          that were not written again, e.g. because their augmentation failed, are deleted, so that the dataset
+          never picks them up. With an unchanged source, such outputs stay tracked and are rebuilt by the next plan.
+        """
+        if json_file not in self._planned:
+            return []
+        stat, source_hash, keys = self._planned[json_file]
+        entry = self.sources.get(json_file)
+        removed = []
+        if entry is not None and entry["hash"] != source_hash:
+            for transformation, output in entry["outputs"].items():
+                stale = [path for path in output["files"] if path not in outputs.get(transformation, ())]
+                removed.extend(self._remove_files(stale))
+            entry = None
+        if entry is None:
+            entry = {"outputs": {}}
+        entry["stat"] = stat
+        entry["hash"] = source_hash
+        for transformation, files in outputs.items():
+            entry["outputs"][transformation] = {"key": keys[transformation], "files": list(files)}
+        self.sources[json_file] = entry
+        return removed
+
+    def save(self):
+        """
+        Write the manifest atomically, so that a crash never leaves a truncated manifest behind.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"version": MANIFEST_VERSION, "sources": self.sources}, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _remove_files(paths):
+        removed = []
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+                removed.append(path)
+        return removed
+
+    @staticmethod
+    def _is_up_to_date(entry, transformation, key):
+        if entry is None or transformation not in entry["outputs"]:
+            return False
+        output = entry["outputs"][transformation]
+        return output["key"] == key and all(os.path.exists(path) for path in output["files"])
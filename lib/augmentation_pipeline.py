@@ -1,14 +1,22 @@
 import albumentations as A
 from albumentations.pytorch import ToTensorV2
 
+# The (height, width) of the shared resize step that starts every pipeline
+RESIZE_SIZE = (360, 640)
 
-def scale_down_pipeline():
+
+def _resize_prefix(include_resize):
+    return [A.Resize(height=RESIZE_SIZE[0], width=RESIZE_SIZE[1])] if include_resize else []
+
+
+def scale_down_pipeline(include_resize=True):
     """
     This function creates a scale down transform pipeline.
     The pipeline is designed to make people appear smaller in images.
 
     Parameters:
-    None
+    include_resize (bool): Whether the pipeline starts with the shared A.Resize(height=360, width=640) step.
+      Pass False to get only the transform-specific tail, to be applied on the output of resize_pipeline().
 
     Returns:
     scale_down_transform (A.Compose): An Albumentations Compose object containing the scale down transform pipeline.
@@ -23,8 +31,7 @@ def scale_down_pipeline():
     """
     
     # Scale Down Pipeline to make People Smaller
-    scale_down_transform = A.Compose([
-        A.Resize(height=360, width=640),
+    scale_down_transform = A.Compose(_resize_prefix(include_resize) + [
         A.ShiftScaleRotate(scale_limit=(-0.1, -0.05), rotate_limit=5, p=1)
     ], 
     bbox_params=A.BboxParams(format='pascal_voc'), 
@@ -47,10 +54,11 @@ def resize_pipeline():
     - A.Resize(height=512, width=512): Resizes the image to a fixed size of 512x512 pixels.
 
     The bbox_params and keypoint_params are set to handle bounding boxes and keypoints in the Pascal VOC format.
+    Every other pipeline starts with the same resize, so this pipeline is also the shared prefix of all of them.
     """
 
     resize_transform = A.Compose([
-        A.Resize(height=360, width=640)
+        A.Resize(height=RESIZE_SIZE[0], width=RESIZE_SIZE[1])
     ], 
     bbox_params=A.BboxParams(format='pascal_voc'), 
     keypoint_params=A.KeypointParams(format='xy', label_fields=['class_labels'], remove_invisible=False)
@@ -58,13 +66,14 @@ def resize_pipeline():
     return resize_transform
 
 
-def horizontal_flip_pipeline():
+def horizontal_flip_pipeline(include_resize=True):
     """
     This function creates a horizontal flip transform pipeline.
     The pipeline is designed to make people mirrored in images.
 
     Parameters:
-    None
+    include_resize (bool): Whether the pipeline starts with the shared A.Resize(height=360, width=640) step.
+      Pass False to get only the transform-specific tail, to be applied on the output of resize_pipeline().
 
     Returns:
     horizontal_flip_transform (A.Compose): An Albumentations Compose object containing the horizontal flip transform pipeline.
@@ -75,8 +84,7 @@ def horizontal_flip_pipeline():
     The bbox_params and keypoint_params are set to handle bounding boxes and keypoints in the Pascal VOC format.
     """
     
-    horizontal_flip_transform = A.Compose([
-        A.Resize(height=360, width=640),
+    horizontal_flip_transform = A.Compose(_resize_prefix(include_resize) + [
         A.HorizontalFlip(p=1)
     ],
     bbox_params=A.BboxParams(format='pascal_voc'), 
@@ -85,13 +93,14 @@ def horizontal_flip_pipeline():
     return horizontal_flip_transform
 
 
-def shift_scale_rotate_pipeline():
+def shift_scale_rotate_pipeline(include_resize=True):
     """
     This function creates a shifting and scale a little bit transform pipeline.
     The pipeline is designed for Scale Up to make People Bigger and Shift people Slightly
 
     Parameters:
-    None
+    include_resize (bool): Whether the pipeline starts with the shared A.Resize(height=360, width=640) step.
+      Pass False to get only the transform-specific tail, to be applied on the output of resize_pipeline().
 
     Returns:
     horizontal_flip_transform (A.Compose): An Albumentations Compose object containing the horizontal flip transform pipeline.
@@ -102,8 +111,7 @@ def shift_scale_rotate_pipeline():
     The bbox_params and keypoint_params are set to handle bounding boxes and keypoints in the Pascal VOC format.
     """
 
-    shift_scale_rotate_transform = A.Compose([
-        A.Resize(height=360, width=640),
+    shift_scale_rotate_transform = A.Compose(_resize_prefix(include_resize) + [
         A.ShiftScaleRotate(shift_limit=0.05, scale_limit=0.1, rotate_limit=5, p=1)
     ], 
     bbox_params=A.BboxParams(format='pascal_voc'), 
@@ -112,13 +120,14 @@ def shift_scale_rotate_pipeline():
     return shift_scale_rotate_transform
 
 
-def shift_scale_rotate_negative_pipeline():
+def shift_scale_rotate_negative_pipeline(include_resize=True):
     """
     This function creates a negative shifting and scale a little bit transform pipeline.
     The pipeline is designed for Scale Up to make People Bigger and Shift people Slightly
 
     Parameters:
-    None
+    include_resize (bool): Whether the pipeline starts with the shared A.Resize(height=360, width=640) step.
+      Pass False to get only the transform-specific tail, to be applied on the output of resize_pipeline().
 
     Returns:
     horizontal_flip_transform (A.Compose): An Albumentations Compose object containing the horizontal flip transform pipeline.
@@ -129,11 +138,35 @@ def shift_scale_rotate_negative_pipeline():
     The bbox_params and keypoint_params are set to handle bounding boxes and keypoints in the Pascal VOC format.
     """
 
-    shift_scale_rotate_transform = A.Compose([
-        A.Resize(height=360, width=640),
+    shift_scale_rotate_transform = A.Compose(_resize_prefix(include_resize) + [
         A.ShiftScaleRotate(shift_limit=0.05, scale_limit=0.1, rotate_limit=-5, p=1)
     ], 
     bbox_params=A.BboxParams(format='pascal_voc'), 
     keypoint_params=A.KeypointParams(format='xy', label_fields=['class_labels'], remove_invisible=False)
     )
-    return shift_scale_rotate_transform
\ No newline at end of file
+    return shift_scale_rotate_transform
+
+
+def get_augmentation_pipelines(include_resize=True):
+    """
+    This function creates every augmentation pipeline used to build the augmented dataset.
+
+    Parameters:
+    include_resize (bool): Whether the pipelines start with the shared resize step. With False, only the
+      transform-specific tails are returned and "resize" maps to None, meaning the output of
+      resize_pipeline() is used as is.
+
+    Returns:
+    pipelines (dict): A dictionary mapping each augmentation type name to its A.Compose pipeline.
+
+    The keys match the augmentation type names used in the augmented file names, e.g. "horizontal_flip"
+    produces "<image>_horizontal_flip_augmented.jpg". Every call builds fresh pipeline objects, so each
+    worker process can own its own copies.
+    """
+    return {
+        "horizontal_flip": horizontal_flip_pipeline(include_resize),
+        "scale_down": scale_down_pipeline(include_resize),
+        "shift_scale_rotate": shift_scale_rotate_pipeline(include_resize),
+        "shift_scale_rotate_negative": shift_scale_rotate_negative_pipeline(include_resize),
+        "resize": resize_pipeline() if include_resize else None,
+    }
@@ -1,7 +1,9 @@
 import json
-import copy
 import os
+import random
+import zlib
 import cv2
+import numpy as np
 from dataset_utils import get_information_of_dataset
 # from training_utils import write_proccess_to_log
 
@@ -40,7 +42,6 @@ def convert_data_for_augmentation(json_path):
     json.JSONDecodeError: If the JSON file contains invalid data.
     """
     annotation = read_annotation(json_path)
-    copy_of_annotations = copy.deepcopy(annotation)
     # proccesed_image_file_name = copy_of_annotations['images'][0]['file_name']
     _, bbox_data, keypoints_data, categories, class_name = get_information_of_dataset(annotation)
     
@@ -127,13 +128,16 @@ def create_new_augmented_dataset(annotation, augmented):
     Returns:
     dict: The new augmented annotation data.
 
-    This function creates a deep copy of the original annotation data, modifies the keypoints and bounding box
-    information based on the augmented data, and returns the new annotation data.
+    This function copies only the parts of the original annotation data that change (the top-level dict, the
+    first annotation and its keypoint list), modifies the keypoints and bounding box information based on the
+    augmented data, and returns the new annotation data. The original annotation is left untouched, so it can
+    be shared by all augmentation types of an image without a deep copy per type.
     """
-    copy_of_annotations = copy.deepcopy(annotation)
+    copy_of_annotations = dict(annotation)
+    copy_of_annotations['annotations'] = [dict(annotation['annotations'][0])] + annotation['annotations'][1:]
     # proccesed_image_file_name = copy_of_annotations['images'][0]['file_name']
 
-    modified_keypoint = copy_of_annotations['annotations'][0]['keypoints']
+    modified_keypoint = list(copy_of_annotations['annotations'][0]['keypoints'])
     for i in range(len(augmented['keypoints'])):
         modified_keypoint[i * 3] = int(augmented['keypoints'][i][0])
         modified_keypoint[i * 3 + 1] = int(augmented['keypoints'][i][1])
@@ -171,4 +175,50 @@ def get_array_for_augmented():
     Returns:
     tuple: A tuple containing three empty lists. The first list is for bounding image, the second list is for bbox data, and the third list is for keypoint data.
     """
-    return([],[],[])
\ No newline at end of file
+    return([],[],[])
+
+
+def augment_from_shared_prefix(resized, tail_pipeline, class_labels):
+    """
+    Apply the transform-specific tail of an augmentation pipeline to the output of the shared resize prefix.
+
+    Parameters:
+    resized (dict): The output of resize_pipeline() for the source image, with 'image', 'bboxes' and 'keypoints'.
+    tail_pipeline (A.Compose or None): The tail pipeline, see get_augmentation_pipelines(include_resize=False).
+      None means the resized output is the augmented output, as for the "resize" augmentation type.
+    class_labels (list): The keypoint class labels.
+
+    Returns:
+    dict: The augmented data, in the same format as returned by an albumentations pipeline.
+
+    Decoding, color conversion, resizing and annotation conversion are done once per image, and only the
+    tails are run per augmentation type.
+    """
+    if tail_pipeline is None:
+        return resized
+    return tail_pipeline(image=resized['image'], bboxes=resized['bboxes'], keypoints=resized['keypoints'], class_labels=class_labels)
+
+
+def seed_augmentation(pipeline, json_file, augmentation_type, base_seed=0):
+    """
+    Seed the random number generators used by an augmentation pipeline for one source file.
+
+    Parameters:
+    pipeline (A.Compose): The pipeline that is about to be applied.
+    json_file (str): The original JSON file name of the source image.
+    augmentation_type (str): The type of augmentation that is about to be applied.
+    base_seed (int): A run-wide seed that is mixed into every per-file seed.
+
+    Returns:
+    int: The seed that was applied.
+
+    The seed only depends on the base seed, the file name and the augmentation type, so a given source
+    file always gets the same augmented outputs, regardless of the processing order or the number of
+    worker processes.
+    """
+    seed = zlib.crc32("{}:{}:{}".format(base_seed, json_file, augmentation_type).encode("utf-8"))
+    random.seed(seed)
+    np.random.seed(seed)
+    if hasattr(pipeline, "set_random_seed"):
+        pipeline.set_random_seed(seed)
+    return seed
@@ -0,0 +1,103 @@
+import queue
+import threading
+from augmentation_utils import write_augmented_data_to_json, write_augmented_image_to_file
+
+
+class AugmentationWriter:
+    """
+    Write augmented images and annotations from a pool of background threads.
+
+    Parameters:
+    num_threads (int): The number of writer threads. With 0, every submitted output is written synchronously by submit.
+    max_pending (int): The maximum number of outputs waiting to be written. submit blocks when the queue is full,
+      so the memory held by pending images stays bounded whatever the dataset size.
+
+    cv2.imwrite and json.dump release the GIL for most of their work, so image encoding and file I/O run
+    concurrently with the augmentation of the next images. Failures are collected instead of raised, see pop_failed.
+
+    Usage:
+    with AugmentationWriter(num_threads=4) as writer:
+        writer.submit(json_output_filename, new_augmented_json_data, image_output_filename, augmented)
+    """
+
+    def __init__(self, num_threads=4, max_pending=32):
+        self.num_threads = num_threads
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.failed = []
+        self._failed_lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(num_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, json_output_filename, new_augmented_json_data, image_output_filename, augmented):
+        """
+        Schedule one augmented output for writing.
+
+        Parameters:
+        json_output_filename (str): The path where the augmented JSON data will be saved.
+        new_augmented_json_data (dict): The augmented annotation data, see create_new_augmented_dataset.
+        image_output_filename (str): The path where the augmented image will be saved.
+        augmented (dict): The augmented data. Only the 'image' key is used.
+
+        Returns:
+        None
+        """
+        item = (json_output_filename, new_augmented_json_data, image_output_filename, {'image': augmented['image']})
+        if self.num_threads == 0:
+            self._write(item)
+        else:
+            self.queue.put(item)
+
+    def flush(self):
+        """
+        Block until every submitted output has been written.
+        """
+        if self.num_threads > 0:
+            self.queue.join()
+
+    def pop_failed(self):
+        """
+        Return the outputs that could not be written so far and clear them.
+
+        Returns:
+        list: A list of (json_output_filename, image_output_filename) tuples, one per failed output.
+        """
+        with self._failed_lock:
+            failed, self.failed = self.failed, []
+        return failed
+
+    def close(self):
+        """
+        Write the pending outputs and stop the writer threads.
+        """
+        self.flush()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(item)
+            finally:
+                self.queue.task_done()
+
+    def _write(self, item):
+        json_output_filename, new_augmented_json_data, image_output_filename, augmented = item
+        try:
+            write_augmented_data_to_json(json_output_filename, new_augmented_json_data)
+            write_augmented_image_to_file(image_output_filename, augmented)
+        except Exception:
+            with self._failed_lock:
+                self.failed.append((json_output_filename, image_output_filename))
@@ -0,0 +1,544 @@
+"""Offline CPU benchmarks of the data, training and inference paths.
+
+Times the albumentations pipelines, the per-sample train transforms of presets.py (and their batched
+variants), the collate functions, __getitem__ of the per-image JSON dataset of the training notebook and of
+ShardDataset, the DataLoader over several worker counts, train_one_epoch on a tiny Keypoint R-CNN, and end-to-end
+RollerPredictor inference. The frames are nhk_test.jpg (or synthetic frames if it is missing), so no dataset is
+needed. Run it from the repository root:
+
+    python -m lib.benchmark --output benchmark.json --save-baseline
+    # after a change
+    python -m lib.benchmark --output benchmark.json --baseline benchmark_baseline.json
+
+Every result is stored with its unit and whether higher is better, and the comparison flags the results
+that are worse than the baseline by more than --tolerance (relative). Baselines are only comparable on the
+same machine and thread count, which are recorded in the output.
+"""
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.utils.data
+from PIL import Image
+from torch import nn
+from torchvision.transforms import functional as F
+from torchvision.models.detection import KeypointRCNN
+from torchvision.models.detection.anchor_utils import AnchorGenerator
+from torchvision.models.detection.faster_rcnn import FastRCNNPredictor, TwoMLPHead
+from torchvision.models.detection.keypoint_rcnn import KeypointRCNNHeads, KeypointRCNNPredictor
+from torchvision.ops import MultiScaleRoIAlign
+
+import lib.utils as utils
+from lib.augmentation_pipeline import get_augmentation_pipelines
+from lib.engine import train_one_epoch
+from lib.predictor import RollerPredictor
+from lib.shard_dataset import ShardDataset, pack_roller_shards
+from lib.transforms import collate_uint8_batch
+
+BENCHMARK_VERSION = 2
+BENCHMARKS = ["augmentation", "transforms", "collate", "dataset", "data_loader", "train", "inference"]
+POLICIES = ["hflip", "ssd", "ssdlite"]
+DEFAULT_IMAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nhk_test.jpg")
+
+
+def _result(value, unit, higher_is_better):
+    return {"value": float(value), "unit": unit, "higher_is_better": higher_is_better}
+
+
+def _latency_results(prefix, seconds):
+    milliseconds = np.asarray(seconds) * 1000
+    results = {f"{prefix}/latency_mean_ms": _result(milliseconds.mean(), "ms", False)}
+    for q in (50, 95, 99):
+        results[f"{prefix}/latency_p{q}_ms"] = _result(np.percentile(milliseconds, q), "ms", False)
+    return results
+
+
+def _synthetic_frame(rng, height, width):
+    # Smooth random colors compress like a photo, unlike per-pixel noise
+    coarse = rng.integers(0, 256, size=(max(height // 16, 1), max(width // 16, 1), 3), dtype=np.uint8)
+    return cv2.resize(coarse, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+def load_frames(image_path, num_frames, height, width, seed=0):
+    """
+    Returns num_frames RGB uint8 frames of size (height, width): random crops of image_path, or synthetic frames
+    if image_path is None or missing.
+    """
+    rng = np.random.default_rng(seed)
+    image = cv2.imread(image_path) if image_path and os.path.exists(image_path) else None
+    if image is None:
+        return [_synthetic_frame(rng, height, width) for _ in range(num_frames)]
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    frames = []
+    for _ in range(num_frames):
+        # Crops of 80-100% of the image keep the content realistic while the frames differ
+        scale = rng.uniform(0.8, 1.0)
+        crop_h, crop_w = int(image.shape[0] * scale), int(image.shape[1] * scale)
+        y0 = rng.integers(0, image.shape[0] - crop_h + 1)
+        x0 = rng.integers(0, image.shape[1] - crop_w + 1)
+        crop = image[y0 : y0 + crop_h, x0 : x0 + crop_w]
+        frames.append(cv2.resize(crop, (width, height), interpolation=cv2.INTER_AREA))
+    return frames
+
+
+def _synthetic_annotation(rng, height, width, num_keypoints):
+    box_w, box_h = rng.uniform(0.1, 0.4) * width, rng.uniform(0.1, 0.4) * height
+    x0, y0 = rng.uniform(0, width - box_w), rng.uniform(0, height - box_h)
+    xs = rng.uniform(x0, x0 + box_w, num_keypoints)
+    ys = rng.uniform(y0, y0 + box_h, num_keypoints)
+    keypoints = np.stack([xs, ys, np.full(num_keypoints, 2.0)], axis=1)
+    return [x0, y0, x0 + box_w, y0 + box_h], keypoints
+
+
+def write_samples(frames, img_dir, annot_dir, num_keypoints=1, seed=0):
+    """
+    Writes frames as JPEG images with one random box and keypoints each, in the per-image JSON format of the
+    roller dataset (xyxy bbox, flat keypoints, category_id).
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(img_dir, exist_ok=True)
+    os.makedirs(annot_dir, exist_ok=True)
+    for i, frame in enumerate(frames):
+        name = f"{i:06d}"
+        cv2.imwrite(os.path.join(img_dir, name + ".jpg"), cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+        box, keypoints = _synthetic_annotation(rng, frame.shape[0], frame.shape[1], num_keypoints)
+        annotation = {
+            "images": [{"file_name": name + ".jpg", "height": frame.shape[0], "width": frame.shape[1]}],
+            "annotations": [{"bbox": box, "keypoints": keypoints.reshape(-1).tolist(), "category_id": 1}],
+            "category_ids": [1],
+        }
+        with open(os.path.join(annot_dir, name + ".json"), "w") as f:
+            json.dump(annotation, f)
+
+
+class JsonImageDataset(torch.utils.data.Dataset):
+    """
+    The per-image JSON dataset of the training notebook (CustomDataset without an AnnotationIndex): every
+    sample decodes its image with cv2 and parses its JSON annotation. The notebook class cannot be imported,
+    so this copy of its __getitem__ keeps the benchmark on the path the notebook trains with.
+    """
+
+    def __init__(self, img_dir, annot_dir):
+        self.img_dir = img_dir
+        self.annot_dir = annot_dir
+        self.image_files = sorted(f for f in os.listdir(img_dir) if f.endswith(".jpg") or f.endswith(".png"))
+        self.annotation_files = [f.replace(".jpg", ".json").replace(".png", ".json") for f in self.image_files]
+
+    def __len__(self):
+        return len(self.image_files)
+
+    def __getitem__(self, idx):
+        img = cv2.imread(os.path.join(self.img_dir, self.image_files[idx]))
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        with open(os.path.join(self.annot_dir, self.annotation_files[idx]), "r") as f:
+            annotations = json.load(f)["annotations"]
+        boxes = torch.as_tensor([annotations[0]["bbox"]], dtype=torch.float32)
+        keypoints = annotations[0]["keypoints"]
+        target = {
+            "boxes": boxes,
+            "labels": torch.tensor([1], dtype=torch.int64),
+            "image_id": torch.tensor([idx]),
+            "area": (boxes[:, 3] - boxes[:, 1]) * (boxes[:, 2] - boxes[:, 0]),
+            "iscrowd": torch.zeros(len(boxes), dtype=torch.int64),
+            "keypoints": torch.as_tensor(
+                [[keypoints[i : i + 3] for i in range(0, len(keypoints), 3)]], dtype=torch.float32
+            ),
+            "category": torch.as_tensor(annotations[0]["category_id"], dtype=torch.float32),
+        }
+        return F.to_tensor(img), target
+
+
+def _load_presets():
+    # presets.py imports transforms as a top-level module, as train.py runs from lib
+    lib_dir = os.path.dirname(os.path.abspath(__file__))
+    if lib_dir not in sys.path:
+        sys.path.append(lib_dir)
+    import presets
+
+    return presets
+
+
+def create_tiny_model(num_keypoints=1, min_size=360, max_size=640):
+    """
+    Returns a Keypoint R-CNN with a 4-layer backbone and small heads, which trains at a few steps per second on
+    a CPU. It exercises the same torchvision code paths as the real model at a fraction of the cost.
+    """
+    backbone = nn.Sequential(
+        nn.Conv2d(3, 16, 3, stride=2, padding=1),
+        nn.ReLU(inplace=True),
+        nn.Conv2d(16, 32, 3, stride=2, padding=1),
+        nn.ReLU(inplace=True),
+        nn.Conv2d(32, 32, 3, stride=2, padding=1),
+        nn.ReLU(inplace=True),
+        nn.Conv2d(32, 32, 3, stride=2, padding=1),
+        nn.ReLU(inplace=True),
+    )
+    backbone.out_channels = 32
+    return KeypointRCNN(
+        backbone,
+        min_size=min_size,
+        max_size=max_size,
+        rpn_anchor_generator=AnchorGenerator(sizes=((32, 64, 128),), aspect_ratios=((0.5, 1.0, 2.0),)),
+        rpn_pre_nms_top_n_train=200,
+        rpn_post_nms_top_n_train=100,
+        rpn_pre_nms_top_n_test=100,
+        rpn_post_nms_top_n_test=50,
+        box_roi_pool=MultiScaleRoIAlign(["0"], 7, 2),
+        box_head=TwoMLPHead(32 * 7 * 7, 128),
+        box_predictor=FastRCNNPredictor(128, 2),
+        box_batch_size_per_image=64,
+        keypoint_roi_pool=MultiScaleRoIAlign(["0"], 14, 2),
+        keypoint_head=KeypointRCNNHeads(32, (64, 64)),
+        keypoint_predictor=KeypointRCNNPredictor(64, num_keypoints),
+    )
+
+
+def bench_augmentation(frames, num_keypoints=1, seed=0):
+    """
+    Times every augmentation pipeline (with its resize) per source frame.
+    """
+    rng = np.random.default_rng(seed)
+    class_labels = ["keypoint"] * num_keypoints
+    samples = []
+    for frame in frames:
+        box, keypoints = _synthetic_annotation(rng, frame.shape[0], frame.shape[1], num_keypoints)
+        samples.append((frame, [[int(v) for v in box] + ["roller"]], [tuple(k) for k in keypoints[:, :2].tolist()]))
+
+    results = {}
+    for name, pipeline in get_augmentation_pipelines().items():
+        # albumentations draws its parameters from the global generators
+        random.seed(seed)
+        np.random.seed(seed)
+        pipeline(image=samples[0][0], bboxes=samples[0][1], keypoints=samples[0][2], class_labels=class_labels)
+        start = time.perf_counter()
+        for image, bboxes, keypoints in samples:
+            pipeline(image=image, bboxes=bboxes, keypoints=keypoints, class_labels=class_labels)
+        elapsed = time.perf_counter() - start
+        results[f"augmentation/{name}_ms_per_image"] = _result(elapsed * 1000 / len(samples), "ms", False)
+    return results
+
+
+def _transform_samples(frames, num_keypoints, seed):
+    # (PIL image, target) pairs as the COCO datasets of train.py produce them, with a box, keypoints and a mask
+    rng = np.random.default_rng(seed)
+    samples = []
+    for frame in frames:
+        height, width = frame.shape[:2]
+        box, keypoints = _synthetic_annotation(rng, height, width, num_keypoints)
+        mask = np.zeros((height, width), dtype=np.uint8)
+        mask[int(box[1]) : int(box[3]), int(box[0]) : int(box[2])] = 1
+        target = {
+            "boxes": torch.tensor([box], dtype=torch.float32),
+            "labels": torch.tensor([1], dtype=torch.int64),
+            "keypoints": torch.tensor(keypoints[None], dtype=torch.float32),
+            "masks": torch.from_numpy(mask)[None],
+        }
+        samples.append((Image.fromarray(frame), target))
+    return samples
+
+
+def _copy_samples(samples):
+    # the transforms update the targets in place
+    return [(image, {k: v.clone() for k, v in target.items()}) for image, target in samples]
+
+
+def bench_transforms(frames, policies=POLICIES, batch_size=2, num_keypoints=17, seed=0):
+    """
+    Times the train transforms of presets.DetectionPresetTrain per image, for every data augmentation policy,
+    per sample as in the data loader workers and batched (the per-sample part, collate_uint8_batch and the batch
+    transforms on the CPU). The horizontal flip swaps the COCO person keypoints, hence 17 keypoints.
+    """
+    presets = _load_presets()
+    samples = _transform_samples(frames, num_keypoints, seed)
+    results = {}
+    for policy in policies:
+        preset = presets.DetectionPresetTrain(policy)
+        torch.manual_seed(seed)
+        copies = _copy_samples(samples)
+        preset(*copies[0])
+        start = time.perf_counter()
+        for image, target in copies[1:]:
+            preset(image, target)
+        elapsed = time.perf_counter() - start
+        results[f"transforms/{policy}_ms_per_image"] = _result(elapsed * 1000 / (len(copies) - 1), "ms", False)
+
+        preset = presets.DetectionPresetTrain(policy, batched=True)
+        torch.manual_seed(seed)
+        copies = _copy_samples(samples)
+        start = time.perf_counter()
+        for i in range(0, len(copies), batch_size):
+            batch = [preset(image, target) for image, target in copies[i : i + batch_size]]
+            (images, image_sizes), targets = collate_uint8_batch(batch)
+            preset.batch_transform(images, list(targets), image_sizes)
+        elapsed = time.perf_counter() - start
+        results[f"transforms/{policy}_batched_ms_per_image"] = _result(elapsed * 1000 / len(copies), "ms", False)
+    return results
+
+
+def bench_collate(frames, batch_size=2, repeats=20):
+    """
+    Times utils.collate_fn and transforms.collate_uint8_batch on batches of uint8 frames.
+    """
+    samples = [
+        (torch.from_numpy(frame).permute(2, 0, 1).contiguous(), {"boxes": torch.zeros((1, 4))}) for frame in frames
+    ]
+    batches = [samples[i : i + batch_size] for i in range(0, len(samples), batch_size)]
+    results = {}
+    for name, collate in (("collate_fn", utils.collate_fn), ("uint8_batch", collate_uint8_batch)):
+        collate(batches[0])
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for batch in batches:
+                collate(batch)
+        elapsed = time.perf_counter() - start
+        results[f"collate/{name}_us_per_batch"] = _result(elapsed * 1e6 / (repeats * len(batches)), "us", False)
+    return results
+
+
+def bench_dataset(dataset, name, passes=2):
+    """
+    Times dataset.__getitem__ over the whole dataset.
+    """
+    dataset[0]
+    start = time.perf_counter()
+    for _ in range(passes):
+        for idx in range(len(dataset)):
+            dataset[idx]
+    elapsed = time.perf_counter() - start
+    return {f"dataset/{name}_getitem_per_second": _result(passes * len(dataset) / elapsed, "images/s", True)}
+
+
+def bench_data_loader(dataset, name, worker_counts, batch_size=2):
+    """
+    Times one pass of a DataLoader over dataset for every number of workers. The startup of the workers is
+    excluded: the timing starts at the first batch.
+    """
+    results = {}
+    for num_workers in worker_counts:
+        data_loader = torch.utils.data.DataLoader(
+            dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers, collate_fn=utils.collate_fn
+        )
+        iterator = iter(data_loader)
+        next(iterator)
+        count = 0
+        start = time.perf_counter()
+        for images, _ in iterator:
+            count += len(images)
+        elapsed = time.perf_counter() - start
+        results[f"data_loader/{name}_workers_{num_workers}_per_second"] = _result(
+            count / elapsed if elapsed > 0 else 0.0, "images/s", True
+        )
+    return results
+
+
+def bench_train(dataset, steps, batch_size=2, num_keypoints=1, seed=0):
+    """
+    Times train_one_epoch on the tiny model. The first epoch (with the learning rate warmup) is a warmup run
+    of a few steps, the timed epoch has steps iterations.
+    """
+    torch.manual_seed(seed)
+    device = torch.device("cpu")
+    model = create_tiny_model(num_keypoints)
+    params = [p for p in model.parameters() if p.requires_grad]
+    optimizer = torch.optim.SGD(params, lr=0.001, momentum=0.9, weight_decay=1e-4)
+
+    def loader(num_steps):
+        indices = [i % len(dataset) for i in range(num_steps * batch_size)]
+        subset = torch.utils.data.Subset(dataset, indices)
+        return torch.utils.data.DataLoader(subset, batch_size=batch_size, shuffle=False, collate_fn=utils.collate_fn)
+
+    print_freq = steps + 1
+    train_one_epoch(model, optimizer, loader(min(steps, 3)), device, 0, print_freq)
+    start = time.perf_counter()
+    train_one_epoch(model, optimizer, loader(steps), device, 1, print_freq)
+    elapsed = time.perf_counter() - start
+    return {"train/steps_per_second": _result(steps / elapsed, "steps/s", True)}
+
+
+def bench_inference(model, frames, warmup=2):
+    """
+    Times end-to-end RollerPredictor inference (decoding, forward and top-1 selection) one frame at a time.
+    """
+    predictor = RollerPredictor(model, torch.device("cpu"), batch_size=1, num_workers=1)
+    predictor.predict(frames[:warmup])
+    seconds = []
+    start = time.perf_counter()
+    last = start
+    for _ in predictor.predict_batches(frames):
+        now = time.perf_counter()
+        seconds.append(now - last)
+        last = now
+    elapsed = last - start
+    results = {"inference/images_per_second": _result(len(frames) / elapsed, "images/s", True)}
+    results.update(_latency_results("inference", seconds))
+    return results
+
+
+def compare_results(results, baseline, tolerance=0.1):
+    """
+    Compares results to baseline (both as in the "results" of the output file).
+
+    Returns one dict per result present in both: name, value, baseline, relative change (positive is better)
+    and whether it is a regression, i.e. worse than the baseline by more than tolerance.
+    """
+    rows = []
+    for name, result in results.items():
+        if name not in baseline or not baseline[name]["value"]:
+            continue
+        change = result["value"] / baseline[name]["value"] - 1
+        if not result["higher_is_better"]:
+            change = -change
+        rows.append(
+            {
+                "name": name,
+                "value": result["value"],
+                "baseline": baseline[name]["value"],
+                "change": change,
+                "regression": change < -tolerance,
+            }
+        )
+    return rows
+
+
+def run_benchmarks(args):
+    """
+    Runs the selected benchmarks and returns the content of the output file.
+    """
+    torch.manual_seed(args.seed)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    frames = load_frames(args.image, args.num_images, args.height, args.width, args.seed)
+    results = {}
+
+    if "augmentation" in args.only:
+        source_frames = load_frames(args.image, args.num_images, args.source_height, args.source_width, args.seed)
+        results.update(bench_augmentation(source_frames, args.num_keypoints, args.seed))
+
+    if "transforms" in args.only:
+        results.update(bench_transforms(frames, args.policies, args.batch_size, seed=args.seed))
+
+    if "collate" in args.only:
+        results.update(bench_collate(frames, args.batch_size))
+
+    if {"dataset", "data_loader", "train"} & set(args.only):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            img_dir, annot_dir = os.path.join(tmp_dir, "images"), os.path.join(tmp_dir, "annotations")
+            shard_dir = os.path.join(tmp_dir, "shards")
+            write_samples(frames, img_dir, annot_dir, args.num_keypoints, args.seed)
+            pack_roller_shards(img_dir, annot_dir, shard_dir, height=args.height, width=args.width)
+            datasets = {"json": JsonImageDataset(img_dir, annot_dir), "shard": ShardDataset(shard_dir)}
+            for name, dataset in datasets.items():
+                if "dataset" in args.only:
+                    results.update(bench_dataset(dataset, name))
+                if "data_loader" in args.only:
+                    results.update(bench_data_loader(dataset, name, args.workers, args.batch_size))
+            dataset = datasets.pop("shard")
+            if "train" in args.only:
+                results.update(bench_train(dataset, args.train_steps, args.batch_size, args.num_keypoints, args.seed))
+            del dataset
+
+    if "inference" in args.only:
+        if args.model_path:
+            model = torch.load(args.model_path, map_location="cpu")
+        else:
+            torch.manual_seed(args.seed)
+            model = create_tiny_model(args.num_keypoints, args.height, args.width)
+        results.update(bench_inference(model, frames[: args.inference_frames]))
+
+    return {
+        "version": BENCHMARK_VERSION,
+        "time": time.time(),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "threads": torch.get_num_threads(),
+        },
+        "config": {
+            "image": args.image if args.image and os.path.exists(args.image) else None,
+            "num_images": args.num_images,
+            "size": [args.height, args.width],
+            "batch_size": args.batch_size,
+            "policies": args.policies,
+            "train_steps": args.train_steps,
+            "model_path": args.model_path,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def get_args_parser(add_help=True):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline CPU benchmarks", add_help=add_help)
+    parser.add_argument("--output", default="benchmark.json", type=str, help="result file (default: benchmark.json)")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", type=str, help="baseline result file")
+    parser.add_argument("--save-baseline", action="store_true", help="also write the results to --baseline")
+    parser.add_argument(
+        "--tolerance", default=0.1, type=float, help="relative slowdown reported as a regression (default: 0.1)"
+    )
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on a regression")
+    parser.add_argument("--only", default=BENCHMARKS, nargs="+", choices=BENCHMARKS, help="benchmarks to run")
+    parser.add_argument(
+        "--image", default=DEFAULT_IMAGE, type=str, help="source image of the frames, synthetic frames if missing"
+    )
+    parser.add_argument("--num-images", default=32, type=int, help="number of frames (default: 32)")
+    parser.add_argument("--height", default=360, type=int, help="dataset and inference frame height (default: 360)")
+    parser.add_argument("--width", default=640, type=int, help="dataset and inference frame width (default: 640)")
+    parser.add_argument("--source-height", default=1080, type=int, help="augmentation source height (default: 1080)")
+    parser.add_argument("--source-width", default=1920, type=int, help="augmentation source width (default: 1920)")
+    parser.add_argument("--num-keypoints", default=1, type=int, help="keypoints per object (default: 1)")
+    parser.add_argument("--policies", default=POLICIES, nargs="+", choices=POLICIES, help="presets.py policies")
+    parser.add_argument("--workers", default=[0, 1, 2, 4], nargs="+", type=int, help="DataLoader worker counts")
+    parser.add_argument("-b", "--batch-size", default=2, type=int, help="images per batch (default: 2)")
+    parser.add_argument("--train-steps", default=10, type=int, help="timed training steps (default: 10)")
+    parser.add_argument("--inference-frames", default=20, type=int, help="timed inference frames (default: 20)")
+    parser.add_argument(
+        "--model-path", default=None, type=str, help="model saved with torch.save(model) for inference (default: tiny)"
+    )
+    parser.add_argument("--threads", default=0, type=int, help="torch intra-op threads (default: torch default)")
+    parser.add_argument("--seed", default=0, type=int, help="random seed (default: 0)")
+    return parser
+
+
+def main(args):
+    output = run_benchmarks(args)
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(output, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    elif args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline["environment"] != output["environment"]:
+            print("Warning: the baseline was recorded in another environment:", baseline["environment"])
+        rows = compare_results(output["results"], baseline["results"], args.tolerance)
+        for row in rows:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"{row['name']:<48} {row['value']:>10.3f} {row['baseline']:>10.3f} {row['change']:>+8.1%}{flag}")
+        regressions = [row["name"] for row in rows if row["regression"]]
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+    else:
+        for name, result in output["results"].items():
+            print(f"{name:<48} {result['value']:>10.3f} {result['unit']}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(get_args_parser().parse_args())
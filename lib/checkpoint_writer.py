@@ -0,0 +1,370 @@
+import contextlib
+import os
+import queue
+import re
+import shutil
+import signal
+import sys
+import threading
+import time
+import traceback
+
+import torch
+import torch.distributed as dist
+
+CHECKPOINT_FILE_NAME = "checkpoint.pth"
+_EPOCH_FILE_PATTERN = re.compile(r"^model_(\d+)\.pth$")
+
+
+def snapshot_to_cpu(obj):
+    """
+    Returns a copy of a (nested) state dict whose tensors are detached CPU copies, which can be serialized
+    from another thread while training keeps updating the original tensors.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        copied = type(obj)((k, snapshot_to_cpu(v)) for k, v in obj.items())
+        # Module.state_dict keeps the module versions there, load_state_dict needs them
+        if hasattr(obj, "_metadata"):
+            copied._metadata = obj._metadata
+        return copied
+    if isinstance(obj, list):
+        return [snapshot_to_cpu(v) for v in obj]
+    if isinstance(obj, tuple):
+        return tuple(snapshot_to_cpu(v) for v in obj)
+    return obj
+
+
+class CheckpointWriter:
+    """
+    Writes the training checkpoints from a background thread and bounds the number of kept files.
+
+    Every checkpoint is snapshotted to CPU memory, then serialized once to model_{epoch}.pth by the writer
+    thread. checkpoint.pth is atomically replaced by a hardlink to that file (a copy on filesystems without
+    hardlinks), so it always holds a complete checkpoint of the latest epoch. A failed write is printed by the
+    writer thread, and raised as a RuntimeError by the next save, save_latest or flush.
+
+    Args:
+        output_dir (str): The directory of the checkpoints.
+        keep_last (int): Keep the model_{epoch}.pth files of the last keep_last epochs.
+        keep_best (int): Also keep the keep_best epochs with the highest metric, see set_metric.
+            With keep_last and keep_best both 0, every checkpoint is kept.
+        max_pending (int): The maximum number of snapshots waiting to be written. save blocks when it is
+            reached, so at most max_pending + 1 snapshots are held in memory.
+        enabled (bool): With False, every method does nothing. Use it on the non-master distributed processes.
+
+    Usage:
+        writer = CheckpointWriter(output_dir, keep_last=2, keep_best=1)
+        writer.save(checkpoint, epoch, await_metric=True)
+        writer.set_metric(epoch, ap)
+        writer.close()
+    """
+
+    def __init__(self, output_dir, keep_last=0, keep_best=0, max_pending=1, enabled=True):
+        self.output_dir = output_dir
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.enabled = enabled
+        self.metrics = {}
+        # (epoch, exception) of the checkpoints that could not be written, epoch None for save_latest
+        self.failed = []
+        # epochs kept until their metric is known, e.g. while they are being evaluated
+        self._awaiting = set()
+        self._lock = threading.Lock()
+        self._saved = []
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = None
+        if not enabled:
+            return
+        # the checkpoints of a resumed run are subject to the same policy
+        for name in os.listdir(output_dir):
+            match = _EPOCH_FILE_PATTERN.match(name)
+            if match:
+                self._saved.append(int(match.group(1)))
+        self._saved.sort()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def epoch_path(self, epoch):
+        return os.path.join(self.output_dir, f"model_{epoch}.pth")
+
+    def save(self, state, epoch, await_metric=False):
+        """
+        Snapshots state to CPU and schedules it for writing.
+
+        If await_metric is True, the checkpoint of this epoch is not deleted before set_metric is called for it.
+
+        Raises:
+            RuntimeError: If a previously scheduled checkpoint could not be written.
+        """
+        if not self.enabled:
+            return
+        self._raise_failures()
+        snapshot = snapshot_to_cpu(state)
+        if await_metric:
+            with self._lock:
+                self._awaiting.add(epoch)
+        self.queue.put((epoch, snapshot))
+
+    def save_latest(self, state):
+        """
+        Snapshots state to CPU and schedules it for writing to checkpoint.pth only, e.g. a mid-epoch checkpoint.
+        It does not create a model_{epoch}.pth file and is not subject to the retention policy.
+
+        Raises:
+            RuntimeError: If a previously scheduled checkpoint could not be written.
+        """
+        if not self.enabled:
+            return
+        self._raise_failures()
+        self.queue.put((None, snapshot_to_cpu(state)))
+
+    def set_metric(self, epoch, value):
+        """
+        Records the metric of an epoch (higher is better, None if unknown) and applies the retention policy.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.metrics[epoch] = value
+            self._awaiting.discard(epoch)
+            self._apply_retention()
+
+    def flush(self):
+        """
+        Blocks until every scheduled checkpoint has been written.
+
+        Raises:
+            RuntimeError: If a checkpoint could not be written.
+        """
+        if not self.enabled:
+            return
+        self.queue.join()
+        self._raise_failures()
+
+    def close(self):
+        """
+        Writes the pending checkpoints and stops the writer thread.
+        """
+        if self.thread is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _raise_failures(self):
+        with self._lock:
+            failed, self.failed = self.failed, []
+        if failed:
+            epochs = [epoch for epoch, _ in failed]
+            raise RuntimeError(f"Could not write the checkpoints of epochs {epochs}") from failed[0][1]
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as e:
+                name = CHECKPOINT_FILE_NAME if item[0] is None else os.path.basename(self.epoch_path(item[0]))
+                print(f"Could not write the checkpoint {name}:", file=sys.stderr)
+                traceback.print_exc()
+                with self._lock:
+                    self.failed.append((item[0], e))
+            finally:
+                self.queue.task_done()
+
+    def _write(self, epoch, snapshot):
+        latest_path = os.path.join(self.output_dir, CHECKPOINT_FILE_NAME)
+        if epoch is None:
+            torch.save(snapshot, latest_path + ".tmp")
+            os.replace(latest_path + ".tmp", latest_path)
+            return
+
+        path = self.epoch_path(epoch)
+        tmp_path = path + ".tmp"
+        torch.save(snapshot, tmp_path)
+        os.replace(tmp_path, path)
+
+        tmp_latest_path = latest_path + ".tmp"
+        if os.path.lexists(tmp_latest_path):
+            os.remove(tmp_latest_path)
+        try:
+            os.link(path, tmp_latest_path)
+        except OSError:
+            shutil.copyfile(path, tmp_latest_path)
+        os.replace(tmp_latest_path, latest_path)
+
+        with self._lock:
+            if epoch not in self._saved:
+                self._saved.append(epoch)
+                self._saved.sort()
+            self._apply_retention()
+
+    def _apply_retention(self):
+        if self.keep_last <= 0 and self.keep_best <= 0:
+            return
+        keep = set(self._saved[-self.keep_last :]) if self.keep_last > 0 else set()
+        scored = [epoch for epoch in self._saved if self.metrics.get(epoch) is not None]
+        keep.update(sorted(scored, key=lambda epoch: self.metrics[epoch], reverse=True)[: self.keep_best])
+        keep.update(self._awaiting)
+        for epoch in [epoch for epoch in self._saved if epoch not in keep]:
+            # checkpoint.pth has its own link to the latest checkpoint, so it is not affected
+            if os.path.exists(self.epoch_path(epoch)):
+                os.remove(self.epoch_path(epoch))
+            self._saved.remove(epoch)
+
+
+class StepCheckpointer:
+    """
+    Writes the mid-epoch (step) checkpoints of a training loop on a step or time interval, and on SIGTERM.
+
+    step is called after every optimizer step with a function returning the checkpoint of that step, which is
+    only called when a checkpoint is due. SIGTERM is only handled within deferred_sigterm, around the training
+    loop of an epoch and its epoch checkpoint: the process is not killed, the checkpoint of the next completed
+    step is written, then the process exits with status 128 + SIGTERM. If the loop ends first, the process
+    exits at the end of the context, after writing the queued checkpoints. If the loop raises after SIGTERM
+    (e.g. its DataLoader workers were killed too), the checkpoint of the last completed step is written instead.
+    Outside of the context, e.g. during the evaluations, the previous SIGTERM handler applies.
+
+    Under distributed training, the ranks agree on the stop request with an asynchronous all_reduce started at
+    every optimizer step and read at the next one, so that they all stop at the same step, even if only some of
+    them received SIGTERM, without waiting for the other ranks or the device on every step. At the end of
+    deferred_sigterm, they agree synchronously.
+
+    Args:
+        writer (CheckpointWriter): Writes the checkpoints, see CheckpointWriter.save_latest.
+        every_steps (int): Write a checkpoint every every_steps optimizer steps (0: never).
+        every_seconds (float): Write a checkpoint when every_seconds passed since the last one (0: never).
+        handle_sigterm (bool): Whether deferred_sigterm installs the SIGTERM handler. It must be used from the
+            main thread.
+        device (torch.device): The device of the all_reduce of the stop request under distributed training.
+
+    Usage:
+        step_checkpointer = StepCheckpointer(writer, every_seconds=600)
+        with step_checkpointer.deferred_sigterm():
+            # in the training loop, after optimizer.step()
+            step_checkpointer.step(lambda: {"model": model.state_dict(), ...})
+    """
+
+    def __init__(self, writer, every_steps=0, every_seconds=0, handle_sigterm=True, device=None):
+        self.writer = writer
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.handle_sigterm = handle_sigterm
+        self.device = device
+        self.stop_requested = False
+        self.num_steps = 0
+        self.last_time = time.monotonic()
+        self._last_state_fn = None
+        # (work, host flag, CUDA event) of the all_reduce of the stop request started at the previous step
+        self._pending_stop = None
+
+    def _on_sigterm(self, signum, frame):
+        self.stop_requested = True
+
+    @staticmethod
+    def _is_distributed():
+        return dist.is_available() and dist.is_initialized()
+
+    def _start_stop_agreement(self):
+        flag = torch.tensor([int(self.stop_requested)], device=self.device)
+        work = dist.all_reduce(flag, op=dist.ReduceOp.MAX, async_op=True)
+        if not flag.is_cuda:
+            self._pending_stop = (work, flag, None)
+            return
+        # with NCCL, wait only makes the current stream wait for the all_reduce, and reading the result from
+        # pinned memory after an event does not synchronize the work queued after it
+        work.wait()
+        host_flag = torch.empty_like(flag, device="cpu").pin_memory()
+        host_flag.copy_(flag, non_blocking=True)
+        event = torch.cuda.Event()
+        event.record()
+        self._pending_stop = (None, host_flag, event)
+
+    def _finish_stop_agreement(self):
+        if self._pending_stop is None:
+            return False
+        work, flag, event = self._pending_stop
+        self._pending_stop = None
+        if work is not None:
+            work.wait()
+        if event is not None:
+            event.synchronize()
+        return bool(flag.item())
+
+    def _poll_stop(self):
+        # whether any rank received SIGTERM before the previous step, every rank getting the same answer
+        if not self._is_distributed():
+            return self.stop_requested
+        stop = self._finish_stop_agreement()
+        self._start_stop_agreement()
+        self.stop_requested = self.stop_requested or stop
+        return stop
+
+    def _agree_on_stop(self):
+        # whether any rank received SIGTERM, synchronously
+        if not self._is_distributed():
+            return self.stop_requested
+        self._finish_stop_agreement()
+        self._start_stop_agreement()
+        self.stop_requested = self._finish_stop_agreement()
+        return self.stop_requested
+
+    @contextlib.contextmanager
+    def deferred_sigterm(self):
+        """
+        Defers SIGTERM to the next step or the end of the context, see the class docstring. The previous
+        SIGTERM handler is restored when the context exits.
+        """
+        previous_handler = None
+        if self.handle_sigterm:
+            previous_handler = signal.signal(signal.SIGTERM, self._on_sigterm)
+        try:
+            yield self
+        except Exception:
+            self.handle_interruption()
+            raise
+        finally:
+            if self.handle_sigterm:
+                signal.signal(signal.SIGTERM, previous_handler if previous_handler is not None else signal.SIG_DFL)
+        if self._agree_on_stop():
+            self._exit()
+
+    def step(self, state_fn):
+        """
+        Records an optimizer step, and writes state_fn() if a checkpoint is due or SIGTERM was received.
+        """
+        self.num_steps += 1
+        self._last_state_fn = state_fn
+        now = time.monotonic()
+        due = (self.every_steps > 0 and self.num_steps % self.every_steps == 0) or (
+            self.every_seconds > 0 and now - self.last_time >= self.every_seconds
+        )
+        stop = self._poll_stop()
+        if due or stop:
+            self.writer.save_latest(state_fn())
+            self.last_time = now
+        if stop:
+            self._exit()
+
+    def handle_interruption(self):
+        """
+        Called when the training loop raised: if SIGTERM was received, writes the checkpoint of the last
+        completed step and exits. Otherwise, does nothing.
+        """
+        if not self.stop_requested:
+            return
+        if self._last_state_fn is not None:
+            self.writer.save_latest(self._last_state_fn())
+        self._exit()
+
+    def _exit(self):
+        self.writer.close()
+        print("Received SIGTERM, wrote the checkpoints")
+        sys.exit(128 + signal.SIGTERM)
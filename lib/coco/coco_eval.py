@@ -11,10 +11,23 @@ from pycocotools.cocoeval import COCOeval
 
 
 class CocoEvaluator:
-    def __init__(self, coco_gt, iou_types):
+    """
+    Args:
+        coco_gt (COCO): the ground truth.
+        iou_types (list[str]): any of "bbox", "segm" and "keypoints".
+        kpt_oks_sigmas (np.ndarray, optional): per-keypoint OKS sigmas, overriding the 17 COCO person ones.
+        single_pass (bool): only buffer compact detections in update, and run a single COCOeval
+            evaluate per IoU type in synchronize_between_processes, instead of one per batch.
+    """
+
+    def __init__(self, coco_gt, iou_types, kpt_oks_sigmas=None, single_pass=False):
         assert isinstance(iou_types, (list, tuple))
-        coco_gt = copy.deepcopy(coco_gt)
+        # COCOeval only modifies the ground truth in place when converting segmentations to RLE
+        if not single_pass or "segm" in iou_types:
+            coco_gt = copy.deepcopy(coco_gt)
         self.coco_gt = coco_gt
+        self.kpt_oks_sigmas = kpt_oks_sigmas
+        self.single_pass = single_pass
 
         self.iou_types = iou_types
         self.coco_eval = {}
@@ -23,11 +36,18 @@ class CocoEvaluator:
 
         self.img_ids = []
         self.eval_imgs = {k: [] for k in iou_types}
+        self.detections = []
 
-    def update(self, predictions, kpt_oks_sigmas):
+    def update(self, predictions, kpt_oks_sigmas=None):
+        if kpt_oks_sigmas is not None:
+            self.kpt_oks_sigmas = kpt_oks_sigmas
         img_ids = list(np.unique(list(predictions.keys())))
         self.img_ids.extend(img_ids)
 
+        if self.single_pass:
+            self.detections.append(self.prepare_compact(predictions))
+            return
+
         for iou_type in self.iou_types:
             results = self.prepare(predictions, iou_type)
             with redirect_stdout(io.StringIO()):
@@ -35,7 +55,8 @@ class CocoEvaluator:
             # coco_eval = self.coco_eval[iou_type]
             # This one is so that we can use 1 keypoint instead of 17 (by default)
             coco_eval = COCOeval(self.coco_gt, iouType=iou_type)
-            coco_eval.params.kpt_oks_sigmas = kpt_oks_sigmas
+            if self.kpt_oks_sigmas is not None:
+                coco_eval.params.kpt_oks_sigmas = self.kpt_oks_sigmas
             self.coco_eval[iou_type] = coco_eval
             
             coco_eval.cocoDt = coco_dt
@@ -45,10 +66,34 @@ class CocoEvaluator:
             self.eval_imgs[iou_type].append(eval_imgs)
 
     def synchronize_between_processes(self):
+        if self.single_pass:
+            self._evaluate_single_pass()
+            return
         for iou_type in self.iou_types:
             self.eval_imgs[iou_type] = np.concatenate(self.eval_imgs[iou_type], 2)
             create_common_coco_eval(self.coco_eval[iou_type], self.img_ids, self.eval_imgs[iou_type])
 
+    def _evaluate_single_pass(self):
+        img_ids = set()
+        for p in utils.all_gather(self.img_ids):
+            img_ids.update(int(img_id) for img_id in p)
+        img_ids = sorted(img_ids)
+        detections = []
+        for p in utils.all_gather(self.detections):
+            detections.extend(p)
+        for iou_type in self.iou_types:
+            results = self.results_from_compact(detections, iou_type)
+            with redirect_stdout(io.StringIO()):
+                coco_dt = COCO.loadRes(self.coco_gt, results) if results else COCO()
+            coco_eval = COCOeval(self.coco_gt, iouType=iou_type)
+            if self.kpt_oks_sigmas is not None:
+                coco_eval.params.kpt_oks_sigmas = self.kpt_oks_sigmas
+            coco_eval.cocoDt = coco_dt
+            coco_eval.params.imgIds = img_ids
+            with redirect_stdout(io.StringIO()):
+                coco_eval.evaluate()
+            self.coco_eval[iou_type] = coco_eval
+
     def accumulate(self):
         for coco_eval in self.coco_eval.values():
             coco_eval.accumulate()
@@ -58,6 +103,12 @@ class CocoEvaluator:
             print(f"IoU metric: {iou_type}")
             coco_eval.summarize()
 
+    def summary_stats(self):
+        """
+        Returns the stats of every IoU type as lists, after summarize.
+        """
+        return {iou_type: coco_eval.stats.tolist() for iou_type, coco_eval in self.coco_eval.items()}
+
     def prepare(self, predictions, iou_type):
         if iou_type == "bbox":
             return self.prepare_for_coco_detection(predictions)
@@ -67,6 +118,59 @@ class CocoEvaluator:
             return self.prepare_for_coco_keypoint(predictions)
         raise ValueError(f"Unknown iou type {iou_type}")
 
+    def prepare_compact(self, predictions):
+        """
+        Keeps the detections of a batch as flat numpy arrays, see results_from_compact.
+        """
+        image_ids, boxes, scores, labels, keypoints, segmentations = [], [], [], [], [], []
+        for original_id, prediction in predictions.items():
+            if len(prediction) == 0:
+                continue
+            image_ids.append(np.full(len(prediction["scores"]), original_id, dtype=np.int64))
+            boxes.append(convert_to_xywh(prediction["boxes"]).cpu().numpy())
+            scores.append(prediction["scores"].cpu().numpy())
+            labels.append(prediction["labels"].cpu().numpy())
+            if "keypoints" in self.iou_types:
+                keypoints.append(prediction["keypoints"].flatten(start_dim=1).cpu().numpy())
+        if "segm" in self.iou_types:
+            segmentations = self.prepare_for_coco_segmentation(predictions)
+        if not image_ids:
+            return {"image_ids": np.zeros(0, dtype=np.int64), "segm": segmentations}
+        compact = {
+            "image_ids": np.concatenate(image_ids),
+            "boxes": np.concatenate(boxes),
+            "scores": np.concatenate(scores),
+            "labels": np.concatenate(labels),
+            "segm": segmentations,
+        }
+        if keypoints:
+            compact["keypoints"] = np.concatenate(keypoints)
+        return compact
+
+    def results_from_compact(self, detections, iou_type):
+        if iou_type == "segm":
+            return [r for d in detections for r in d["segm"]]
+        coco_results = []
+        for d in detections:
+            if len(d["image_ids"]) == 0:
+                continue
+            image_ids = d["image_ids"].tolist()
+            labels = d["labels"].tolist()
+            scores = d["scores"].tolist()
+            if iou_type == "bbox":
+                key, values = "bbox", d["boxes"].tolist()
+            elif iou_type == "keypoints":
+                key, values = "keypoints", d["keypoints"].tolist()
+            else:
+                raise ValueError(f"Unknown iou type {iou_type}")
+            coco_results.extend(
+                [
+                    {"image_id": image_ids[k], "category_id": labels[k], key: value, "score": scores[k]}
+                    for k, value in enumerate(values)
+                ]
+            )
+        return coco_results
+
     def prepare_for_coco_detection(self, predictions):
         coco_results = []
         for original_id, prediction in predictions.items():
@@ -1,5 +1,8 @@
 import copy
+import hashlib
+import json
 import os
+import weakref
 
 import torch
 import torch.utils.data
@@ -140,6 +143,34 @@ def _coco_remove_images_without_annotations(dataset, cat_list=None):
     return dataset
 
 
+# Ground truth COCO objects already built, by dataset cache key and by dataset object
+_coco_api_by_key = {}
+_coco_api_by_dataset = weakref.WeakKeyDictionary()
+
+
+def _get_target_and_size(ds, idx):
+    if isinstance(ds, torch.utils.data.Subset):
+        return _get_target_and_size(ds.dataset, ds.indices[idx])
+    # Datasets can provide their targets and image sizes without decoding the image
+    if hasattr(ds, "get_annotations") and hasattr(ds, "get_height_and_width"):
+        height, width = ds.get_height_and_width(idx)
+        return ds.get_annotations(idx), height, width
+    img, targets = ds[idx]
+    return targets, img.shape[-2], img.shape[-1]
+
+
+def _get_dataset_cache_key(ds):
+    if isinstance(ds, torch.utils.data.Subset):
+        key = _get_dataset_cache_key(ds.dataset)
+        if key is None:
+            return None
+        indices = json.dumps([int(i) for i in ds.indices])
+        return hashlib.sha256((key + indices).encode("utf-8")).hexdigest()
+    if hasattr(ds, "get_cache_key"):
+        return ds.get_cache_key()
+    return None
+
+
 def convert_to_coco_api(ds):
     coco_ds = COCO()
     # annotation IDs need to start at 1, not 0, see torchvision issue #1530
@@ -147,16 +178,15 @@ def convert_to_coco_api(ds):
     dataset = {"images": [], "categories": [], "annotations": []}
     categories = set()
     for img_idx in range(len(ds)):
-        # find better way to get target
-        # targets = ds.get_annotations(img_idx)
-        img, targets = ds[img_idx]
+        targets, height, width = _get_target_and_size(ds, img_idx)
         image_id = targets["image_id"].item()
         img_dict = {}
         img_dict["id"] = image_id
-        img_dict["height"] = img.shape[-2]
-        img_dict["width"] = img.shape[-1]
+        img_dict["height"] = int(height)
+        img_dict["width"] = int(width)
         dataset["images"].append(img_dict)
-        bboxes = targets["boxes"]
+        # the targets may share memory with the dataset
+        bboxes = targets["boxes"].clone()
         bboxes[:, 2:] -= bboxes[:, :2]
         bboxes = bboxes.tolist()
         labels = targets["labels"].tolist()
@@ -192,15 +222,48 @@ def convert_to_coco_api(ds):
     return coco_ds
 
 
-def get_coco_api_from_dataset(dataset):
+def get_coco_api_from_dataset(dataset, cache_dir=None):
+    """
+    Returns the ground truth of a dataset as a COCO object.
+
+    For datasets other than CocoDetection, the object is built by convert_to_coco_api once and kept in memory.
+    If the dataset provides get_cache_key(), returning a hash of its content, the object is also cached in
+    cache_dir as JSON, and reused by later runs as long as the key is unchanged.
+    """
+    coco_dataset = dataset
     for _ in range(10):
-        if isinstance(dataset, torchvision.datasets.CocoDetection):
+        if isinstance(coco_dataset, torchvision.datasets.CocoDetection):
             break
-        if isinstance(dataset, torch.utils.data.Subset):
-            dataset = dataset.dataset
-    if isinstance(dataset, torchvision.datasets.CocoDetection):
-        return dataset.coco
-    return convert_to_coco_api(dataset)
+        if isinstance(coco_dataset, torch.utils.data.Subset):
+            coco_dataset = coco_dataset.dataset
+    if isinstance(coco_dataset, torchvision.datasets.CocoDetection):
+        return coco_dataset.coco
+
+    key = _get_dataset_cache_key(dataset)
+    if key is None:
+        if dataset not in _coco_api_by_dataset:
+            _coco_api_by_dataset[dataset] = convert_to_coco_api(dataset)
+        return _coco_api_by_dataset[dataset]
+    if key in _coco_api_by_key:
+        return _coco_api_by_key[key]
+
+    cache_path = os.path.join(cache_dir, f"coco_gt_{key}.json") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        coco_ds = COCO()
+        with open(cache_path, "r") as f:
+            coco_ds.dataset = json.load(f)
+        coco_ds.createIndex()
+    else:
+        coco_ds = convert_to_coco_api(dataset)
+        # RLE segmentations are not JSON serializable
+        if cache_path and not any("segmentation" in ann for ann in coco_ds.dataset["annotations"]):
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(coco_ds.dataset, f)
+            os.replace(tmp_path, cache_path)
+    _coco_api_by_key[key] = coco_ds
+    return coco_ds
 
 
 class CocoDetection(torchvision.datasets.CocoDetection):
@@ -0,0 +1,437 @@
+import io
+from contextlib import redirect_stdout
+
+import numpy as np
+import lib.utils as utils
+from pycocotools.coco import COCO
+from pycocotools.cocoeval import COCOeval, Params
+
+# Same evaluation parameters as pycocotools.cocoeval.Params
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+RECALL_THRESHOLDS = np.linspace(0.0, 1.0, 101)
+AREA_RANGES = {
+    "bbox": [("all", 0, 1e5**2), ("small", 0, 32**2), ("medium", 32**2, 96**2), ("large", 96**2, 1e5**2)],
+    "keypoints": [("all", 0, 1e5**2), ("medium", 32**2, 96**2), ("large", 96**2, 1e5**2)],
+}
+MAX_DETS = {"bbox": [1, 10, 100], "keypoints": [20]}
+
+
+def _xyxy_to_xywh(boxes):
+    # Same float32 arithmetic as convert_to_xywh in CocoEvaluator
+    boxes = np.asarray(boxes, dtype=np.float32)
+    return np.concatenate([boxes[:, :2], boxes[:, 2:] - boxes[:, :2]], axis=1)
+
+
+def _pad_by_image(image_index, num_images, arrays, limit=None):
+    # Rows must be sorted by image_index. Returns a (num_images, width) validity mask and the padded arrays
+    counts = np.bincount(image_index, minlength=num_images)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    rank = np.arange(len(image_index)) - starts[image_index]
+    width = int(counts.max()) if len(counts) else 0
+    if limit is not None:
+        width = min(width, limit)
+    keep = rank < width
+    rows, cols = image_index[keep], rank[keep]
+    valid = np.zeros((num_images, width), dtype=bool)
+    valid[rows, cols] = True
+    padded = []
+    for array in arrays:
+        out = np.zeros((num_images, width) + array.shape[1:], dtype=array.dtype)
+        out[rows, cols] = array[keep]
+        padded.append(out)
+    return valid, padded
+
+
+def box_iou(det_boxes, gt_boxes, gt_crowd):
+    """
+    IoU of xywh boxes, as pycocotools.mask.iou: a crowd ground truth is divided by the detection area only.
+
+    det_boxes (I, D, 4), gt_boxes (I, G, 4), gt_crowd (I, G) -> (I, D, G)
+    """
+    d, g = det_boxes[:, :, None, :], gt_boxes[:, None, :, :]
+    iw = np.minimum(d[..., 0] + d[..., 2], g[..., 0] + g[..., 2]) - np.maximum(d[..., 0], g[..., 0])
+    ih = np.minimum(d[..., 1] + d[..., 3], g[..., 1] + g[..., 3]) - np.maximum(d[..., 1], g[..., 1])
+    inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+    det_area = d[..., 2] * d[..., 3]
+    union = np.where(gt_crowd[:, None, :], det_area, det_area + g[..., 2] * g[..., 3] - inter)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(inter > 0, inter / union, 0.0)
+
+
+def keypoint_oks(det_keypoints, gt_keypoints, gt_boxes, gt_areas, sigmas):
+    """
+    Object keypoint similarity, as COCOeval.computeOks.
+
+    det_keypoints (I, D, K, 3), gt_keypoints (I, G, K, 3), gt_boxes (I, G, 4) xywh, gt_areas (I, G) -> (I, D, G)
+    """
+    variances = (sigmas * 2) ** 2
+    xd, yd = det_keypoints[:, :, None, :, 0], det_keypoints[:, :, None, :, 1]
+    xg, yg = gt_keypoints[:, None, :, :, 0], gt_keypoints[:, None, :, :, 1]
+    visible = gt_keypoints[:, None, :, :, 2] > 0
+    labeled = visible.any(axis=-1, keepdims=True)
+
+    # Without any labeled keypoint, the distance is measured to a box twice as large as the ground truth box
+    b = gt_boxes[:, None, :, None, :]
+    x0, x1 = b[..., 0] - b[..., 2], b[..., 0] + b[..., 2] * 2
+    y0, y1 = b[..., 1] - b[..., 3], b[..., 1] + b[..., 3] * 2
+    dx = np.where(labeled, xd - xg, np.maximum(0, x0 - xd) + np.maximum(0, xd - x1))
+    dy = np.where(labeled, yd - yg, np.maximum(0, y0 - yd) + np.maximum(0, yd - y1))
+
+    e = (dx**2 + dy**2) / variances / (gt_areas[:, None, :, None] + np.spacing(1)) / 2
+    weights = np.where(labeled, visible, True)
+    return (np.exp(-e) * weights).sum(axis=-1) / weights.sum(axis=-1)
+
+
+def match(similarity, gt_valid, gt_ignore, gt_crowd, det_valid, det_out_of_range, thresholds=IOU_THRESHOLDS):
+    """
+    Greedy matching of COCOeval.evaluateImg, vectorized over images and thresholds.
+
+    The detections of every image must be sorted by decreasing score. Every detection, in that order, takes the
+    unmatched ground truth of highest similarity above the threshold, non-ignored ones first; crowd ground
+    truths can be matched several times.
+
+    similarity (I, D, G), gt_* (I, G), det_* (I, D) -> det_matched (I, T, D), det_ignored (I, T, D)
+    """
+    num_images, num_dets, num_gts = similarity.shape
+    # COCOeval visits the non-ignored ground truths first
+    order = np.argsort(gt_ignore.astype(np.int8) + 2 * ~gt_valid, axis=1, kind="stable")
+    similarity = np.take_along_axis(similarity, order[:, None, :], axis=2)
+    gt_valid, gt_ignore, gt_crowd = (np.take_along_axis(a, order, axis=1) for a in (gt_valid, gt_ignore, gt_crowd))
+
+    num_thresholds = len(thresholds)
+    thresholds = np.minimum(thresholds, 1 - 1e-10)[None, :, None]
+    gt_matched = np.zeros((num_images, num_thresholds, num_gts), dtype=bool)
+    det_matched = np.zeros((num_images, num_thresholds, num_dets), dtype=bool)
+    det_ignored = np.zeros_like(det_matched)
+    rows = np.arange(num_images)[:, None]
+    cols = np.arange(num_thresholds)[None, :]
+    if num_gts == 0:
+        det_ignored |= det_out_of_range[:, None, :]
+        return det_matched, det_ignored
+
+    def last_argmax(candidates, s):
+        # COCOeval keeps the last ground truth among equal similarities
+        values = np.where(candidates, s, -np.inf)[..., ::-1]
+        return num_gts - 1 - np.argmax(values, axis=-1)
+
+    for d in range(num_dets):
+        s = similarity[:, None, d, :]
+        candidates = (
+            (gt_valid & det_valid[:, d, None])[:, None, :] & (~gt_matched | gt_crowd[:, None, :]) & (s >= thresholds)
+        )
+        regular = candidates & ~gt_ignore[:, None, :]
+        has_regular = regular.any(axis=-1)
+        matched = has_regular | candidates.any(axis=-1)
+        best = np.where(has_regular, last_argmax(regular, s), last_argmax(candidates, s))
+        det_matched[:, :, d] = matched
+        det_ignored[:, :, d] = matched & gt_ignore[rows, best]
+        gt_matched[rows, cols, best] |= matched
+    det_ignored |= ~det_matched & det_out_of_range[:, None, :]
+    return det_matched, det_ignored
+
+
+def accumulate(det_scores, det_valid, det_matched, det_ignored, num_positives, max_det):
+    """
+    Precision/recall of COCOeval.accumulate for a single category, area range and maximum detection count.
+
+    Returns precision (T, R) and recall (T,), -1 when there is no positive.
+    """
+    num_thresholds = det_matched.shape[1]
+    if num_positives == 0:
+        return -np.ones((num_thresholds, len(RECALL_THRESHOLDS))), -np.ones(num_thresholds)
+    keep = det_valid[:, :max_det]
+    scores = det_scores[:, :max_det][keep]
+    order = np.argsort(-scores, kind="mergesort")
+    matched = det_matched[:, :, :max_det].transpose(1, 0, 2)[:, keep][:, order]
+    ignored = det_ignored[:, :, :max_det].transpose(1, 0, 2)[:, keep][:, order]
+
+    precision = np.zeros((num_thresholds, len(RECALL_THRESHOLDS)))
+    if len(scores) == 0:
+        return precision, np.zeros(num_thresholds)
+    tps = np.cumsum(matched & ~ignored, axis=1, dtype=np.float64)
+    fps = np.cumsum(~matched & ~ignored, axis=1, dtype=np.float64)
+    rc = tps / num_positives
+    pr = tps / (fps + tps + np.spacing(1))
+    # Make the precision monotonically decreasing
+    pr = np.maximum.accumulate(pr[:, ::-1], axis=1)[:, ::-1]
+    for t in range(num_thresholds):
+        inds = np.searchsorted(rc[t], RECALL_THRESHOLDS, side="left")
+        found = inds < len(scores)
+        precision[t, found] = pr[t, inds[found]]
+    return precision, rc[:, -1]
+
+
+def _mean(values):
+    values = values[values > -1]
+    return float(values.mean()) if len(values) else -1.0
+
+
+def summarize_stats(precision, recall, iou_type):
+    """
+    Returns the stats array of COCOeval.summarize from precision (T, R, A, M) and recall (T, A, M).
+    """
+    a = {name: i for i, (name, _, _) in enumerate(AREA_RANGES[iou_type])}
+    t50, t75 = np.isclose(IOU_THRESHOLDS, 0.5), np.isclose(IOU_THRESHOLDS, 0.75)
+    if iou_type == "bbox":
+        return np.array(
+            [
+                _mean(precision[:, :, a["all"], -1]),
+                _mean(precision[t50, :, a["all"], -1]),
+                _mean(precision[t75, :, a["all"], -1]),
+                _mean(precision[:, :, a["small"], -1]),
+                _mean(precision[:, :, a["medium"], -1]),
+                _mean(precision[:, :, a["large"], -1]),
+                _mean(recall[:, a["all"], 0]),
+                _mean(recall[:, a["all"], 1]),
+                _mean(recall[:, a["all"], 2]),
+                _mean(recall[:, a["small"], -1]),
+                _mean(recall[:, a["medium"], -1]),
+                _mean(recall[:, a["large"], -1]),
+            ]
+        )
+    return np.array(
+        [
+            _mean(precision[:, :, a["all"], -1]),
+            _mean(precision[t50, :, a["all"], -1]),
+            _mean(precision[t75, :, a["all"], -1]),
+            _mean(precision[:, :, a["medium"], -1]),
+            _mean(precision[:, :, a["large"], -1]),
+            _mean(recall[:, a["all"], -1]),
+            _mean(recall[t50, a["all"], -1]),
+            _mean(recall[t75, a["all"], -1]),
+            _mean(recall[:, a["medium"], -1]),
+            _mean(recall[:, a["large"], -1]),
+        ]
+    )
+
+
+class RollerEvaluator:
+    """
+    Box AP/AR and keypoint OKS AP/AR of a single-category dataset, computed with NumPy arrays.
+
+    Drop-in replacement of CocoEvaluator for the "bbox" and "keypoints" IoU types. The similarity matrices
+    of all the images are computed at once and the greedy matching of pycocotools is vectorized over images
+    and IoU thresholds, so the whole test set is evaluated without a Python loop over images. The results
+    follow the conventions of COCOeval (thresholds, area ranges, maximum detections, interpolation);
+    use cross_check to compare both on a sample of images.
+
+    Args:
+        coco_gt (COCO): the ground truth, with a single category.
+        iou_types (list[str]): "bbox" and/or "keypoints".
+        kpt_oks_sigmas (np.ndarray, optional): per-keypoint OKS sigmas. Defaults to the 17 COCO person ones.
+
+    Usage:
+        evaluator = RollerEvaluator(coco_gt, ["bbox", "keypoints"], kpt_oks_sigmas=np.array([0.01]))
+        evaluator.update(predictions)  # for every batch
+        evaluator.synchronize_between_processes()
+        evaluator.accumulate()
+        evaluator.summarize()
+        evaluator.stats["keypoints"][0]  # OKS AP
+    """
+
+    def __init__(self, coco_gt, iou_types, kpt_oks_sigmas=None):
+        assert isinstance(iou_types, (list, tuple))
+        for iou_type in iou_types:
+            if iou_type not in MAX_DETS:
+                raise ValueError(f"Unsupported iou type {iou_type}, only bbox and keypoints are supported")
+        cat_ids = sorted(coco_gt.getCatIds())
+        if len(cat_ids) != 1:
+            raise ValueError(f"RollerEvaluator supports a single category, got {len(cat_ids)}")
+        self.coco_gt = coco_gt
+        self.iou_types = iou_types
+        self.cat_id = cat_ids[0]
+        if kpt_oks_sigmas is None:
+            kpt_oks_sigmas = Params(iouType="keypoints").kpt_oks_sigmas
+        self.kpt_oks_sigmas = np.asarray(kpt_oks_sigmas, dtype=np.float64)
+        self.img_ids = []
+        self.detections = []
+        self.precision = {}
+        self.recall = {}
+        self.stats = {}
+        self._load_ground_truth()
+
+    def _load_ground_truth(self):
+        anns = [ann for ann in self.coco_gt.dataset["annotations"] if ann["category_id"] == self.cat_id]
+        num_keypoints = max([len(ann.get("keypoints", [])) // 3 for ann in anns], default=0)
+        keypoints = np.zeros((len(anns), num_keypoints, 3), dtype=np.float64)
+        for i, ann in enumerate(anns):
+            k = np.asarray(ann.get("keypoints", []), dtype=np.float64).reshape(-1, 3)
+            keypoints[i, : len(k)] = k
+        self.gt = {
+            "image_ids": np.asarray([ann["image_id"] for ann in anns], dtype=np.int64),
+            "boxes": np.asarray([ann["bbox"] for ann in anns], dtype=np.float64).reshape(-1, 4),
+            "areas": np.asarray([ann["area"] for ann in anns], dtype=np.float64),
+            "crowd": np.asarray([bool(ann.get("iscrowd", 0)) for ann in anns], dtype=bool),
+            "num_keypoints": np.asarray([ann.get("num_keypoints", 0) for ann in anns], dtype=np.int64),
+            "keypoints": keypoints,
+        }
+
+    def update(self, predictions, kpt_oks_sigmas=None):
+        if kpt_oks_sigmas is not None:
+            self.kpt_oks_sigmas = np.asarray(kpt_oks_sigmas, dtype=np.float64)
+        image_ids, boxes, scores, labels, keypoints = [], [], [], [], []
+        for original_id, prediction in predictions.items():
+            self.img_ids.append(int(original_id))
+            if len(prediction) == 0:
+                continue
+            image_ids.append(np.full(len(prediction["scores"]), original_id, dtype=np.int64))
+            boxes.append(prediction["boxes"].cpu().numpy())
+            scores.append(prediction["scores"].cpu().numpy())
+            labels.append(prediction["labels"].cpu().numpy())
+            if "keypoints" in self.iou_types:
+                keypoints.append(prediction["keypoints"].cpu().numpy())
+        if image_ids:
+            batch = {
+                "image_ids": np.concatenate(image_ids),
+                "boxes": np.concatenate(boxes),
+                "scores": np.concatenate(scores),
+                "labels": np.concatenate(labels),
+            }
+            if keypoints:
+                batch["keypoints"] = np.concatenate(keypoints)
+            self.detections.append(batch)
+
+    def synchronize_between_processes(self):
+        img_ids, detections = [], []
+        for p in utils.all_gather(self.img_ids):
+            img_ids.extend(p)
+        for p in utils.all_gather(self.detections):
+            detections.extend(p)
+        self.img_ids = img_ids
+        self.detections = detections
+
+    def _detection_arrays(self):
+        if not self.detections:
+            return None
+        keys = self.detections[0].keys()
+        detections = {k: np.concatenate([d[k] for d in self.detections]) for k in keys}
+        keep = detections["labels"] == self.cat_id
+        return {k: v[keep] for k, v in detections.items()}
+
+    def evaluate(self, iou_type, img_ids):
+        """
+        Returns precision (T, R, A, M) and recall (T, A, M) over the images img_ids.
+        """
+        img_ids = np.unique(np.asarray(img_ids, dtype=np.int64))
+        num_images = len(img_ids)
+        max_dets = MAX_DETS[iou_type]
+        area_ranges = AREA_RANGES[iou_type]
+
+        gt = self.gt
+        gt_rows = np.flatnonzero(np.isin(gt["image_ids"], img_ids))
+        gt_rows = gt_rows[np.argsort(gt["image_ids"][gt_rows], kind="stable")]
+        gt_index = np.searchsorted(img_ids, gt["image_ids"][gt_rows])
+        gt_ignore = gt["crowd"][gt_rows]
+        if iou_type == "keypoints":
+            gt_ignore = gt_ignore | (gt["num_keypoints"][gt_rows] == 0)
+        gt_valid, (gt_boxes, gt_areas, gt_crowd, gt_keypoints, gt_ignore) = _pad_by_image(
+            gt_index,
+            num_images,
+            [gt["boxes"][gt_rows], gt["areas"][gt_rows], gt["crowd"][gt_rows], gt["keypoints"][gt_rows], gt_ignore],
+        )
+
+        det = self._detection_arrays()
+        if det is None:
+            det = {"image_ids": np.zeros(0, dtype=np.int64), "scores": np.zeros(0), "boxes": np.zeros((0, 4))}
+            det["keypoints"] = np.zeros((0, len(self.kpt_oks_sigmas), 3))
+        det_rows = np.flatnonzero(np.isin(det["image_ids"], img_ids))
+        det_index = np.searchsorted(img_ids, det["image_ids"][det_rows])
+        # Sorted by image, then by decreasing score, keeping the prediction order among equal scores
+        det_rows = det_rows[np.lexsort((-det["scores"][det_rows], det_index))]
+        det_index = np.searchsorted(img_ids, det["image_ids"][det_rows])
+        det_scores = det["scores"][det_rows].astype(np.float64)
+
+        if iou_type == "bbox":
+            boxes = _xyxy_to_xywh(det["boxes"][det_rows]).astype(np.float64)
+            det_areas = boxes[:, 2] * boxes[:, 3]
+            det_valid, (det_scores, det_boxes, det_areas) = _pad_by_image(
+                det_index, num_images, [det_scores, boxes, det_areas], limit=max_dets[-1]
+            )
+            similarity = box_iou(det_boxes, gt_boxes, gt_crowd)
+        else:
+            keypoints = det["keypoints"][det_rows].astype(np.float64)[:, : len(self.kpt_oks_sigmas)]
+            # COCO.loadRes computes the area of a keypoint detection from the extent of its keypoints
+            extent = keypoints[..., :2].max(axis=1) - keypoints[..., :2].min(axis=1)
+            det_areas = extent[:, 0] * extent[:, 1]
+            det_valid, (det_scores, det_keypoints, det_areas) = _pad_by_image(
+                det_index, num_images, [det_scores, keypoints, det_areas], limit=max_dets[-1]
+            )
+            similarity = keypoint_oks(det_keypoints, gt_keypoints, gt_boxes, gt_areas, self.kpt_oks_sigmas)
+
+        precision = -np.ones((len(IOU_THRESHOLDS), len(RECALL_THRESHOLDS), len(area_ranges), len(max_dets)))
+        recall = -np.ones((len(IOU_THRESHOLDS), len(area_ranges), len(max_dets)))
+        for a, (_, low, high) in enumerate(area_ranges):
+            area_ignore = gt_ignore | (gt_areas < low) | (gt_areas > high)
+            det_out_of_range = (det_areas < low) | (det_areas > high)
+            det_matched, det_ignored = match(similarity, gt_valid, area_ignore, gt_crowd, det_valid, det_out_of_range)
+            num_positives = int((gt_valid & ~area_ignore).sum())
+            for m, max_det in enumerate(max_dets):
+                precision[:, :, a, m], recall[:, a, m] = accumulate(
+                    det_scores, det_valid, det_matched, det_ignored, num_positives, max_det
+                )
+        return precision, recall
+
+    def accumulate(self):
+        for iou_type in self.iou_types:
+            precision, recall = self.evaluate(iou_type, self.img_ids)
+            self.precision[iou_type] = precision
+            self.recall[iou_type] = recall
+            self.stats[iou_type] = summarize_stats(precision, recall, iou_type)
+
+    def summarize(self):
+        for iou_type in self.iou_types:
+            print(f"IoU metric: {iou_type}")
+            stats = self.stats[iou_type]
+            names = ["AP", "AP50", "AP75", "APs", "APm", "APl", "AR1", "AR10", "AR100", "ARs", "ARm", "ARl"]
+            if iou_type == "keypoints":
+                names = ["AP", "AP50", "AP75", "APm", "APl", "AR", "AR50", "AR75", "ARm", "ARl"]
+            print("  ".join(f"{name}: {value:.3f}" for name, value in zip(names, stats)))
+
+    def summary_stats(self):
+        """
+        Returns the stats of every IoU type as lists, after accumulate.
+        """
+        return {iou_type: stats.tolist() for iou_type, stats in self.stats.items()}
+
+    def cross_check(self, num_images=200, seed=0, atol=1e-6):
+        """
+        Evaluates a random sample of the updated images with both this evaluator and pycocotools COCOeval,
+        and asserts that all the summary stats agree.
+
+        Returns a dict mapping every IoU type to the (native, pycocotools) stats of the sample.
+        """
+        img_ids = np.unique(np.asarray(self.img_ids, dtype=np.int64))
+        if len(img_ids) > num_images:
+            img_ids = np.sort(np.random.default_rng(seed).choice(img_ids, num_images, replace=False))
+        det = self._detection_arrays()
+        report = {}
+        for iou_type in self.iou_types:
+            precision, recall = self.evaluate(iou_type, img_ids)
+            native = summarize_stats(precision, recall, iou_type)
+
+            results = []
+            if det is not None:
+                for k in np.flatnonzero(np.isin(det["image_ids"], img_ids)):
+                    result = {
+                        "image_id": int(det["image_ids"][k]),
+                        "category_id": self.cat_id,
+                        "score": float(det["scores"][k]),
+                    }
+                    if iou_type == "bbox":
+                        result["bbox"] = _xyxy_to_xywh(det["boxes"][k : k + 1])[0].tolist()
+                    else:
+                        result["keypoints"] = det["keypoints"][k].flatten().tolist()
+                    results.append(result)
+            with redirect_stdout(io.StringIO()):
+                coco_dt = COCO.loadRes(self.coco_gt, results) if results else COCO()
+                coco_eval = COCOeval(self.coco_gt, coco_dt, iouType=iou_type)
+                coco_eval.params.kpt_oks_sigmas = self.kpt_oks_sigmas
+                coco_eval.params.imgIds = img_ids.tolist()
+                coco_eval.evaluate()
+                coco_eval.accumulate()
+                coco_eval.summarize()
+            reference = coco_eval.stats
+            if not np.allclose(native, reference, atol=atol):
+                raise AssertionError(f"{iou_type} stats differ from pycocotools: {native} != {reference}")
+            report[iou_type] = (native, reference)
+        return report
@@ -1,3 +1,4 @@
+import contextlib
 import math
 import sys
 import time
@@ -7,53 +8,222 @@ import torch
 import torchvision.models.detection.mask_rcnn
 import lib.utils as utils
 from lib.coco.coco_eval import CocoEvaluator
+from lib.coco.roller_eval import RollerEvaluator
 from lib.coco.coco_utils import get_coco_api_from_dataset
+from lib.mixed_precision import autocast, keep_sensitive_ops_in_float32
 
 
-def train_one_epoch(model, optimizer, data_loader, device, epoch, print_freq):
+def _log_loss_sums(metric_logger, loss_names, loss_sums, count):
+    # Reduces the losses summed on the device over the last count iterations, logs their averages,
+    # and returns them as floats
+    reduced = utils.reduce_dict(dict(zip(["loss"] + loss_names, loss_sums / count)))
+    names = list(reduced)
+    values = torch.stack([reduced[name] for name in names]).tolist()
+    for name, value in zip(names, values):
+        metric_logger.meters[name].update(value, n=count)
+    return dict(zip(names, values))
+
+
+class _NonFiniteFlag:
+    # Whether a loss of the current accumulation group was non-finite on any process, kept on the device and
+    # copied to the host without blocking, so that reading it at the optimizer step only waits for the copy,
+    # which is queued before the backward pass
+    def __init__(self, device):
+        self.device = device
+        self.flag = None
+        self.event = None
+        self.host = torch.zeros((), dtype=torch.int32, pin_memory=device.type == "cuda")
+
+    def update(self, losses):
+        nonfinite = (~torch.isfinite(losses.detach())).to(torch.int32)
+        self.flag = nonfinite if self.flag is None else torch.maximum(self.flag, nonfinite)
+
+    def copy_to_host(self):
+        if utils.is_dist_avail_and_initialized():
+            torch.distributed.all_reduce(self.flag, op=torch.distributed.ReduceOp.MAX)
+        self.host.copy_(self.flag, non_blocking=self.device.type == "cuda")
+        if self.device.type == "cuda":
+            self.event = torch.cuda.Event()
+            self.event.record()
+        self.flag = None
+
+    def read(self):
+        if self.event is not None:
+            self.event.synchronize()
+            self.event = None
+        return bool(self.host.item())
+
+
+def train_one_epoch(
+    model,
+    optimizer,
+    data_loader,
+    device,
+    epoch,
+    print_freq,
+    scaler=None,
+    amp_dtype=None,
+    accumulation_steps=1,
+    lazy_logging=False,
+    telemetry=None,
+    profiler=None,
+    start_iteration=0,
+    warmup_state=None,
+    step_callback=None,
+    batch_transform=None,
+):
+    """
+    Trains the model for one epoch.
+
+    With accumulation_steps > 1, the gradients of accumulation_steps consecutive mini-batches are summed before
+    every optimizer step, for an effective batch size of accumulation_steps times the mini-batch size. The warmup
+    of the first epoch counts optimizer steps, not mini-batches.
+
+    With lazy_logging, the losses are summed on the device and only reduced across processes and copied to the
+    host every print_freq iterations, instead of on every iteration. Whether a loss of the current accumulation
+    group is non-finite is kept on the device, and copied to the host before the backward pass of its last
+    mini-batch, so that reading it at the optimizer step does not wait for the backward pass. Training then
+    stops before the optimizer step and step_callback of a group with a non-finite loss, as it does otherwise.
+
+    telemetry (utils.StageTimer, optional) records the time of the data, h2d, augment (with batch_transform),
+    forward, logging, backward and optimizer stages of every iteration.
+
+    profiler (torch.profiler.profile, optional) is stepped after every iteration, see profiling.profile_window.
+
+    To resume an epoch, start_iteration is the number of mini-batches already done, and data_loader only yields
+    the remaining ones. In the first epoch, warmup_state is then the state dict of the warmup LinearLR at that
+    point. step_callback is called after every optimizer step as step_callback(iteration, warmup_lr_scheduler),
+    with iteration the number of mini-batches of the epoch done and warmup_lr_scheduler None after the first epoch.
+
+    batch_transform (callable, optional) augments the batches of transforms.collate_uint8_batch on the device,
+    as batch_transform(images, targets, image_sizes), and returns the lists of images and targets of the model,
+    see presets.DetectionPresetTrain with batched.
+    """
     model.train()
+    if amp_dtype is not None:
+        keep_sensitive_ops_in_float32(model)
     metric_logger = utils.MetricLogger(delimiter="  ")
     metric_logger.add_meter("lr", utils.SmoothedValue(window_size=1, fmt="{value:.6f}"))
     header = f"Epoch: [{epoch}]"
 
+    num_batches = start_iteration + len(data_loader)
     lr_scheduler = None
     if epoch == 0:
         warmup_factor = 1.0 / 1000
-        warmup_iters = min(1000, len(data_loader) - 1)
+        warmup_iters = min(1000, math.ceil(num_batches / accumulation_steps) - 1)
 
+        resumed_lrs = [group["lr"] for group in optimizer.param_groups]
         lr_scheduler = torch.optim.lr_scheduler.LinearLR(
             optimizer, start_factor=warmup_factor, total_iters=warmup_iters
         )
+        if warmup_state is not None:
+            lr_scheduler.load_state_dict(warmup_state)
+            # the constructor scaled the learning rates, which the resumed optimizer already has
+            for group, lr in zip(optimizer.param_groups, resumed_lrs):
+                group["lr"] = lr
 
-    for images, targets in metric_logger.log_every(data_loader, print_freq, header):
-        images = list(image.to(device) for image in images)
+    loss_names = None
+    loss_sums = None
+    window_count = 0
+    nonfinite = _NonFiniteFlag(device) if lazy_logging else None
+    if telemetry is None:
+        telemetry = utils.StageTimer(enabled=False)
+    telemetry.start_epoch(epoch, "train")
+
+    optimizer.zero_grad()
+    for i, (images, targets) in enumerate(metric_logger.log_every(data_loader, print_freq, header)):
+        telemetry.lap("data", elapsed=metric_logger.data_wait)
+        if batch_transform is None:
+            images = list(image.to(device) for image in images)
+        else:
+            images, image_sizes = images
+            images = images.to(device)
         targets = [{k: v.to(device) for k, v in t.items()} for t in targets]
+        telemetry.lap("h2d")
+        if batch_transform is not None:
+            images, targets = batch_transform(images, targets, image_sizes.to(device))
+            telemetry.lap("augment")
+
+        # the last group of the epoch may have fewer mini-batches
+        iteration = start_iteration + i
+        group_start = iteration - iteration % accumulation_steps
+        group_size = min(accumulation_steps, num_batches - group_start)
+        step = iteration + 1 == group_start + group_size
+        # under DDP, the gradients are only all-reduced on the last mini-batch of a group
+        sync_context = contextlib.nullcontext()
+        if not step and isinstance(model, torch.nn.parallel.DistributedDataParallel):
+            sync_context = model.no_sync()
 
-        loss_dict = model(images, targets)
+        with sync_context:
+            with autocast(device, amp_dtype):
+                loss_dict = model(images, targets)
+                losses = sum(loss for loss in loss_dict.values())
+            telemetry.lap("forward")
 
-        losses = sum(loss for loss in loss_dict.values())
+            if lazy_logging:
+                if loss_names is None:
+                    loss_names = sorted(loss_dict)
+                values = torch.stack([losses.detach()] + [loss_dict[name].detach() for name in loss_names]).float()
+                loss_sums = values if loss_sums is None else loss_sums + values
+                window_count += 1
+                nonfinite.update(losses)
+                if step:
+                    nonfinite.copy_to_host()
+                # same iterations as the ones printed by log_every
+                if i % print_freq == 0 or iteration == num_batches - 1:
+                    logged = _log_loss_sums(metric_logger, loss_names, loss_sums, window_count)
+                    loss_sums = None
+                    window_count = 0
+                    # a non-finite loss makes its sum non-finite
+                    if not all(math.isfinite(value) for value in logged.values()):
+                        print(f"Loss is {logged['loss']}, stopping training")
+                        print(logged)
+                        sys.exit(1)
+            else:
+                # reduce losses over all GPUs for logging purposes
+                loss_dict_reduced = utils.reduce_dict(loss_dict)
+                losses_reduced = sum(loss for loss in loss_dict_reduced.values())
 
-        # reduce losses over all GPUs for logging purposes
-        loss_dict_reduced = utils.reduce_dict(loss_dict)
-        losses_reduced = sum(loss for loss in loss_dict_reduced.values())
+                loss_value = losses_reduced.item()
 
-        loss_value = losses_reduced.item()
+                if not math.isfinite(loss_value):
+                    print(f"Loss is {loss_value}, stopping training")
+                    print(loss_dict_reduced)
+                    sys.exit(1)
+            telemetry.lap("logging")
 
-        if not math.isfinite(loss_value):
-            print(f"Loss is {loss_value}, stopping training")
-            print(loss_dict_reduced)
-            sys.exit(1)
+            if scaler is not None:
+                scaler.scale(losses / group_size).backward()
+            else:
+                (losses / group_size).backward()
+            telemetry.lap("backward")
 
-        optimizer.zero_grad()
-        losses.backward()
-        optimizer.step()
+        if step:
+            if lazy_logging and nonfinite.read():
+                print("Loss is not finite, stopping training before the optimizer step")
+                sys.exit(1)
+            if scaler is not None:
+                scaler.step(optimizer)
+                scaler.update()
+            else:
+                optimizer.step()
+            optimizer.zero_grad()
 
-        if lr_scheduler is not None:
-            lr_scheduler.step()
+            if lr_scheduler is not None:
+                lr_scheduler.step()
+            telemetry.lap("optimizer")
+            if step_callback is not None:
+                step_callback(iteration + 1, lr_scheduler)
 
-        metric_logger.update(loss=losses_reduced, **loss_dict_reduced)
+        if not lazy_logging:
+            metric_logger.update(loss=losses_reduced, **loss_dict_reduced)
         metric_logger.update(lr=optimizer.param_groups[0]["lr"])
+        if profiler is not None:
+            profiler.step()
+        telemetry.lap("logging")
+        telemetry.end_iteration()
 
+    telemetry.end_epoch()
     return metric_logger
 
 
@@ -69,46 +239,99 @@ def _get_iou_types(model):
     return iou_types
 
 @torch.inference_mode()
-def evaluate(model, data_loader, device):
+def evaluate(
+    model,
+    data_loader,
+    device,
+    single_pass=True,
+    native=False,
+    coco_cache_dir=None,
+    amp_dtype=None,
+    telemetry=None,
+    profiler=None,
+):
     n_threads = torch.get_num_threads()
     # FIXME remove this and make paste_masks_in_image run on the GPU
     torch.set_num_threads(1)
     cpu_device = torch.device("cpu")
     model.eval()
+    if amp_dtype is not None:
+        keep_sensitive_ops_in_float32(model)
     metric_logger = utils.MetricLogger(delimiter="  ")
     header = "Test:"
 
-    coco = get_coco_api_from_dataset(data_loader.dataset)
+    coco = get_coco_api_from_dataset(data_loader.dataset, cache_dir=coco_cache_dir)
     iou_types = _get_iou_types(model)
-    coco_evaluator = CocoEvaluator(coco, iou_types)
+    # use this to override 17 points by default. We only have 1
+    if native:
+        coco_evaluator = RollerEvaluator(coco, iou_types, kpt_oks_sigmas=np.array([0.01]))
+    else:
+        coco_evaluator = CocoEvaluator(coco, iou_types, kpt_oks_sigmas=np.array([0.01]), single_pass=single_pass)
+
+    if telemetry is None:
+        telemetry = utils.StageTimer(enabled=False)
+    telemetry.start_epoch(telemetry.epoch, "eval")
 
     for images, targets in metric_logger.log_every(data_loader, 100, header):
+        telemetry.lap("data", elapsed=metric_logger.data_wait)
         images = list(img.to(device) for img in images)
+        telemetry.lap("h2d")
 
         if torch.cuda.is_available():
             torch.cuda.synchronize()
         model_time = time.time()
-        outputs = model(images)
+        with autocast(device, amp_dtype):
+            outputs = model(images)
 
-        outputs = [{k: v.to(cpu_device) for k, v in t.items()} for t in outputs]
+        outputs = [
+            {k: v.to(cpu_device, torch.float32) if v.is_floating_point() else v.to(cpu_device) for k, v in t.items()}
+            for t in outputs
+        ]
         model_time = time.time() - model_time
+        telemetry.lap("forward")
 
         res = {target["image_id"].item(): output for target, output in zip(targets, outputs)}
-        
-        for target in targets:
-            coco_evaluator.update(res, np.array([0.01])) # use this to override 17 points by default. We only have 1
-        
         evaluator_time = time.time()
+        coco_evaluator.update(res)
         evaluator_time = time.time() - evaluator_time
+        telemetry.lap("evaluator")
         metric_logger.update(model_time=model_time, evaluator_time=evaluator_time)
+        if profiler is not None:
+            profiler.step()
+        telemetry.lap("logging")
+        telemetry.end_iteration()
 
+    telemetry.end_epoch()
     # gather the stats from all processes
     metric_logger.synchronize_between_processes()
     print("Averaged stats:", metric_logger)
+    accumulate_time = time.time()
     coco_evaluator.synchronize_between_processes()
 
     # accumulate predictions from all images
     coco_evaluator.accumulate()
+    print(f"Evaluator accumulate time: {time.time() - accumulate_time:.2f}s")
     coco_evaluator.summarize()
     torch.set_num_threads(n_threads)
     return coco_evaluator
+
+
+def compare_precision(model, data_loader, device, amp_dtype=torch.bfloat16, native=False):
+    """
+    Evaluates the same model in float32 and under autocast, and reports the speedup and the AP delta.
+
+    Returns a dict with the evaluation time in seconds and the stats of both runs, the speedup of the
+    autocast run, and the difference of every stat (autocast minus float32) for every IoU type.
+    """
+    report = {}
+    for name, dtype in (("fp32", None), ("amp", amp_dtype)):
+        start = time.perf_counter()
+        coco_evaluator = evaluate(model, data_loader, device, native=native, amp_dtype=dtype)
+        report[f"{name}_seconds"] = time.perf_counter() - start
+        report[f"{name}_stats"] = coco_evaluator.summary_stats()
+    report["speedup"] = report["fp32_seconds"] / report["amp_seconds"] if report["amp_seconds"] > 0 else 0.0
+    report["stats_delta"] = {
+        iou_type: [amp - fp32 for amp, fp32 in zip(report["amp_stats"][iou_type], stats)]
+        for iou_type, stats in report["fp32_stats"].items()
+    }
+    return report
@@ -1,25 +1,15 @@
 import os
-import json
+from annotation_index import AnnotationIndex
 
 json_checking_dir = "/home/citiai-cygnus/RollerDetection_HoangKhanh/roller_dataset_augmented/train_all_augmented/annotations"
 
-files_lacking_area = []
-areas = []
+# Boxes written by the augmentation are in [xmin, ymin, xmax, ymax] format
+index = AnnotationIndex.build(json_checking_dir, bbox_format="xyxy")
 
-for json_file in os.listdir(json_checking_dir):
-    if json_file.endswith('.json'):
-         # Load JSON annotation file
-        json_path = os.path.join(json_checking_dir, json_file)
-        with open(json_path, 'r') as f:
-            data = json.load(f)
-            
-        for annotation in data['annotations']:
-            bbox = annotation['bbox']
-            xmin = bbox[0]
-            ymin = bbox[1]
-            xmax = bbox[2]
-            ymax = bbox[3]
-            if xmin>=xmax or ymin>=ymax:
-                print(json_path)
+files_lacking_area = index.file_names[index.image_ids[index.invalid_boxes()]]
+areas = index.areas()
+
+for json_file in files_lacking_area:
+    print(os.path.join(json_checking_dir, json_file))
      
 
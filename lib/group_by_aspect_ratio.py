@@ -1,7 +1,12 @@
 import bisect
 import copy
+import hashlib
 import math
+import os
+import struct
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from itertools import repeat, chain
 
 import numpy as np
@@ -12,6 +17,11 @@ from PIL import Image
 from torch.utils.data.sampler import BatchSampler, Sampler
 from torch.utils.model_zoo import tqdm
 
+IMAGE_SIZE_CACHE_VERSION = 2
+# Start of frame markers, which hold the image size. C4 (DHT), C8 (JPG) and CC (DAC) are not frames
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
 
 def _repeat_to_at_least(iterable, n):
     repeat_times = math.ceil(n / len(iterable))
@@ -80,10 +90,132 @@ class GroupedBatchSampler(BatchSampler):
         return len(self.sampler) // self.batch_size
 
 
+class GroupedBatchPlanSampler(Sampler):
+    """
+    Yields mini-batches of indices of a single group each, like GroupedBatchSampler over a shuffled sampler,
+    from a batch plan computed up front with NumPy.
+
+    The plan of an epoch is derived from the seed and the epoch only: a permutation of the indices, a stable
+    sort by group (so every group keeps its samples in permutation order), and the chunking of every group into
+    batches. The full batches are ordered by the permutation position of their last sample, which is the order
+    in which GroupedBatchSampler completes them. The incomplete batches come last, the largest first (ties broken
+    as GroupedBatchSampler does), padded with the first samples of their group, so that there are
+    len(group_ids) // batch_size batches in total, as with GroupedBatchSampler.
+
+    The plan is an int64 array of shape (num_batches, batch_size). With num_replicas > 1, every rank takes every
+    num_replicas-th batch of the same plan, which is padded with its first batches so that all the ranks get the
+    same number of batches. Iteration can start at any batch, see load_state_dict, to resume an epoch.
+
+    Args:
+        group_ids (list[int]): The group id of every sample, in the range [0, num_groups).
+        batch_size (int): Size of mini-batch.
+        shuffle (bool): Whether the samples are permuted every epoch. With False, the permutation is the identity.
+        seed (int): The seed of the permutations. It must be the same on every rank.
+        num_replicas (int): The number of distributed processes.
+        rank (int): The rank of this process.
+
+    Usage:
+        sampler = GroupedBatchPlanSampler(group_ids, batch_size, num_replicas=world_size, rank=rank)
+        for epoch in range(epochs):
+            sampler.set_epoch(epoch)
+            data_loader = DataLoader(dataset, batch_sampler=sampler)
+    """
+
+    def __init__(self, group_ids, batch_size, shuffle=True, seed=0, num_replicas=1, rank=0):
+        if not 0 <= rank < num_replicas:
+            raise ValueError(f"rank should be in [0, {num_replicas}), got {rank}")
+        self.group_ids = np.asarray(group_ids, dtype=np.int64)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.start_batch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self.start_batch = 0
+
+    def plan(self, epoch=None):
+        """
+        Returns the batch plan of all the ranks for an epoch (default: the current one), see the class docstring.
+        """
+        epoch = self.epoch if epoch is None else epoch
+        num_samples = len(self.group_ids)
+        if self.shuffle:
+            permutation = np.random.default_rng([self.seed, epoch]).permutation(num_samples)
+        else:
+            permutation = np.arange(num_samples)
+        # positions in the permutation, sorted by group and in permutation order within a group
+        positions = np.argsort(self.group_ids[permutation], kind="stable")
+        ordered = permutation[positions]
+        _, group_starts, group_counts = np.unique(self.group_ids[ordered], return_index=True, return_counts=True)
+
+        # full batches: the first batch_size * (count // batch_size) samples of every group
+        num_full = group_counts // self.batch_size
+        full_starts = np.repeat(group_starts, num_full) + self.batch_size * (
+            np.arange(num_full.sum()) - np.repeat(np.cumsum(num_full) - num_full, num_full)
+        )
+        full = ordered[full_starts[:, None] + np.arange(self.batch_size)]
+        full = full[np.argsort(positions[full_starts + self.batch_size - 1], kind="stable")]
+
+        # incomplete batches: the remainders of the groups, largest first. GroupedBatchSampler breaks ties by
+        # the order in which it (re)created the buffers: at the last sample of the last full batch of a group,
+        # or at its first sample if it has no full batch
+        remainders = group_counts - num_full * self.batch_size
+        num_incomplete = num_samples // self.batch_size - len(full)
+        buffer_starts = positions[group_starts + np.maximum(num_full * self.batch_size - 1, 0)]
+        incomplete = []
+        for g in np.lexsort((buffer_starts, -remainders))[:num_incomplete]:
+            group = ordered[group_starts[g] : group_starts[g] + group_counts[g]]
+            # np.resize repeats the group cyclically, as _repeat_to_at_least does
+            padding = np.resize(group, self.batch_size - remainders[g])
+            incomplete.append(np.concatenate([group[len(group) - remainders[g] :], padding]))
+        if incomplete:
+            full = np.concatenate([full, np.stack(incomplete)])
+        return full.reshape(-1, self.batch_size).astype(np.int64)
+
+    def local_plan(self, epoch=None):
+        """
+        Returns the batches of this rank for an epoch (default: the current one).
+        """
+        plan = self.plan(epoch)
+        if self.num_replicas == 1:
+            return plan
+        num_batches = math.ceil(len(plan) / self.num_replicas) * self.num_replicas
+        if len(plan):
+            plan = plan[np.arange(num_batches) % len(plan)]
+        return plan[self.rank :: self.num_replicas]
+
+    def state_dict(self, num_consumed=0):
+        """
+        Returns the position of the sampler after num_consumed more batches of the current epoch were consumed.
+        """
+        return {"epoch": self.epoch, "start_batch": self.start_batch + num_consumed, "seed": self.seed}
+
+    def load_state_dict(self, state_dict):
+        """
+        Makes the next iteration continue an epoch at the batch of state_dict, see state_dict.
+        """
+        self.seed = state_dict["seed"]
+        self.epoch = state_dict["epoch"]
+        self.start_batch = state_dict["start_batch"]
+
+    def __iter__(self):
+        for batch in self.local_plan()[self.start_batch :]:
+            yield batch.tolist()
+
+    def __len__(self):
+        num_batches = len(self.group_ids) // self.batch_size
+        return max(math.ceil(num_batches / self.num_replicas) - self.start_batch, 0)
+
+
 def _compute_aspect_ratios_slow(dataset, indices=None):
     print(
         "Your dataset doesn't support the fast path for "
-        "computing the aspect ratios, so will iterate over "
+        "computing the aspect ratios (get_image_path or "
+        "get_height_and_width), so will iterate over "
         "the full dataset and load every image instead. "
         "This might take some time..."
     )
@@ -118,6 +250,176 @@ def _compute_aspect_ratios_slow(dataset, indices=None):
     return aspect_ratios
 
 
+def _exif_orientation(tiff):
+    # Orientation tag (0x0112) of the first IFD of a TIFF header, 1 (upright) if absent
+    if len(tiff) < 8:
+        return 1
+    endian = "<" if tiff[:2] == b"II" else ">"
+    offset = struct.unpack(endian + "I", tiff[4:8])[0]
+    if offset + 2 > len(tiff):
+        return 1
+    (count,) = struct.unpack(endian + "H", tiff[offset : offset + 2])
+    for entry in range(offset + 2, min(offset + 2 + 12 * count, len(tiff) - 11), 12):
+        tag, _, _, value = struct.unpack(endian + "HHIH", tiff[entry : entry + 10])
+        if tag == 0x0112:
+            return value
+    return 1
+
+
+def _read_jpeg_size(f):
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        # markers without a segment
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        if marker in _JPEG_SOF_MARKERS:
+            header = f.read(5)
+            if len(header) < 5:
+                return None
+            _, height, width = struct.unpack(">BHH", header)
+            return height, width, orientation
+        segment = f.read(struct.unpack(">H", length)[0] - 2)
+        if marker == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+            orientation = _exif_orientation(segment[6:])
+
+
+def read_image_size(path, apply_exif_orientation=False):
+    """
+    Returns the (height, width) of an image from its header, without decoding the pixels.
+
+    JPEG (SOF segment) and PNG (IHDR chunk) headers are parsed directly, the other formats are read with PIL,
+    which also only reads the header. By default, this is the stored size that PIL reports, as the
+    get_height_and_width of the datasets and the COCO annotations do. With apply_exif_orientation, the size of
+    a JPEG image rotated by its EXIF orientation is swapped, as the image returned by cv2.imread is.
+    """
+    with open(path, "rb") as f:
+        header = f.read(24)
+        if header.startswith(_PNG_SIGNATURE) and header[12:16] == b"IHDR":
+            width, height = struct.unpack(">II", header[16:24])
+            return height, width
+        if header.startswith(b"\xff\xd8"):
+            f.seek(2)
+            size = _read_jpeg_size(f)
+            if size is not None:
+                height, width, orientation = size
+                if apply_exif_orientation and orientation in (5, 6, 7, 8):
+                    return width, height
+                return height, width
+    with Image.open(path) as img:
+        width, height = img.size
+    return height, width
+
+
+def default_image_size_cache_path(image_dir):
+    """
+    Returns the default cache file of the image sizes of image_dir, in the user cache directory
+    ($XDG_CACHE_HOME, or ~/.cache), so that read-only dataset directories work and stay untouched.
+    """
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    key = hashlib.sha1(os.path.abspath(image_dir).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, "roller_image_sizes", f"image_sizes_{key}.npz")
+
+
+def _load_image_size_cache(cache_path, apply_exif_orientation):
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    try:
+        with np.load(cache_path) as data:
+            if int(data["version"]) != IMAGE_SIZE_CACHE_VERSION:
+                return {}
+            if bool(data["exif_orientation"]) != apply_exif_orientation:
+                return {}
+            return {
+                path: (mtime, height, width)
+                for path, mtime, height, width in zip(
+                    data["paths"].tolist(), data["mtimes"].tolist(), data["heights"].tolist(), data["widths"].tolist()
+                )
+            }
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def _save_image_size_cache(cache_path, entries, apply_exif_orientation):
+    paths = list(entries)
+    values = np.asarray([entries[path] for path in paths], dtype=np.int64).reshape(-1, 3)
+    tmp_path = cache_path + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                version=np.int64(IMAGE_SIZE_CACHE_VERSION),
+                exif_orientation=np.bool_(apply_exif_orientation),
+                paths=np.asarray(paths, dtype=np.str_),
+                mtimes=values[:, 0],
+                heights=values[:, 1].astype(np.int32),
+                widths=values[:, 2].astype(np.int32),
+            )
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Could not write the image size cache {cache_path}: {e}")
+
+
+def read_image_sizes(paths, cache_path=None, num_workers=None, apply_exif_orientation=False):
+    """
+    Returns the (height, width) of every image of paths, see read_image_size.
+
+    The headers are read by a pool of num_workers threads (default: 4 per CPU, at most 32). The sizes are
+    cached in cache_path, by default the default_image_size_cache_path of the common directory of the images,
+    keyed by the path and the modification time of the files: on the next call, only the new and modified
+    files are read. Pass cache_path=False to disable the cache.
+    """
+    if not paths:
+        return []
+    paths = [os.path.abspath(path) for path in paths]
+    if cache_path is None:
+        cache_path = default_image_size_cache_path(os.path.commonpath([os.path.dirname(path) for path in paths]))
+    num_workers = num_workers or min(32, 4 * (os.cpu_count() or 1))
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        mtimes = list(executor.map(lambda path: os.stat(path).st_mtime_ns, paths, chunksize=256))
+        cache = _load_image_size_cache(cache_path, apply_exif_orientation)
+        sizes = [None] * len(paths)
+        missing = []
+        for i, (path, mtime) in enumerate(zip(paths, mtimes)):
+            cached = cache.get(path)
+            if cached is not None and cached[0] == mtime:
+                sizes[i] = cached[1:]
+            else:
+                missing.append(i)
+        sizes_of_missing = executor.map(
+            lambda i: read_image_size(paths[i], apply_exif_orientation), missing, chunksize=64
+        )
+        for i, size in zip(missing, sizes_of_missing):
+            sizes[i] = size
+
+    if missing and cache_path:
+        for i in missing:
+            cache[paths[i]] = (mtimes[i],) + tuple(sizes[i])
+        _save_image_size_cache(cache_path, cache, apply_exif_orientation)
+    return [tuple(size) for size in sizes]
+
+
+def _compute_aspect_ratios_from_headers(dataset, indices=None, cache_path=None):
+    if indices is None:
+        indices = range(len(dataset))
+    start = time.time()
+    sizes = read_image_sizes([dataset.get_image_path(i) for i in indices], cache_path)
+    print(f"Read the sizes of {len(sizes)} images in {time.time() - start:.2f}s")
+    return [float(width) / float(height) for height, width in sizes]
+
+
 def _compute_aspect_ratios_custom_dataset(dataset, indices=None):
     if indices is None:
         indices = range(len(dataset))
@@ -152,15 +454,19 @@ def _compute_aspect_ratios_voc_dataset(dataset, indices=None):
     return aspect_ratios
 
 
-def _compute_aspect_ratios_subset_dataset(dataset, indices=None):
+def _compute_aspect_ratios_subset_dataset(dataset, indices=None, cache_path=None):
     if indices is None:
         indices = range(len(dataset))
 
     ds_indices = [dataset.indices[i] for i in indices]
-    return compute_aspect_ratios(dataset.dataset, ds_indices)
+    return compute_aspect_ratios(dataset.dataset, ds_indices, cache_path)
+
 
+def compute_aspect_ratios(dataset, indices=None, cache_path=None):
+    # datasets of image files only need their headers, read in parallel and cached (see read_image_sizes)
+    if hasattr(dataset, "get_image_path"):
+        return _compute_aspect_ratios_from_headers(dataset, indices, cache_path)
 
-def compute_aspect_ratios(dataset, indices=None):
     if hasattr(dataset, "get_height_and_width"):
         return _compute_aspect_ratios_custom_dataset(dataset, indices)
 
@@ -171,7 +477,7 @@ def compute_aspect_ratios(dataset, indices=None):
         return _compute_aspect_ratios_voc_dataset(dataset, indices)
 
     if isinstance(dataset, torch.utils.data.Subset):
-        return _compute_aspect_ratios_subset_dataset(dataset, indices)
+        return _compute_aspect_ratios_subset_dataset(dataset, indices, cache_path)
 
     # slow path
     return _compute_aspect_ratios_slow(dataset, indices)
@@ -184,8 +490,8 @@ def _quantize(x, bins):
     return quantized
 
 
-def create_aspect_ratio_groups(dataset, k=0):
-    aspect_ratios = compute_aspect_ratios(dataset)
+def create_aspect_ratio_groups(dataset, k=0, cache_path=None):
+    aspect_ratios = compute_aspect_ratios(dataset, cache_path=cache_path)
     bins = (2 ** np.linspace(-1, 1, 2 * k + 1)).tolist() if k > 0 else [1.0]
     groups = _quantize(aspect_ratios, bins)
     # count number of elements per group
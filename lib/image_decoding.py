@@ -0,0 +1,162 @@
+import math
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# JPEG DCT scaling: libjpeg can decode directly at 1/2, 1/4 and 1/8 of the full resolution
+_REDUCED_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def get_reduction_factor(height, width, target_height, target_width):
+    """
+    Return the largest JPEG DCT reduction factor that still decodes an image at least as large as the target.
+
+    Parameters:
+    height (int): The full height of the image.
+    width (int): The full width of the image.
+    target_height (int): The height the image is resized to after decoding.
+    target_width (int): The width the image is resized to after decoding.
+
+    Returns:
+    int: 8, 4 or 2, or 1 if the image is not more than twice the target size in both dimensions.
+
+    The decoded image is never smaller than the target, so the final resize only scales down.
+    """
+    for factor in (8, 4, 2):
+        if math.ceil(height / factor) >= target_height and math.ceil(width / factor) >= target_width:
+            return factor
+    return 1
+
+
+def read_image(image_path, target_size=None):
+    """
+    Decode an image as an RGB array, at a reduced resolution when the final size allows it.
+
+    Parameters:
+    image_path (str): The path to the image.
+    target_size (tuple): The (height, width) the image is resized to afterwards, or None to decode at full resolution.
+
+    Returns:
+    tuple: A tuple containing two elements:
+           - The decoded image in RGB format.
+           - The (x, y) scale of the decoded image relative to the full resolution image, to apply to its annotations.
+
+    Raises:
+    FileNotFoundError: If the image cannot be read.
+
+    JPEG images are decoded by cv2.imread with IMREAD_REDUCED_COLOR_2/4/8, which scales the DCT blocks
+    instead of decoding every pixel, see get_reduction_factor. Other formats are decoded at full resolution.
+    As with cv2.imread, the EXIF orientation is applied.
+    """
+    factor = 1
+    full_height = full_width = None
+    if target_size is not None:
+        with Image.open(image_path) as img:
+            full_width, full_height = img.size
+            is_jpeg = img.format == "JPEG"
+            # cv2.imread rotates the image by its EXIF orientation, the header size is the stored one
+            if is_jpeg and img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                full_width, full_height = full_height, full_width
+        if is_jpeg:
+            factor = get_reduction_factor(full_height, full_width, *target_size)
+
+    image = cv2.imread(image_path, _REDUCED_FLAGS.get(factor, cv2.IMREAD_COLOR))
+    if image is None:
+        raise FileNotFoundError(f"Could not read image {image_path}")
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    if factor == 1:
+        return image, (1.0, 1.0)
+    return image, (image.shape[1] / full_width, image.shape[0] / full_height)
+
+
+def scale_data_for_augmentation(bboxes, keypoints, scale):
+    """
+    Scale the boxes and keypoints returned by convert_data_for_augmentation to a reduced image, see read_image.
+
+    Parameters:
+    bboxes (list): A list of bounding boxes as (xmin, ymin, xmax, ymax, label).
+    keypoints (list): A list of keypoints as (x, y).
+    scale (tuple): The (x, y) scale of the decoded image.
+
+    Returns:
+    tuple: The scaled bounding boxes and keypoints, in the same formats.
+    """
+    scale_x, scale_y = scale
+    if scale_x == 1.0 and scale_y == 1.0:
+        return bboxes, keypoints
+    scaled_bboxes = [
+        [bbox[0] * scale_x, bbox[1] * scale_y, bbox[2] * scale_x, bbox[3] * scale_y] + list(bbox[4:]) for bbox in bboxes
+    ]
+    scaled_keypoints = [(keypoint[0] * scale_x, keypoint[1] * scale_y) for keypoint in keypoints]
+    return scaled_bboxes, scaled_keypoints
+
+
+def check_reduced_decoding(image_paths, target_size=(360, 640), interpolation=cv2.INTER_LINEAR):
+    """
+    Compare reduced decoding to full resolution decoding, both followed by the same final resize.
+
+    Parameters:
+    image_paths (list): The images to compare.
+    target_size (tuple): The (height, width) of the final resize.
+    interpolation (int): The interpolation of the final resize. INTER_LINEAR is the default of A.Resize.
+
+    Returns:
+    dict: A dictionary with one entry per image in 'images' (its path, reduction factor, mean and max absolute
+      pixel difference and PSNR in dB) and the worst values over all images in 'mean_abs_diff', 'max_abs_diff'
+      and 'min_psnr'.
+    """
+    target_height, target_width = target_size
+    images = []
+    for image_path in image_paths:
+        full, _ = read_image(image_path)
+        reduced, scale = read_image(image_path, target_size)
+        full = cv2.resize(full, (target_width, target_height), interpolation=interpolation)
+        reduced = cv2.resize(reduced, (target_width, target_height), interpolation=interpolation)
+        diff = np.abs(full.astype(np.int16) - reduced.astype(np.int16))
+        mse = float(np.mean(diff.astype(np.float32) ** 2))
+        images.append({
+            "path": image_path,
+            "factor": round(1 / scale[0]) if scale[0] < 1 else 1,
+            "mean_abs_diff": float(diff.mean()),
+            "max_abs_diff": int(diff.max()),
+            "psnr": 10 * math.log10(255 ** 2 / mse) if mse > 0 else math.inf,
+        })
+    return {
+        "images": images,
+        "mean_abs_diff": max((image["mean_abs_diff"] for image in images), default=0.0),
+        "max_abs_diff": max((image["max_abs_diff"] for image in images), default=0),
+        "min_psnr": min((image["psnr"] for image in images), default=math.inf),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+
+    parser = argparse.ArgumentParser(description="Check the accuracy of reduced JPEG decoding")
+    parser.add_argument("--img-dir", required=True, type=str, help="images directory")
+    parser.add_argument("--num-images", default=50, type=int, help="number of images to check (default: 50)")
+    parser.add_argument("--height", default=360, type=int, help="final height (default: 360)")
+    parser.add_argument("--width", default=640, type=int, help="final width (default: 640)")
+    parser.add_argument(
+        "--tolerance", default=2.0, type=float, help="maximum mean absolute pixel difference, in 0-255 (default: 2.0)"
+    )
+    args = parser.parse_args()
+    image_files = sorted(f for f in os.listdir(args.img_dir) if f.endswith('.jpg') or f.endswith('.png'))
+    report = check_reduced_decoding(
+        [os.path.join(args.img_dir, f) for f in image_files[: args.num_images]], (args.height, args.width)
+    )
+    for image in report["images"]:
+        print("{path}: 1/{factor}, mean abs diff {mean_abs_diff:.3f}, max abs diff {max_abs_diff}, "
+              "PSNR {psnr:.1f} dB".format(**image))
+    print("Worst mean abs diff {:.3f}, max abs diff {}, min PSNR {:.1f} dB".format(
+        report["mean_abs_diff"], report["max_abs_diff"], report["min_psnr"]))
+    if report["mean_abs_diff"] > args.tolerance:
+        print("Mean absolute difference above the tolerance of {}".format(args.tolerance))
+        sys.exit(1)
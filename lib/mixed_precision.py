@@ -0,0 +1,60 @@
+import torch
+
+AMP_DTYPES = {"bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+def _to_float32(obj):
+    if isinstance(obj, torch.Tensor):
+        return obj.float() if obj.is_floating_point() else obj
+    if isinstance(obj, dict):
+        return type(obj)((k, _to_float32(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return [_to_float32(v) for v in obj]
+    if isinstance(obj, tuple):
+        return tuple(_to_float32(v) for v in obj)
+    return obj
+
+
+def _float32_inputs_hook(module, args):
+    return _to_float32(args)
+
+
+def _float32_output_hook(module, args, output):
+    return _to_float32(output)
+
+
+def keep_sensitive_ops_in_float32(model):
+    """
+    Keeps the numerically sensitive parts of a Faster/Keypoint R-CNN model in float32 under autocast.
+
+    - The RoIAlign poolers get float32 features. roi_align is not on the autocast lists, so it then runs in float32.
+    - The box and keypoint predictors return float32 outputs, so that the box decoding, the keypoint heatmap
+      decoding (heatmaps_to_keypoints) and the losses computed from them run in float32.
+
+    This uses forward hooks, so the module structure and the state dict keys do not change. Calling it again
+    on the same model does nothing.
+    """
+    if isinstance(model, torch.nn.parallel.DistributedDataParallel):
+        model = model.module
+    if getattr(model, "_float32_hooks", False):
+        return model
+    roi_heads = model.roi_heads
+    for name in ("box_roi_pool", "mask_roi_pool", "keypoint_roi_pool"):
+        pooler = getattr(roi_heads, name, None)
+        if pooler is not None:
+            pooler.register_forward_pre_hook(_float32_inputs_hook)
+    for name in ("box_predictor", "mask_predictor", "keypoint_predictor"):
+        predictor = getattr(roi_heads, name, None)
+        if predictor is not None:
+            predictor.register_forward_hook(_float32_output_hook)
+    model._float32_hooks = True
+    return model
+
+
+def autocast(device, amp_dtype):
+    """
+    Returns the autocast context of the forward passes. With amp_dtype None, autocast is disabled.
+    """
+    device_type = device.type if isinstance(device, torch.device) else torch.device(device).type
+    return torch.autocast(device_type=device_type, dtype=amp_dtype, enabled=amp_dtype is not None)
+
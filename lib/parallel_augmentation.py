@@ -0,0 +1,153 @@
+import multiprocessing
+import os
+import cv2
+from augmentation_pipeline import RESIZE_SIZE, get_augmentation_pipelines, resize_pipeline
+from augmentation_utils import (
+    augment_from_shared_prefix,
+    convert_data_for_augmentation,
+    create_new_augmented_dataset,
+    get_path_for_saving_augmented_image,
+    get_path_for_saving_augmented_json,
+    seed_augmentation,
+)
+from augmentation_writer import AugmentationWriter
+from image_decoding import read_image, scale_data_for_augmentation
+from shared_utils import get_class_labels
+
+# Per-process state, filled in by _init_worker so that every worker owns its own pipelines
+_worker_resize_pipeline = None
+_worker_pipelines = None
+_worker_class_labels = None
+_worker_writer = None
+
+
+def _init_worker(writer_threads):
+    """
+    Build the albumentations pipelines of a worker process.
+
+    Parameters:
+    writer_threads (int): The number of AugmentationWriter threads of the worker, 0 to write synchronously.
+
+    Returns:
+    None
+
+    OpenCV threading is disabled inside the workers, since the parallelism already comes from the
+    process pool and nested thread pools would oversubscribe the cores.
+    """
+    global _worker_resize_pipeline, _worker_pipelines, _worker_class_labels, _worker_writer
+    cv2.setNumThreads(0)
+    _worker_resize_pipeline = resize_pipeline()
+    _worker_pipelines = get_augmentation_pipelines(include_resize=False)
+    _worker_class_labels = get_class_labels()
+    _worker_writer = AugmentationWriter(num_threads=writer_threads)
+
+
+def augment_single_file(task):
+    """
+    Apply every requested augmentation to one source image and write the results.
+
+    Parameters:
+    task (tuple): A tuple of (json_file, json_dir, image_dir, output_json_dir, output_image_dir, transformations, base_seed,
+      reduced_decoding).
+
+    Returns:
+    dict: A dictionary with the keys 'json_file', 'outputs' (dict mapping each successful augmentation type to its written
+      [json_path, image_path]) and 'errors' (list of failure messages).
+
+    The image is looked up in image_dir by replacing the extension of json_file with ".jpg", which is the
+    same convention as get_image_file_and_path_and_renderable_image_from_json. The image is decoded and
+    resized once, and only the transform-specific tails are applied per augmentation type. Outputs are
+    written by the worker's AugmentationWriter while the next types are computed, and flushed before returning.
+    """
+    json_file, json_dir, image_dir, output_json_dir, output_image_dir, transformations, base_seed, reduced_decoding = task
+    result = {"json_file": json_file, "outputs": {}, "errors": []}
+
+    image_path = os.path.join(image_dir, os.path.splitext(json_file)[0] + ".jpg")
+    try:
+        image, scale = read_image(image_path, RESIZE_SIZE if reduced_decoding else None)
+        annotation, bbox_data_for_albumentations, keypoints_data_for_albumentations = convert_data_for_augmentation(
+            os.path.join(json_dir, json_file)
+        )
+        bbox_data_for_albumentations, keypoints_data_for_albumentations = scale_data_for_augmentation(
+            bbox_data_for_albumentations, keypoints_data_for_albumentations, scale
+        )
+        resized = _worker_resize_pipeline(
+            image=image,
+            bboxes=bbox_data_for_albumentations,
+            keypoints=keypoints_data_for_albumentations,
+            class_labels=_worker_class_labels,
+        )
+    except Exception:
+        result["errors"].extend(
+            "Failed to augment {} of type {}".format(json_file, transformation) for transformation in transformations
+        )
+        return result
+
+    for transformation in transformations:
+        try:
+            pipeline = _worker_pipelines[transformation]
+            seed_augmentation(pipeline, json_file, transformation, base_seed)
+            augmented = augment_from_shared_prefix(resized, pipeline, _worker_class_labels)
+            new_augmented_json_data = create_new_augmented_dataset(annotation, augmented)
+
+            augmented_json_output_filename = get_path_for_saving_augmented_json(json_file, output_json_dir, transformation)
+            augmented_image_output_filename = get_path_for_saving_augmented_image(json_file, output_image_dir, transformation)
+            _worker_writer.submit(augmented_json_output_filename, new_augmented_json_data, augmented_image_output_filename, augmented)
+            result["outputs"][transformation] = [augmented_json_output_filename, augmented_image_output_filename]
+        except Exception:
+            result["errors"].append("Failed to augment {} of type {}".format(json_file, transformation))
+
+    _worker_writer.flush()
+    for failed in _worker_writer.pop_failed():
+        for transformation, outputs in list(result["outputs"].items()):
+            if tuple(outputs) == failed:
+                del result["outputs"][transformation]
+        result["errors"].append("Failed to write {}".format(failed[1]))
+    return result
+
+
+def run_parallel_augmentation(jobs, json_dir, image_dir, output_json_dir, output_image_dir, num_workers,
+                              base_seed=0, writer_threads=2, on_file_done=None, chunksize=4, progress_every=100,
+                              reduced_decoding=False):
+    """
+    Distribute the augmentation of a list of annotation files over a pool of worker processes.
+
+    Parameters:
+    jobs (list): A list of (json_file, transformations) tuples, giving for each JSON file name the augmentation
+      type names to apply, see get_augmentation_pipelines.
+    json_dir (str): The directory containing the JSON files.
+    image_dir (str): The directory containing the source images.
+    output_json_dir (str): The directory where the augmented JSON files will be saved.
+    output_image_dir (str): The directory where the augmented images will be saved.
+    num_workers (int): The number of worker processes.
+    base_seed (int): The run-wide seed passed to seed_augmentation.
+    writer_threads (int): The number of AugmentationWriter threads per worker, 0 to write synchronously.
+    on_file_done (callable): Optional, called in the parent as on_file_done(json_file, outputs) once the outputs
+      of a file are on disk, with outputs as in the result of augment_single_file.
+    chunksize (int): The number of files handed to a worker at once.
+    progress_every (int): Print a progress line every progress_every finished files.
+    reduced_decoding (bool): Decode the JPEG sources directly at a reduced resolution that is not below the resize
+      size, see image_decoding.read_image.
+
+    Returns:
+    list: The failure messages collected from all workers.
+
+    Each worker builds its own pipelines once and seeds them per file, so the outputs do not depend on
+    num_workers. Workers do not print anything; progress and failures are aggregated in the parent.
+    """
+    tasks = [
+        (json_file, json_dir, image_dir, output_json_dir, output_image_dir, list(transformations), base_seed, reduced_decoding)
+        for json_file, transformations in jobs
+    ]
+    error_log = []
+    num_written = 0
+    with multiprocessing.Pool(processes=num_workers, initializer=_init_worker, initargs=(writer_threads,)) as pool:
+        for done, result in enumerate(pool.imap_unordered(augment_single_file, tasks, chunksize=chunksize), 1):
+            num_written += 2 * len(result["outputs"])
+            error_log.extend(result["errors"])
+            if on_file_done is not None:
+                on_file_done(result["json_file"], result["outputs"])
+            if done % progress_every == 0 or done == len(tasks):
+                print("[{}/{}] augmented, {} files written, {} failures".format(
+                    done, len(tasks), num_written, len(error_log)))
+    return error_log
@@ -0,0 +1,122 @@
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+
+
+def _decode_image(image):
+    if isinstance(image, (str, os.PathLike)):
+        path = image
+        image = cv2.imread(os.fspath(path))
+        if image is None:
+            raise FileNotFoundError(f"Could not read image {path}")
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    # Same conversion as torchvision.transforms.ToTensor on an RGB uint8 array
+    return torch.from_numpy(np.ascontiguousarray(image)).permute(2, 0, 1).to(torch.float32).div_(255)
+
+
+class RollerPredictor:
+    """
+    Batched Keypoint R-CNN inference returning the top-1 detection of every image.
+
+    The model is put in eval mode once. Images are decoded by a pool of background threads while the
+    previous batch runs through the model under torch.inference_mode, in fixed-size batches.
+
+    Args:
+        model (nn.Module): A Keypoint R-CNN model.
+        device (torch.device): The device the model runs on.
+        batch_size (int): The number of images per forward pass.
+        num_workers (int): The number of decoding threads.
+        prefetch_batches (int): The number of batches decoded ahead of the model.
+
+    Usage:
+        predictor = RollerPredictor(model, device)
+        result = predictor.predict(image_paths)
+        result["boxes"][i], result["keypoints"][i], result["scores"][i]
+    """
+
+    def __init__(self, model, device, batch_size=8, num_workers=4, prefetch_batches=2):
+        self.model = model.to(device)
+        self.model.eval()
+        self.device = device
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.prefetch_batches = prefetch_batches
+        try:
+            self.num_keypoints = model.roi_heads.keypoint_predictor.kps_score_lowres.out_channels
+        except AttributeError:
+            self.num_keypoints = 1
+
+    @classmethod
+    def from_file(cls, model_path, device, **kwargs):
+        """
+        Creates a predictor from a model saved with torch.save(model, model_path).
+        """
+        return cls(torch.load(model_path, map_location=device), device, **kwargs)
+
+    def _decoded_batches(self, inputs):
+        iterator = iter(inputs)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+
+            def fill():
+                while len(pending) < self.prefetch_batches:
+                    chunk = list(itertools.islice(iterator, self.batch_size))
+                    if not chunk:
+                        return
+                    pending.append([executor.submit(_decode_image, image) for image in chunk])
+
+            fill()
+            while pending:
+                futures = pending.popleft()
+                fill()
+                yield [future.result() for future in futures]
+
+    def _top1(self, outputs):
+        n = len(outputs)
+        result = {
+            "boxes": np.zeros((n, 4), dtype=np.float32),
+            "scores": np.zeros(n, dtype=np.float32),
+            "keypoints": np.zeros((n, self.num_keypoints, 3), dtype=np.float32),
+            "keypoints_scores": np.zeros((n, self.num_keypoints), dtype=np.float32),
+            "detected": np.zeros(n, dtype=bool),
+        }
+        for i, output in enumerate(outputs):
+            if len(output["scores"]) == 0:
+                continue
+            best = int(torch.argmax(output["scores"]))
+            result["boxes"][i] = output["boxes"][best].cpu().numpy()
+            result["scores"][i] = float(output["scores"][best])
+            result["keypoints"][i] = output["keypoints"][best].cpu().numpy()
+            result["keypoints_scores"][i] = output["keypoints_scores"][best].cpu().numpy()
+            result["detected"][i] = True
+        return result
+
+    @torch.inference_mode()
+    def predict_batches(self, inputs):
+        """
+        Yields the top-1 result of every batch, see predict. Use this to stream over large directories.
+        """
+        for images in self._decoded_batches(inputs):
+            images = [image.to(self.device) for image in images]
+            yield self._top1(self.model(images))
+
+    def predict(self, inputs):
+        """
+        Runs the detector on a list or an iterator of image paths or RGB uint8 arrays.
+
+        Returns a dict of arrays with one entry per input image:
+            boxes (N, 4): xyxy box of the highest scoring detection.
+            scores (N,): its score.
+            keypoints (N, K, 3): its keypoints as (x, y, visibility).
+            keypoints_scores (N, K): its keypoint scores.
+            detected (N,): False for the images without any detection, whose other entries are zero.
+        """
+        results = list(self.predict_batches(inputs))
+        if not results:
+            return self._top1([])
+        return {k: np.concatenate([r[k] for r in results]) for k in results[0]}
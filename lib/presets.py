@@ -3,8 +3,35 @@ import transforms as T
 
 
 class DetectionPresetTrain:
-    def __init__(self, data_augmentation, hflip_prob=0.5, mean=(123.0, 117.0, 104.0)):
-        if data_augmentation == "hflip":
+    """
+    With batched, the transforms of the dataset only crop the images and convert them to uint8 tensors, in the
+    data loader workers. The data loader then collates the batches with T.collate_uint8_batch, and
+    batch_transform applies the other augmentations to whole batches, e.g. on the device of the model.
+    RandomIoUCrop changes the sizes of the images, so with the "ssd" policy it runs before the zoom out.
+    """
+
+    def __init__(self, data_augmentation, hflip_prob=0.5, mean=(123.0, 117.0, 104.0), batched=False):
+        self.batch_transforms = None
+        if batched:
+            if data_augmentation == "hflip":
+                sample_transforms = [T.PILToTensor()]
+                batch_transforms = [T.BatchConvertImageDtype(torch.float), T.BatchRandomHorizontalFlip(p=hflip_prob)]
+            elif data_augmentation == "ssd":
+                sample_transforms = [T.RandomIoUCrop(), T.PILToTensor()]
+                batch_transforms = [
+                    T.BatchConvertImageDtype(torch.float),
+                    T.BatchRandomPhotometricDistort(),
+                    T.BatchRandomZoomOut(fill=list(mean)),
+                    T.BatchRandomHorizontalFlip(p=hflip_prob),
+                ]
+            elif data_augmentation == "ssdlite":
+                sample_transforms = [T.RandomIoUCrop(), T.PILToTensor()]
+                batch_transforms = [T.BatchConvertImageDtype(torch.float), T.BatchRandomHorizontalFlip(p=hflip_prob)]
+            else:
+                raise ValueError(f'Unknown data augmentation policy "{data_augmentation}"')
+            self.transforms = T.Compose(sample_transforms)
+            self.batch_transforms = T.BatchCompose(batch_transforms)
+        elif data_augmentation == "hflip":
             self.transforms = T.Compose(
                 [
                     T.RandomHorizontalFlip(p=hflip_prob),
@@ -38,6 +65,10 @@ class DetectionPresetTrain:
     def __call__(self, img, target):
         return self.transforms(img, target)
 
+    def batch_transform(self, images, targets, image_sizes):
+        images, targets = self.batch_transforms(images, targets, image_sizes)
+        return T.split_batch(images, targets, image_sizes)
+
 
 class DetectionPresetEval:
     def __init__(self):
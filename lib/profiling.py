@@ -0,0 +1,45 @@
+import os
+
+import torch
+import torch.profiler
+
+
+def _export_handler(output_dir, name, sort_by, row_limit):
+    def on_trace_ready(prof):
+        os.makedirs(output_dir, exist_ok=True)
+        prof.export_chrome_trace(os.path.join(output_dir, f"trace_{name}_{prof.step_num}.json"))
+        table = prof.key_averages(group_by_input_shape=True).table(sort_by=sort_by, row_limit=row_limit)
+        with open(os.path.join(output_dir, f"top_ops_{name}_{prof.step_num}.txt"), "w") as f:
+            f.write(table)
+        print(prof.key_averages().table(sort_by=sort_by, row_limit=min(row_limit, 15)))
+
+    return on_trace_ready
+
+
+def profile_window(output_dir, name="train", skip=10, warmup=2, active=5, row_limit=40):
+    """
+    Returns a torch.profiler.profile recording one window of iterations of a training or evaluation loop.
+
+    The first skip iterations are not profiled, the next warmup ones are profiled and discarded, and the next
+    active ones are recorded with CPU (and CUDA if available) op times, memory and input shapes. When the window
+    ends, a Chrome trace (trace_{name}_{step}.json, open it in chrome://tracing or Perfetto) and a table of the
+    top ops by self CPU time (top_ops_{name}_{step}.txt) are written to output_dir.
+
+    The loop must call step() on the profiler after every iteration, see the profiler argument of
+    engine.train_one_epoch and engine.evaluate.
+
+    Usage:
+        with profile_window(output_dir, "train", skip=10, warmup=2, active=5) as prof:
+            train_one_epoch(model, optimizer, data_loader, device, epoch, print_freq, profiler=prof)
+    """
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    sort_by = "self_cpu_time_total"
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    return torch.profiler.profile(
+        activities=activities,
+        schedule=torch.profiler.schedule(wait=skip, warmup=warmup, active=active, repeat=1),
+        on_trace_ready=_export_handler(output_dir, name, sort_by, row_limit),
+        record_shapes=True,
+        profile_memory=True,
+    )
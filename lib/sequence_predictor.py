@@ -0,0 +1,166 @@
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from lib.predictor import RollerPredictor
+
+
+class SequencePredictor(RollerPredictor):
+    """
+    Tracking-assisted Keypoint R-CNN inference over an ordered sequence of frames.
+
+    The full detector only runs on keyframes: every keyframe_interval frames, and whenever the propagated
+    detection of a frame scores below score_threshold. On the other frames, the previous box is propagated:
+    the backbone and the ROI heads (box and keypoint) run on a search window around the last box only, with
+    the last box and a few jittered copies of it as proposals, skipping the RPN. The search window is resized
+    with the same factor as a full frame, so the features match the ones of the full detector.
+
+    Args:
+        model (nn.Module): A Keypoint R-CNN model.
+        device (torch.device): The device the model runs on.
+        keyframe_interval (int): The maximum number of frames between two full detections.
+        score_threshold (float): Below this score, a propagated detection is replaced by a full detection.
+        search_scale (float): The size of the search window relative to the last box.
+        min_search_size (int): The minimum side of the search window, in frame pixels.
+        num_workers (int): The number of decoding threads.
+
+    Usage:
+        predictor = SequencePredictor(model, device, keyframe_interval=10, score_threshold=0.5)
+        result, stats = predictor.predict_sequence(frame_paths)
+        print(predictor.compare_with_full_detection(frame_paths))
+    """
+
+    def __init__(
+        self,
+        model,
+        device,
+        keyframe_interval=10,
+        score_threshold=0.5,
+        search_scale=2.0,
+        min_search_size=96,
+        num_workers=2,
+    ):
+        super().__init__(model, device, batch_size=1, num_workers=num_workers)
+        self.keyframe_interval = keyframe_interval
+        self.score_threshold = score_threshold
+        self.search_scale = search_scale
+        self.min_search_size = min_search_size
+
+    def _frame_scale(self, height, width):
+        # Same factor as GeneralizedRCNNTransform.resize applies to a full frame in eval mode
+        transform = self.model.transform
+        min_size = float(transform.min_size[-1])
+        max_size = float(transform.max_size)
+        return min(min_size / min(height, width), max_size / max(height, width))
+
+    def _search_window(self, box, height, width):
+        cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+        half_w = max((box[2] - box[0]) * self.search_scale, self.min_search_size) / 2
+        half_h = max((box[3] - box[1]) * self.search_scale, self.min_search_size) / 2
+        x0, y0 = int(max(cx - half_w, 0)), int(max(cy - half_h, 0))
+        x1, y1 = int(min(cx + half_w, width)), int(min(cy + half_h, height))
+        return x0, y0, x1, y1
+
+    def _propagate(self, image, box):
+        height, width = image.shape[-2:]
+        x0, y0, x1, y1 = self._search_window(box, height, width)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return None
+        crop = image[:, y0:y1, x0:x1]
+        scale = self._frame_scale(height, width)
+
+        transform = self.model.transform
+        resized = F.interpolate(
+            transform.normalize(crop)[None], scale_factor=scale, mode="bilinear", recompute_scale_factor=True, align_corners=False
+        )[0]
+        image_shapes = [tuple(resized.shape[-2:])]
+        batched = transform.batch_images([resized], size_divisible=getattr(transform, "size_divisible", 32))
+        features = self.model.backbone(batched)
+
+        # The last box and jittered copies of it, in resized search window coordinates
+        local = torch.tensor([box[0] - x0, box[1] - y0, box[2] - x0, box[3] - y0], dtype=torch.float32, device=self.device)
+        w, h = local[2] - local[0], local[3] - local[1]
+        center = (local[:2] + local[2:]) / 2
+        proposals = []
+        for dx, dy, s in [(0, 0, 1.0), (0, 0, 0.9), (0, 0, 1.1), (-0.1, 0, 1.0), (0.1, 0, 1.0), (0, -0.1, 1.0), (0, 0.1, 1.0)]:
+            c = center + torch.stack([dx * w, dy * h])
+            half = torch.stack([w, h]) * s / 2
+            proposals.append(torch.cat([c - half, c + half]))
+        proposals = torch.stack(proposals) * scale
+
+        detections, _ = self.model.roi_heads(features, [proposals], image_shapes)
+        detections = transform.postprocess(detections, image_shapes, [(y1 - y0, x1 - x0)])[0]
+        if len(detections["scores"]) == 0:
+            return None
+        offset = torch.tensor([x0, y0], dtype=torch.float32, device=detections["boxes"].device)
+        detections["boxes"] = detections["boxes"] + offset.repeat(2)
+        detections["keypoints"][..., :2] += offset
+        return detections
+
+    @torch.inference_mode()
+    def predict_sequence(self, frames):
+        """
+        Runs tracking-assisted detection on frames (paths or RGB uint8 arrays, in temporal order).
+
+        Returns:
+            result (dict): The top-1 arrays of every frame, in the format of RollerPredictor.predict.
+            stats (dict): The number of frames, keyframes (full detections) and propagated frames, and the achieved fps.
+        """
+        results = []
+        last_box = None
+        since_keyframe = 0
+        num_keyframes = 0
+        start = time.perf_counter()
+        for (image,) in self._decoded_batches(frames):
+            image = image.to(self.device)
+            top1 = None
+            if last_box is not None and since_keyframe < self.keyframe_interval - 1:
+                detections = self._propagate(image, last_box)
+                if detections is not None:
+                    top1 = self._top1([detections])
+                    if top1["scores"][0] < self.score_threshold:
+                        top1 = None
+            if top1 is None:
+                top1 = self._top1(self.model([image]))
+                num_keyframes += 1
+                since_keyframe = 0
+            else:
+                since_keyframe += 1
+            last_box = top1["boxes"][0].tolist() if top1["detected"][0] else None
+            results.append(top1)
+        elapsed = time.perf_counter() - start
+
+        result = {k: np.concatenate([r[k] for r in results]) for k in results[0]} if results else self._top1([])
+        stats = {
+            "frames": len(results),
+            "keyframes": num_keyframes,
+            "propagated": len(results) - num_keyframes,
+            "seconds": elapsed,
+            "fps": len(results) / elapsed if elapsed > 0 else 0.0,
+        }
+        return result, stats
+
+    def compare_with_full_detection(self, frames):
+        """
+        Times predict_sequence against a full detection on every frame.
+
+        frames must be a list (or any re-iterable sequence), since it is processed twice.
+
+        Returns a dict with the statistics of predict_sequence, the fps of full per-frame detection,
+        the speedup, and the mean absolute difference of the top-1 boxes and keypoints between both modes.
+        """
+        tracked, stats = self.predict_sequence(frames)
+        start = time.perf_counter()
+        full = self.predict(frames)
+        full_seconds = time.perf_counter() - start
+
+        both = tracked["detected"] & full["detected"]
+        stats["full_fps"] = len(full["scores"]) / full_seconds if full_seconds > 0 else 0.0
+        stats["speedup"] = stats["fps"] / stats["full_fps"] if stats["full_fps"] > 0 else 0.0
+        stats["box_mean_abs_diff"] = float(np.abs(tracked["boxes"][both] - full["boxes"][both]).mean()) if both.any() else 0.0
+        stats["keypoint_mean_abs_diff"] = (
+            float(np.abs(tracked["keypoints"][both][..., :2] - full["keypoints"][both][..., :2]).mean()) if both.any() else 0.0
+        )
+        return stats
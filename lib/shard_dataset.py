@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+
+SHARD_META_FILE_NAME = "shards.json"
+SHARD_ANNOTATION_FILE_NAME = "annotations.npy"
+SHARD_VERSION = 1
+
+
+def get_annotation_dtype(num_keypoints, file_name_length):
+    """
+    Returns the fixed-layout record type of the shard annotation table.
+
+    Parameters:
+    num_keypoints (int): The number of keypoints per object.
+    file_name_length (int): The maximum length of the source image file names.
+
+    Returns:
+    numpy.dtype: A structured dtype with one record per image: the shard number and the offset of the image
+    inside the shard, the box as stored in the annotation, the keypoints as (x, y, v) rows, the category id
+    and the source image file name.
+    """
+    return np.dtype(
+        [
+            ("shard", np.int32),
+            ("offset", np.int32),
+            ("box", np.float32, (4,)),
+            ("keypoints", np.float32, (num_keypoints, 3)),
+            ("category", np.int64),
+            ("file_name", "U{}".format(file_name_length)),
+        ]
+    )
+
+
+def _load_sample(img_dir, annot_dir, image_file, height, width):
+    image = cv2.imread(os.path.join(img_dir, image_file))
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    annotation_file = os.path.splitext(image_file)[0] + ".json"
+    with open(os.path.join(annot_dir, annotation_file), 'r') as f:
+        annotation = json.load(f)['annotations'][0]
+
+    box = np.asarray(annotation['bbox'], dtype=np.float32)
+    keypoints = np.asarray(annotation['keypoints'], dtype=np.float32).reshape(-1, 3)
+    original_height, original_width = image.shape[:2]
+    if (original_height, original_width) != (height, width):
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        scale = np.array([width / original_width, height / original_height], dtype=np.float32)
+        box = box * np.tile(scale, 2)
+        keypoints[:, :2] *= scale
+    return image, box, keypoints, annotation['category_id']
+
+
+def pack_roller_shards(img_dir, annot_dir, out_dir, images_per_shard=4096, height=360, width=640, num_threads=8):
+    """
+    Packs an images/annotations directory pair into memory-mappable shard files.
+
+    Parameters:
+    img_dir (str): The directory containing the images (.jpg or .png).
+    annot_dir (str): The directory containing one JSON annotation per image, with the same base name.
+    out_dir (str): The directory where the shards are written.
+    images_per_shard (int): The maximum number of images per shard file.
+    height (int): The height of the packed images. Images of another size are resized and their annotations scaled.
+    width (int): The width of the packed images.
+    num_threads (int): The number of threads decoding the source images.
+
+    Returns:
+    int: The number of packed images.
+
+    The output directory contains:
+    - images_XXXXX.npy: uint8 arrays of shape (N, height, width, 3) holding the decoded RGB pixels.
+    - annotations.npy: the annotation table, one record per image, see get_annotation_dtype.
+    - shards.json: the image size and the list of shard files.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    image_files = sorted(f for f in os.listdir(img_dir) if f.endswith('.jpg') or f.endswith('.png'))
+    if not image_files:
+        raise ValueError(f"No images found in {img_dir}")
+
+    # The keypoint count is taken from the first annotation, all the others must match it
+    _, _, first_keypoints, _ = _load_sample(img_dir, annot_dir, image_files[0], height, width)
+    num_keypoints = len(first_keypoints)
+    table = np.zeros(len(image_files), dtype=get_annotation_dtype(num_keypoints, max(map(len, image_files))))
+
+    shards = []
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        for shard, start in enumerate(range(0, len(image_files), images_per_shard)):
+            shard_files = image_files[start : start + images_per_shard]
+            shard_name = "images_{:05d}.npy".format(shard)
+            pixels = np.lib.format.open_memmap(
+                os.path.join(out_dir, shard_name), mode="w+", dtype=np.uint8, shape=(len(shard_files), height, width, 3)
+            )
+            samples = executor.map(lambda f: _load_sample(img_dir, annot_dir, f, height, width), shard_files)
+            for offset, (image_file, (image, box, keypoints, category)) in enumerate(zip(shard_files, samples)):
+                pixels[offset] = image
+                table[start + offset] = (shard, offset, box, keypoints, category, image_file)
+            pixels.flush()
+            del pixels
+            shards.append({"file": shard_name, "count": len(shard_files)})
+
+    np.save(os.path.join(out_dir, SHARD_ANNOTATION_FILE_NAME), table)
+    meta = {
+        "version": SHARD_VERSION,
+        "height": height,
+        "width": width,
+        "num_keypoints": num_keypoints,
+        "count": len(image_files),
+        "shards": shards,
+    }
+    with open(os.path.join(out_dir, SHARD_META_FILE_NAME), 'w') as f:
+        json.dump(meta, f)
+    return len(image_files)
+
+
+class ShardDataset(torch.utils.data.Dataset):
+    """
+    Serves the samples of a directory written by pack_roller_shards.
+
+    The shards are memory-mapped, so a sample is a slice of the page cache: there is no per-sample file
+    open, image decoding or JSON parsing. The samples are the same as the ones of the notebook CustomDataset
+    (float image tensor in [0, 1] and the same target keys), with image_id being the index in the dataset.
+
+    Args:
+        shard_dir (str): The directory written by pack_roller_shards.
+        transforms (callable, optional): Applied as transforms(image, target) on every sample.
+    """
+
+    def __init__(self, shard_dir, transforms=None):
+        self.shard_dir = shard_dir
+        self.transforms = transforms
+        with open(os.path.join(shard_dir, SHARD_META_FILE_NAME), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != SHARD_VERSION:
+            raise ValueError(f"Unsupported shard version {self.meta['version']} in {shard_dir}")
+        self.annotations = np.load(os.path.join(shard_dir, SHARD_ANNOTATION_FILE_NAME))
+        self.shards = [np.load(os.path.join(shard_dir, shard["file"]), mmap_mode="r") for shard in self.meta["shards"]]
+
+    def __len__(self):
+        return len(self.annotations)
+
+    def get_height_and_width(self, idx):
+        return self.meta["height"], self.meta["width"]
+
+    def get_cache_key(self):
+        digest = hashlib.sha256(json.dumps(self.meta, sort_keys=True).encode("utf-8"))
+        digest.update(self.annotations.tobytes())
+        return digest.hexdigest()
+
+    def get_annotations(self, idx):
+        """
+        Returns the target of a sample, before transforms, without reading its pixels.
+        """
+        record = self.annotations[idx]
+        boxes = torch.from_numpy(record["box"].copy()).reshape(1, 4)
+        return {
+            "boxes": boxes,
+            "labels": torch.tensor([1], dtype=torch.int64),
+            "image_id": torch.tensor([idx]),
+            "area": (boxes[:, 3] - boxes[:, 1]) * (boxes[:, 2] - boxes[:, 0]),
+            "iscrowd": torch.zeros(1, dtype=torch.int64),
+            "keypoints": torch.from_numpy(record["keypoints"].copy()).unsqueeze(0),
+            "category": torch.as_tensor(record["category"], dtype=torch.float32),
+        }
+
+    def __getitem__(self, idx):
+        record = self.annotations[idx]
+        pixels = self.shards[record["shard"]][record["offset"]]
+        img = torch.from_numpy(np.array(pixels)).permute(2, 0, 1)
+        img = img.to(torch.float32).div_(255)
+
+        target = self.get_annotations(idx)
+        if self.transforms is not None:
+            img, target = self.transforms(img, target)
+        return img, target
+
+    def collate_fn(self, batch):
+        return tuple(zip(*batch))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pack a roller dataset into memory-mapped shards")
+    parser.add_argument("--img-dir", required=True, type=str, help="images directory")
+    parser.add_argument("--annot-dir", required=True, type=str, help="annotations directory")
+    parser.add_argument("--out-dir", required=True, type=str, help="output shard directory")
+    parser.add_argument("--images-per-shard", default=4096, type=int, help="images per shard file (default: 4096)")
+    parser.add_argument("--height", default=360, type=int, help="packed image height (default: 360)")
+    parser.add_argument("--width", default=640, type=int, help="packed image width (default: 640)")
+    parser.add_argument("-j", "--workers", default=8, type=int, help="number of decoding threads (default: 8)")
+    args = parser.parse_args()
+    count = pack_roller_shards(
+        args.img_dir, args.annot_dir, args.out_dir, args.images_per_shard, args.height, args.width, args.workers
+    )
+    print(f"Packed {count} images into {args.out_dir}")
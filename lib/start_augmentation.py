@@ -1,16 +1,29 @@
+import argparse
 from augmentation_utils import *
 from augmentation_pipeline import *
 from dataset_utils import *
 from training_utils import *
+from augmentation_manifest import AugmentationManifest, MANIFEST_FILE_NAME, get_pipeline_fingerprints
+from augmentation_writer import AugmentationWriter
+from image_decoding import scale_data_for_augmentation
+from parallel_augmentation import run_parallel_augmentation
 from shared_utils import get_class_labels, get_all_global_variable
 
 class_labels = get_class_labels()
 transformations = ["horizontal_flip", "scale_down", "shift_scale_rotate", "shift_scale_rotate_negative", "resize"]
-scale_down_transform= scale_down_pipeline()
 resize_transform = resize_pipeline()
-horizontal_flip_transform = horizontal_flip_pipeline()
-shift_scale_rotate_transform = shift_scale_rotate_pipeline()
-shift_scale_rotate_negative_transform = shift_scale_rotate_negative_pipeline()
+# Tails only: every pipeline starts with the same resize, which is run once per image by resize_transform
+scale_down_transform = scale_down_pipeline(include_resize=False)
+horizontal_flip_transform = horizontal_flip_pipeline(include_resize=False)
+shift_scale_rotate_transform = shift_scale_rotate_pipeline(include_resize=False)
+shift_scale_rotate_negative_transform = shift_scale_rotate_negative_pipeline(include_resize=False)
+augmentation_pipelines = {
+    "horizontal_flip": horizontal_flip_transform,
+    "scale_down": scale_down_transform,
+    "shift_scale_rotate": shift_scale_rotate_transform,
+    "shift_scale_rotate_negative": shift_scale_rotate_negative_transform,
+    "resize": None,
+}
 
 (class_labels,
 augmented_images, augmented_bboxes, augmented_keypoints,
@@ -27,45 +40,55 @@ augmented_json_train_path = '/home/citiai-cygnus/RollerDetection_HoangKhanh/roll
 augmented_image_test_path = '/home/citiai-cygnus/RollerDetection_HoangKhanh/roller_dataset_augmented/test_all_augmented/images'
 augmented_json_test_path = '/home/citiai-cygnus/RollerDetection_HoangKhanh/roller_dataset_augmented/test_all_augmented/annotations'
 
-def perform_augmentation(image, bboxes, keypoints, augmentation_type):
-    if augmentation_type == "horizontal_flip":
-        augmented = horizontal_flip_transform(image=image, bboxes=bboxes, keypoints=keypoints, class_labels=class_labels)
-    elif augmentation_type == "scale_down":
-        augmented = scale_down_transform(image=image, bboxes=bboxes, keypoints=keypoints, class_labels=class_labels)
-    elif augmentation_type == "shift_scale_rotate":
-        augmented = shift_scale_rotate_transform(image=image, bboxes=bboxes, keypoints=keypoints, class_labels=class_labels)
-    elif augmentation_type == "shift_scale_rotate_negative":
-        augmented = shift_scale_rotate_negative_transform(image=image, bboxes=bboxes, keypoints=keypoints, class_labels=class_labels)
-    elif augmentation_type == "resize":
-        augmented = resize_transform(image=image, bboxes=bboxes, keypoints=keypoints, class_labels=class_labels)
-    return augmented
+def perform_augmentation(resized, augmentation_type, json_file=None, base_seed=0):
+    tail_pipeline = augmentation_pipelines[augmentation_type]
+    if json_file is not None:
+        seed_augmentation(tail_pipeline, json_file, augmentation_type, base_seed)
+    return augment_from_shared_prefix(resized, tail_pipeline, class_labels)
 
 
 def visualize_all_augmented_images():
     for img, bbox, kpts in zip(augmented_images, augmented_bboxes, augmented_keypoints):
         display_image_with_bboxes_and_keypoints_cv2(img, bbox, kpts)
 
-def main():
+def run_serial_augmentation(jobs, base_seed=0, stream=False, writer_threads=4, on_file_done=None, reduced_decoding=False):
+    # In streaming mode the outputs go through a bounded queue to the writer threads and are not kept
+    # in augmented_images/augmented_bboxes/augmented_keypoints, so memory does not grow with the dataset
+    writer = AugmentationWriter(num_threads=writer_threads if stream else 0)
     error_log = []
-    for json_file in json_training_files:
+    for json_file, file_transformations in jobs:
         json_path = os.path.join(json_training_path, json_file)
-        image_file, image_path, image = get_image_file_and_path_and_renderable_image_from_json(json_file, 'train')
+        if reduced_decoding:
+            # Decoded directly at a reduced resolution, the resize of resize_transform then makes it exactly RESIZE_SIZE
+            image_file, image_path, image, scale = get_image_file_and_path_and_reduced_image_from_json(json_file, 'train', RESIZE_SIZE)
+        else:
+            image_file, image_path, image = get_image_file_and_path_and_renderable_image_from_json(json_file, 'train')
+            scale = (1.0, 1.0)
         
         annotation, bbox_data_for_albumentations, keypoints_data_for_albumentations = convert_data_for_augmentation(json_path)
+        bbox_data_for_albumentations, keypoints_data_for_albumentations = scale_data_for_augmentation(
+            bbox_data_for_albumentations, keypoints_data_for_albumentations, scale)
+        try:
+            resized = resize_transform(image=image, bboxes=bbox_data_for_albumentations, keypoints=keypoints_data_for_albumentations, class_labels=class_labels)
+        except:
+            error_log.extend("Failed to augment {} of type {}".format(json_file, transformation) for transformation in file_transformations)
+            continue
 
-        for transformation in transformations:
+        outputs = {}
+        for transformation in file_transformations:
             # print(image)
             print("Trying to augment {} of type {}".format(json_file, transformation))
             try:
-                augmented = perform_augmentation(image, bbox_data_for_albumentations, keypoints_data_for_albumentations, transformation)
+                augmented = perform_augmentation(resized, transformation, json_file, base_seed)
                 new_augmented_json_data = create_new_augmented_dataset(annotation, augmented)
             
                 augmented_json_output_filename = get_path_for_saving_augmented_json(json_file, augmented_json_train_path, transformation)
-                write_augmented_data_to_json(augmented_json_output_filename, new_augmented_json_data)
-                print("Written {}".format(augmented_json_output_filename))
-            
                 augmented_image_output_filename = get_path_for_saving_augmented_image(json_file, augmented_image_train_path, transformation)
-                write_augmented_image_to_file(augmented_image_output_filename, augmented)
+                writer.submit(augmented_json_output_filename, new_augmented_json_data, augmented_image_output_filename, augmented)
+                outputs[transformation] = [augmented_json_output_filename, augmented_image_output_filename]
+                if stream:
+                    continue
+                print("Written {}".format(augmented_json_output_filename))
                 print("Written {}".format(augmented_image_output_filename))
                 
                 augmented_images.append(augmented['image'])
@@ -74,10 +97,87 @@ def main():
             except:
                 error_log.append("Failed to augment {} of type {}".format(json_file, transformation))
                 continue
+
+        if on_file_done is not None:
+            # The outputs of the file must be on disk before they are reported
+            writer.flush()
+            failed = writer.pop_failed()
+            error_log.extend("Failed to write {}".format(image_output_filename) for _, image_output_filename in failed)
+            on_file_done(json_file, {t: files for t, files in outputs.items() if tuple(files) not in failed})
+    writer.close()
+    error_log.extend("Failed to write {}".format(image_output_filename) for _, image_output_filename in writer.pop_failed())
+    return error_log
+
+
+def main(num_workers=1, base_seed=0, stream=False, writer_threads=4, incremental=False, save_every=100, reduced_decoding=False):
+    jobs = [(json_file, transformations) for json_file in json_training_files]
+    on_file_done = None
+    if incremental:
+        # The manifest sits next to the annotations directory, where it is not mistaken for an annotation
+        manifest = AugmentationManifest(os.path.join(os.path.dirname(augmented_json_train_path), MANIFEST_FILE_NAME))
+        removed = manifest.prune(json_training_files, transformations)
+        jobs = manifest.plan(json_training_files, json_training_path, image_training_path, transformations,
+                             get_pipeline_fingerprints(transformations, base_seed, reduced_decoding))
+        manifest.save()
+        print("Pruned {} stale outputs, {} of {} files need augmentation".format(len(removed), len(jobs), len(json_training_files)))
+
+        files_done = 0
+
+        def on_file_done(json_file, outputs):
+            nonlocal files_done
+            manifest.record(json_file, outputs)
+            files_done += 1
+            if files_done % save_every == 0:
+                manifest.save()
+
+    if num_workers > 1:
+        error_log = run_parallel_augmentation(
+            jobs, json_training_path, image_training_path,
+            augmented_json_train_path, augmented_image_train_path,
+            num_workers, base_seed=base_seed, writer_threads=writer_threads if stream else 0, on_file_done=on_file_done,
+            reduced_decoding=reduced_decoding
+        )
+    else:
+        error_log = run_serial_augmentation(jobs, base_seed, stream=stream, writer_threads=writer_threads, on_file_done=on_file_done,
+                                            reduced_decoding=reduced_decoding)
+    if incremental:
+        manifest.save()
        
     print()     
     print("Done augmentation! Failures:")
     for error in error_log:
         print(error)
-    
-main()
\ No newline at end of file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Roller dataset augmentation")
+    parser.add_argument("-j", "--workers", default=1, type=int, help="number of augmentation processes (default: 1)")
+    parser.add_argument("--seed", default=0, type=int, help="base seed mixed into every per-image seed (default: 0)")
+    parser.add_argument(
+        "--stream",
+        dest="stream",
+        help="write outputs from background threads and do not keep them in memory for visualization",
+        action="store_true",
+    )
+    parser.add_argument("--writer-threads", default=4, type=int, help="number of writer threads per process in --stream mode (default: 4)")
+    parser.add_argument(
+        "--incremental",
+        dest="incremental",
+        help="only augment new or changed files, tracked by a content-hash manifest, and prune outputs of deleted files",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--reduced-decoding",
+        dest="reduced_decoding",
+        help="decode the JPEG sources directly at the smallest 1/2, 1/4 or 1/8 scale that is not below the resize size",
+        action="store_true",
+    )
+    args = parser.parse_args()
+    main(
+        num_workers=args.workers,
+        base_seed=args.seed,
+        stream=args.stream,
+        writer_threads=args.writer_threads,
+        incremental=args.incremental,
+        reduced_decoding=args.reduced_decoding,
+    )
@@ -0,0 +1,283 @@
+import json
+import math
+import multiprocessing
+import os
+
+import cv2
+import numpy as np
+
+SYNTHETIC_MANIFEST_FILE_NAME = "synthetic_manifest.json"
+CORRUPTION_TYPES = ("truncated_image", "invalid_json", "degenerate_box")
+FRAMES_PER_VIDEO = 100
+
+
+def _background(rng, height, width):
+    # Smooth color field plus a vertical gradient, which compresses like an indoor frame
+    coarse = rng.integers(40, 220, size=(max(height // 40, 2), max(width // 40, 2), 3), dtype=np.uint8)
+    image = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC).astype(np.float32)
+    image *= np.linspace(0.8, 1.1, height, dtype=np.float32)[:, None, None]
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def _draw_roller(rng, image, length):
+    """
+    Draws a paint roller: a rotated cylinder (a filled rounded rectangle with a shaded middle stripe) and a
+    handle going out of one end. Returns the xyxy box of the drawn pixels and the center of the cylinder.
+    """
+    height, width = image.shape[:2]
+    thickness = max(length * rng.uniform(0.25, 0.4), 2.0)
+    angle = rng.uniform(-math.pi / 3, math.pi / 3)
+    direction = np.array([math.cos(angle), math.sin(angle)])
+    normal = np.array([-direction[1], direction[0]])
+    handle_length = length * rng.uniform(0.6, 1.2)
+    # Keep the whole object inside the frame
+    extent = length / 2 + thickness + handle_length
+    cx = rng.uniform(min(extent, width / 2), max(width - extent, width / 2))
+    cy = rng.uniform(min(extent, height / 2), max(height - extent, height / 2))
+    center = np.array([cx, cy])
+
+    color = rng.integers(0, 256, size=3)
+    corners = [
+        center + direction * length / 2 + normal * thickness / 2,
+        center - direction * length / 2 + normal * thickness / 2,
+        center - direction * length / 2 - normal * thickness / 2,
+        center + direction * length / 2 - normal * thickness / 2,
+    ]
+    cv2.fillPoly(image, [np.round(corners).astype(np.int32)], color.tolist(), lineType=cv2.LINE_AA)
+    for end in (center + direction * length / 2, center - direction * length / 2):
+        end = tuple(np.round(end).astype(int).tolist())
+        cv2.circle(image, end, int(thickness / 2), color.tolist(), -1, cv2.LINE_AA)
+    stripe = (np.clip(color * 1.3 + 30, 0, 255)).tolist()
+    cv2.line(
+        image,
+        tuple(np.round(center - direction * length / 2).astype(int).tolist()),
+        tuple(np.round(center + direction * length / 2).astype(int).tolist()),
+        stripe,
+        max(int(thickness / 5), 1),
+        cv2.LINE_AA,
+    )
+
+    # The handle leaves the cylinder at one end, bends and ends in a grip
+    start = center + direction * length / 2
+    elbow = start + normal * handle_length * 0.5 * rng.choice([-1, 1])
+    grip = elbow - direction * handle_length * 0.5
+    handle_width = max(int(thickness / 6), 1)
+    handle_color = rng.integers(0, 80, size=3).tolist()
+    points = np.round([start, elbow, grip]).astype(np.int32)
+    cv2.polylines(image, [points], False, handle_color, handle_width, cv2.LINE_AA)
+    cv2.circle(image, tuple(points[-1].tolist()), handle_width * 2, handle_color, -1, cv2.LINE_AA)
+
+    radius = thickness / 2
+    outline = np.concatenate([np.asarray(corners), points.astype(np.float64)])
+    x0, y0 = outline.min(axis=0) - radius * 0.3
+    x1, y1 = outline.max(axis=0) + radius * 0.3
+    box = [max(x0, 0.0), max(y0, 0.0), min(x1, width - 1.0), min(y1, height - 1.0)]
+    return box, center
+
+
+def _sample_length(rng, size_range, size_distribution):
+    low, high = size_range
+    if size_distribution == "loguniform":
+        return float(math.exp(rng.uniform(math.log(low), math.log(high))))
+    return float(rng.uniform(low, high))
+
+
+def _generate_sample(task):
+    index, name, img_dir, annot_dir, height, width, size_range, size_distribution, bbox_format, corruption, seed = task
+    # One generator per sample, so the output does not depend on the number of workers
+    rng = np.random.default_rng([seed, index])
+    image = _background(rng, height, width)
+    box, center = _draw_roller(rng, image, _sample_length(rng, size_range, size_distribution))
+    if corruption == "degenerate_box":
+        box = [box[0], box[1], box[0], box[3]]
+    bbox = box if bbox_format == "xyxy" else [box[0], box[1], box[2] - box[0], box[3] - box[1]]
+    bbox = [int(round(v)) for v in bbox]
+    area = float((box[2] - box[0]) * (box[3] - box[1]))
+
+    image_path = os.path.join(img_dir, name + ".jpg")
+    ok, encoded = cv2.imencode(".jpg", cv2.cvtColor(image, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    if not ok:
+        raise RuntimeError(f"Could not encode {image_path}")
+    encoded = encoded.tobytes()
+    if corruption == "truncated_image":
+        encoded = encoded[: len(encoded) // 2]
+    with open(image_path, "wb") as f:
+        f.write(encoded)
+
+    annotation = {
+        "images": [{"id": index, "file_name": name + ".jpg", "height": height, "width": width}],
+        "annotations": [
+            {
+                "id": index,
+                "image_id": index,
+                "category_id": 1,
+                "bbox": bbox,
+                "area": area,
+                "iscrowd": 0,
+                "num_keypoints": 1,
+                "keypoints": [int(round(center[0])), int(round(center[1])), 2],
+            }
+        ],
+        "categories": [{"id": 1, "name": "roller", "keypoints": ["roller"], "skeleton": []}],
+        "category_ids": [1],
+    }
+    text = json.dumps(annotation)
+    if corruption == "invalid_json":
+        text = text[: len(text) // 2]
+    with open(os.path.join(annot_dir, name + ".json"), "w") as f:
+        f.write(text)
+
+
+def generate_roller_split(
+    out_dir,
+    count,
+    height=360,
+    width=640,
+    size_range=(40, 200),
+    size_distribution="loguniform",
+    bbox_format="xywh",
+    corruption_rate=0.0,
+    corruption_types=CORRUPTION_TYPES,
+    num_workers=None,
+    seed=0,
+    first_index=0,
+):
+    """
+    Generates a synthetic split of the roller dataset: out_dir/images and out_dir/annotations.
+
+    Parameters:
+    out_dir (str): The split directory, e.g. ".../roller_dataset/train".
+    count (int): The number of images.
+    height (int): The height of the frames.
+    width (int): The width of the frames.
+    size_range (tuple): The (min, max) length of the roller cylinder in pixels.
+    size_distribution (str): "loguniform" (small rollers are more frequent, as in far away views) or "uniform".
+    bbox_format (str): "xywh" (COCO) as in the raw dataset read by shared_utils.get_all_global_variable and the
+      augmentation scripts, or "xyxy" as written by the augmentation and read by the notebook CustomDataset,
+      for a split that is read directly by the notebook.
+    corruption_rate (float): The fraction of corrupted samples.
+    corruption_types (tuple): The corruptions drawn from, see CORRUPTION_TYPES: half-written JPEG files,
+      half-written JSON files, and zero-width boxes.
+    num_workers (int): The number of processes. Defaults to the number of CPUs.
+    seed (int): The seed. A sample only depends on the seed and its index.
+    first_index (int): The index of the first sample, so that the splits of a dataset get distinct images.
+
+    Returns:
+    dict: The corrupted samples, mapping their file base names to their corruption type.
+
+    The images are named like the source frames, "<video>_<frame>.jpg", with FRAMES_PER_VIDEO frames per video,
+    and every image has a JSON annotation with the same base name, holding one box and one keypoint (the
+    center of the roller) of category 1.
+    """
+    if bbox_format not in ("xyxy", "xywh"):
+        raise ValueError(f"bbox_format should be either 'xyxy' or 'xywh', got {bbox_format}")
+    if size_distribution not in ("loguniform", "uniform"):
+        raise ValueError(f"size_distribution should be either 'loguniform' or 'uniform', got {size_distribution}")
+    img_dir = os.path.join(out_dir, "images")
+    annot_dir = os.path.join(out_dir, "annotations")
+    os.makedirs(img_dir, exist_ok=True)
+    os.makedirs(annot_dir, exist_ok=True)
+
+    # The corrupted samples are drawn up front, so that exactly round(count * corruption_rate) are corrupted
+    rng = np.random.default_rng([seed, first_index, count])
+    num_corrupted = int(round(count * corruption_rate))
+    corrupted = {}
+    if num_corrupted and corruption_types:
+        for i in rng.choice(count, size=num_corrupted, replace=False).tolist():
+            corrupted[first_index + i] = corruption_types[int(rng.integers(len(corruption_types)))]
+
+    tasks = []
+    for index in range(first_index, first_index + count):
+        name = "{:07d}_{:06d}".format(index // FRAMES_PER_VIDEO + 1, index % FRAMES_PER_VIDEO + 1)
+        tasks.append(
+            (
+                index,
+                name,
+                img_dir,
+                annot_dir,
+                height,
+                width,
+                size_range,
+                size_distribution,
+                bbox_format,
+                corrupted.get(index),
+                seed,
+            )
+        )
+
+    num_workers = num_workers or os.cpu_count() or 1
+    if num_workers > 1:
+        with multiprocessing.Pool(num_workers, initializer=cv2.setNumThreads, initargs=(0,)) as pool:
+            for _ in pool.imap_unordered(_generate_sample, tasks, chunksize=64):
+                pass
+    else:
+        for task in tasks:
+            _generate_sample(task)
+    return {tasks[index - first_index][1]: kind for index, kind in corrupted.items()}
+
+
+def generate_roller_dataset(root, splits=None, **kwargs):
+    """
+    Generates a synthetic roller dataset in the layout of the raw dataset: root/<split>/images and
+    root/<split>/annotations for every split, as read by shared_utils.get_all_global_variable.
+
+    Parameters:
+    root (str): The dataset directory.
+    splits (dict): The number of images of every split. Defaults to {"train": 1000, "test": 200}.
+    **kwargs: The options of generate_roller_split.
+
+    Returns:
+    dict: The content of root/synthetic_manifest.json: the options, the counts, and the corrupted samples of
+      every split, which a data validation run should find.
+    """
+    splits = splits if splits is not None else {"train": 1000, "test": 200}
+    manifest = {"options": {k: list(v) if isinstance(v, tuple) else v for k, v in kwargs.items()}, "splits": {}}
+    first_index = 0
+    for split, count in splits.items():
+        corrupted = generate_roller_split(os.path.join(root, split), count, first_index=first_index, **kwargs)
+        manifest["splits"][split] = {"count": count, "corrupted": corrupted}
+        first_index += count
+    with open(os.path.join(root, SYNTHETIC_MANIFEST_FILE_NAME), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic roller dataset")
+    parser.add_argument("--out-dir", required=True, type=str, help="dataset directory")
+    parser.add_argument("--train", default=1000, type=int, help="number of training images (default: 1000)")
+    parser.add_argument("--test", default=200, type=int, help="number of test images (default: 200)")
+    parser.add_argument("--height", default=360, type=int, help="image height (default: 360)")
+    parser.add_argument("--width", default=640, type=int, help="image width (default: 640)")
+    parser.add_argument(
+        "--size-range", default=[40, 200], nargs=2, type=float, help="min and max roller length in pixels"
+    )
+    parser.add_argument("--size-distribution", default="loguniform", choices=["loguniform", "uniform"])
+    parser.add_argument(
+        "--bbox-format",
+        default="xywh",
+        choices=["xyxy", "xywh"],
+        help="xywh for the raw dataset of the augmentation, xyxy for the notebook CustomDataset (default: xywh)",
+    )
+    parser.add_argument("--corruption-rate", default=0.0, type=float, help="fraction of corrupted samples")
+    parser.add_argument("--corruption-types", default=list(CORRUPTION_TYPES), nargs="+", choices=CORRUPTION_TYPES)
+    parser.add_argument("-j", "--workers", default=None, type=int, help="number of processes (default: CPU count)")
+    parser.add_argument("--seed", default=0, type=int, help="random seed (default: 0)")
+    args = parser.parse_args()
+    manifest = generate_roller_dataset(
+        args.out_dir,
+        {"train": args.train, "test": args.test},
+        height=args.height,
+        width=args.width,
+        size_range=tuple(args.size_range),
+        size_distribution=args.size_distribution,
+        bbox_format=args.bbox_format,
+        corruption_rate=args.corruption_rate,
+        corruption_types=tuple(args.corruption_types),
+        num_workers=args.workers,
+        seed=args.seed,
+    )
+    for split, info in manifest["splits"].items():
+        print(f"{split}: {info['count']} images, {len(info['corrupted'])} corrupted")
@@ -9,6 +9,17 @@ The default hyperparameters are tuned for training on 8 gpus and 2 images per gp
     --lr 0.02 --batch-size 2 --world-size 8
 If you use different number of gpus, the learning rate should be changed to 0.02/8*$NGPU.
 
+On a single node, --accumulation-steps reaches the same total batch size of 16 with fewer processes,
+e.g. on one CPU node:
+    --device cpu --lr 0.02 --batch-size 2 --accumulation-steps 8
+The total batch size is $NGPU x batch_size x accumulation_steps.
+
+On preemptible nodes, --checkpoint-minutes (or --checkpoint-steps) also writes mid-epoch checkpoints to
+checkpoint.pth, and so does SIGTERM during training before exiting. --resume $OUTPUT_DIR/checkpoint.pth then
+continues the epoch at the next batch, with the same batches and the same augmentations of their samples:
+with mid-epoch checkpoints or --resume, the random augmentations of a sample are seeded by --seed, the epoch
+and the sample, instead of drawn from the random state of the DataLoader workers.
+
 On top of that, for training Faster/Mask R-CNN, the default hyperparameters are
     --epochs 26 --lr-steps 16 22 --aspect-ratio-group-factor 3
 
@@ -17,20 +28,31 @@ Also, if you train Keypoint R-CNN, the default hyperparameters are
 Because the number of images is smaller in the person keypoint subset of COCO,
 the number of epochs should be adapted so that we have the same number of iterations.
 """
+import contextlib
 import datetime
+import json
 import os
 import time
 
 import presets as presets
+import numpy as np
 import torch
+import torch.multiprocessing
 import torch.utils.data
 import torchvision
 import torchvision.models.detection
 import torchvision.models.detection.mask_rcnn
+import transforms as T
 import utils as utils
 from coco.coco_utils import get_coco, get_coco_kp
-from engine import train_one_epoch, evaluate
-from group_by_aspect_ratio import GroupedBatchSampler, create_aspect_ratio_groups
+from engine import train_one_epoch, evaluate, compare_precision
+from group_by_aspect_ratio import GroupedBatchPlanSampler, create_aspect_ratio_groups
+
+# engine already imports lib (the repository root must be on the path), and the modules added next to it are
+# imported the same way as engine and the notebook do, so that each of them is only loaded once
+from lib.checkpoint_writer import CheckpointWriter, StepCheckpointer
+from lib.mixed_precision import AMP_DTYPES
+from lib.profiling import profile_window
 
 
 try:
@@ -49,7 +71,7 @@ def get_dataset(name, image_set, transform, data_path):
 
 def get_transform(train, args):
     if train:
-        return presets.DetectionPresetTrain(args.data_augmentation)
+        return presets.DetectionPresetTrain(args.data_augmentation, batched=args.batch_augmentation)
     elif not args.weights:
         return presets.DetectionPresetEval()
     else:
@@ -58,6 +80,113 @@ def get_transform(train, args):
         return weights.transforms()
 
 
+def get_test_loader(dataset_test, args):
+    if args.distributed:
+        test_sampler = torch.utils.data.distributed.DistributedSampler(dataset_test)
+    else:
+        test_sampler = torch.utils.data.SequentialSampler(dataset_test)
+    return torch.utils.data.DataLoader(
+        dataset_test, batch_size=1, sampler=test_sampler, num_workers=args.workers, collate_fn=utils.collate_fn
+    )
+
+
+def create_model(args, num_classes):
+    kwargs = {"trainable_backbone_layers": args.trainable_backbone_layers}
+    if "rcnn" in args.model:
+        if args.rpn_score_thresh is not None:
+            kwargs["rpn_score_thresh"] = args.rpn_score_thresh
+    if not args.weights:
+        model = torchvision.models.detection.__dict__[args.model](
+            pretrained=args.pretrained, num_classes=num_classes, **kwargs
+        )
+    else:
+        model = PM.detection.__dict__[args.model](weights=args.weights, num_classes=num_classes, **kwargs)
+    return model
+
+
+def get_checkpoint(model_without_ddp, optimizer, lr_scheduler, scaler, args, epoch):
+    checkpoint = {
+        "model": model_without_ddp.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "lr_scheduler": lr_scheduler.state_dict(),
+        "args": args,
+        "epoch": epoch,
+        "seed": args.seed,
+    }
+    if scaler is not None:
+        checkpoint["scaler"] = scaler.state_dict()
+    return checkpoint
+
+
+def log_evaluation(log_path, epoch, coco_evaluator, subset):
+    """
+    Appends the stats of an evaluation to the run log, one JSON line per evaluated epoch.
+    """
+    record = {"epoch": epoch, "subset": subset, "time": time.time(), "stats": coco_evaluator.summary_stats()}
+    with open(log_path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def get_evaluation_metric(stats):
+    """
+    Returns the metric used to rank the checkpoints: the keypoint AP if available, the box AP otherwise.
+    """
+    for iou_type in ("keypoints", "bbox"):
+        if iou_type in stats:
+            return stats[iou_type][0]
+    return None
+
+
+def read_evaluation_metrics(log_path):
+    """
+    Returns the metric of every epoch of the run log, see log_evaluation.
+    """
+    metrics = {}
+    if log_path and os.path.exists(log_path):
+        with open(log_path, "r") as f:
+            for line in f:
+                record = json.loads(line)
+                metrics[record["epoch"]] = get_evaluation_metric(record["stats"])
+    return metrics
+
+
+def profile_context(args, phase):
+    """
+    Returns the --profile window of phase ("train" or "eval"), or a null context if phase is not profiled.
+    Only the main process is profiled.
+    """
+    if args.profile is None or args.profile != phase or not utils.is_main_process():
+        return contextlib.nullcontext()
+    return profile_window(
+        args.output_dir or ".",
+        phase,
+        skip=args.profile_skip,
+        warmup=args.profile_warmup,
+        active=args.profile_active,
+    )
+
+
+def evaluate_checkpoint(args, checkpoint_path, epoch, indices, log_path):
+    """
+    Evaluates a saved checkpoint on the test set, or on the test images at indices, and logs the stats.
+    This is the target of the evaluation process of --async-eval, which does not take part in distributed training.
+    """
+    args.distributed = False
+    device = torch.device(args.device)
+    dataset_test, num_classes = get_dataset(args.dataset, "val", get_transform(False, args), args.data_path)
+    if indices is not None:
+        dataset_test = torch.utils.data.Subset(dataset_test, indices)
+    model = create_model(args, num_classes)
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    model.load_state_dict(checkpoint["model"])
+    model.to(device)
+    amp_dtype = AMP_DTYPES[args.amp_dtype] if args.amp_dtype else None
+    coco_evaluator = evaluate(
+        model, get_test_loader(dataset_test, args), device=device, native=args.native_eval, amp_dtype=amp_dtype
+    )
+    log_evaluation(log_path, epoch, coco_evaluator, indices is not None)
+
+
 def get_args_parser(add_help=True):
     import argparse
 
@@ -70,6 +199,12 @@ def get_args_parser(add_help=True):
     parser.add_argument(
         "-b", "--batch-size", default=2, type=int, help="images per gpu, the total batch size is $NGPU x batch_size"
     )
+    parser.add_argument(
+        "--accumulation-steps",
+        default=1,
+        type=int,
+        help="mini-batches per optimizer step, the total batch size is $NGPU x batch_size x accumulation_steps",
+    )
     parser.add_argument("--epochs", default=26, type=int, metavar="N", help="number of total epochs to run")
     parser.add_argument(
         "-j", "--workers", default=4, type=int, metavar="N", help="number of data loading workers (default: 4)"
@@ -109,6 +244,12 @@ def get_args_parser(add_help=True):
     parser.add_argument("--print-freq", default=20, type=int, help="print frequency")
     parser.add_argument("--output-dir", default=".", type=str, help="path to save outputs")
     parser.add_argument("--resume", default="", type=str, help="path of checkpoint")
+    parser.add_argument(
+        "--seed",
+        default=None,
+        type=int,
+        help="seed of the shuffling of the training batches (default: drawn at startup, --resume restores it)",
+    )
     parser.add_argument("--start_epoch", default=0, type=int, help="start epoch")
     parser.add_argument("--aspect-ratio-group-factor", default=3, type=int)
     parser.add_argument("--rpn-score-thresh", default=None, type=float, help="rpn score threshold for faster-rcnn")
@@ -118,6 +259,13 @@ def get_args_parser(add_help=True):
     parser.add_argument(
         "--data-augmentation", default="hflip", type=str, help="data augmentation policy (default: hflip)"
     )
+    parser.add_argument(
+        "--batch-augmentation",
+        dest="batch_augmentation",
+        help="apply the data augmentation to whole uint8 batches on the device after collation, instead of per "
+        "sample in the data loader workers",
+        action="store_true",
+    )
     parser.add_argument(
         "--sync-bn",
         dest="sync_bn",
@@ -130,6 +278,88 @@ def get_args_parser(add_help=True):
         help="Only test the model",
         action="store_true",
     )
+    parser.add_argument(
+        "--amp-dtype",
+        default=None,
+        choices=list(AMP_DTYPES),
+        help="train and evaluate under autocast with this dtype (default: float32). fp16 requires a CUDA device",
+    )
+    parser.add_argument(
+        "--amp-report",
+        dest="amp_report",
+        help="With --test-only, evaluate in float32 and under autocast and report the speedup and the AP delta",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--lazy-logging",
+        dest="lazy_logging",
+        help="Sum the losses on the device and only reduce and log them every --print-freq iterations",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--telemetry",
+        default=None,
+        choices=["jsonl", "csv"],
+        help="write the per-iteration stage times and their per-epoch percentiles to telemetry.<format> in "
+        "--output-dir",
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        choices=["train", "eval"],
+        help="record a torch.profiler window of the first trained epoch or of the first evaluation and write its "
+        "Chrome trace and top ops table to --output-dir",
+    )
+    parser.add_argument(
+        "--profile-skip", default=10, type=int, help="iterations before the profiler window (default: 10)"
+    )
+    parser.add_argument(
+        "--profile-warmup", default=2, type=int, help="profiled iterations discarded as warmup (default: 2)"
+    )
+    parser.add_argument("--profile-active", default=5, type=int, help="recorded iterations (default: 5)")
+    parser.add_argument(
+        "--native-eval",
+        dest="native_eval",
+        help="Evaluate with the vectorized single-category evaluator instead of pycocotools",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--eval-every", default=1, type=int, help="evaluate every N epochs and after the last one (default: 1)"
+    )
+    parser.add_argument(
+        "--eval-subset",
+        default=0,
+        type=int,
+        help="evaluate the intermediate epochs on a fixed subset of N test images, and the last one on the full "
+        "test set (default: 0, always the full test set)",
+    )
+    parser.add_argument(
+        "--async-eval",
+        dest="async_eval",
+        help="Evaluate the saved checkpoints in a separate process while training continues, requires --output-dir",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--checkpoint-steps",
+        default=0,
+        type=int,
+        help="also write a mid-epoch checkpoint every N optimizer steps (default: 0, never)",
+    )
+    parser.add_argument(
+        "--checkpoint-minutes",
+        default=0,
+        type=float,
+        help="also write a mid-epoch checkpoint every N minutes (default: 0, never)",
+    )
+    parser.add_argument(
+        "--keep-last", default=0, type=int, help="keep the checkpoints of the last N epochs (default: 0, keep all)"
+    )
+    parser.add_argument(
+        "--keep-best",
+        default=0,
+        type=int,
+        help="also keep the checkpoints of the N epochs with the best evaluation AP (default: 0, keep all)",
+    )
     parser.add_argument(
         "--pretrained",
         dest="pretrained",
@@ -153,50 +383,75 @@ def main(args):
     if args.output_dir:
         utils.mkdir(args.output_dir)
 
+    if args.async_eval and not args.output_dir:
+        raise ValueError("--async-eval evaluates the saved checkpoints and requires --output-dir")
+
     utils.init_distributed_mode(args)
     print(args)
 
     device = torch.device(args.device)
+    amp_dtype = AMP_DTYPES[args.amp_dtype] if args.amp_dtype else None
+    if amp_dtype == torch.float16 and device.type != "cuda":
+        raise ValueError("--amp-dtype fp16 requires a CUDA device, use bf16 on CPU")
+    # bf16 has the exponent range of float32, only fp16 needs loss scaling
+    scaler = torch.cuda.amp.GradScaler() if amp_dtype == torch.float16 else None
 
     # Data loading code
     print("Loading data")
 
-    dataset, num_classes = get_dataset(args.dataset, "train", get_transform(True, args), args.data_path)
+    train_transform = get_transform(True, args)
+    dataset, num_classes = get_dataset(args.dataset, "train", train_transform, args.data_path)
     dataset_test, _ = get_dataset(args.dataset, "val", get_transform(False, args), args.data_path)
 
     print("Creating data loaders")
-    if args.distributed:
-        train_sampler = torch.utils.data.distributed.DistributedSampler(dataset)
-        test_sampler = torch.utils.data.distributed.DistributedSampler(dataset_test)
-    else:
-        train_sampler = torch.utils.data.RandomSampler(dataset)
-        test_sampler = torch.utils.data.SequentialSampler(dataset_test)
-
     if args.aspect_ratio_group_factor >= 0:
         group_ids = create_aspect_ratio_groups(dataset, k=args.aspect_ratio_group_factor)
-        train_batch_sampler = GroupedBatchSampler(train_sampler, group_ids, args.batch_size)
     else:
-        train_batch_sampler = torch.utils.data.BatchSampler(train_sampler, args.batch_size, drop_last=True)
+        # a single group: shuffled batches of any aspect ratio, without the last incomplete one
+        group_ids = np.zeros(len(dataset), dtype=np.int64)
+    if args.seed is None:
+        # every rank must shuffle with the same seed, the one of the first rank
+        args.seed = utils.all_gather(int(np.random.SeedSequence().entropy % 2**63))[0]
+        print(f"Shuffling with seed {args.seed}")
+    # the batch plan shuffles and shards the dataset, and can resume an epoch at any batch
+    train_batch_sampler = GroupedBatchPlanSampler(
+        group_ids, args.batch_size, seed=args.seed, num_replicas=utils.get_world_size(), rank=utils.get_rank()
+    )
 
+    batch_transform = None
+    collate_fn = utils.collate_fn
+    if args.batch_augmentation:
+        batch_transform = train_transform.batch_transform
+        collate_fn = T.collate_uint8_batch
+    step_checkpoints = bool(args.output_dir) and (args.checkpoint_steps > 0 or args.checkpoint_minutes > 0)
+    # with mid-epoch checkpoints or on resume, the augmentations of a sample only depend on the seed, the epoch and
+    # the sample, so that a resumed epoch gets the same ones, and the DataLoader has its own generator, so that
+    # creating its iterator does not draw from the global one restored on resume
+    seeded_dataset = None
+    generator = None
+    if step_checkpoints or args.resume:
+        seeded_dataset = utils.SeededDataset(dataset, args.seed)
+        generator = torch.Generator().manual_seed(args.seed)
     data_loader = torch.utils.data.DataLoader(
-        dataset, batch_sampler=train_batch_sampler, num_workers=args.workers, collate_fn=utils.collate_fn
+        seeded_dataset if seeded_dataset is not None else dataset,
+        batch_sampler=train_batch_sampler,
+        num_workers=args.workers,
+        collate_fn=collate_fn,
+        generator=generator,
     )
 
-    data_loader_test = torch.utils.data.DataLoader(
-        dataset_test, batch_size=1, sampler=test_sampler, num_workers=args.workers, collate_fn=utils.collate_fn
-    )
+    data_loader_test = get_test_loader(dataset_test, args)
+
+    # A fixed subset of the test set, evenly spaced so that it is the same in every epoch and every process
+    subset_indices = None
+    data_loader_subset = data_loader_test
+    if 0 < args.eval_subset < len(dataset_test):
+        subset_indices = np.linspace(0, len(dataset_test) - 1, args.eval_subset).round().astype(int)
+        subset_indices = np.unique(subset_indices).tolist()
+        data_loader_subset = get_test_loader(torch.utils.data.Subset(dataset_test, subset_indices), args)
 
     print("Creating model")
-    kwargs = {"trainable_backbone_layers": args.trainable_backbone_layers}
-    if "rcnn" in args.model:
-        if args.rpn_score_thresh is not None:
-            kwargs["rpn_score_thresh"] = args.rpn_score_thresh
-    if not args.weights:
-        model = torchvision.models.detection.__dict__[args.model](
-            pretrained=args.pretrained, num_classes=num_classes, **kwargs
-        )
-    else:
-        model = PM.detection.__dict__[args.model](weights=args.weights, num_classes=num_classes, **kwargs)
+    model = create_model(args, num_classes)
     model.to(device)
     if args.distributed and args.sync_bn:
         model = torch.nn.SyncBatchNorm.convert_sync_batchnorm(model)
@@ -219,37 +474,180 @@ def main(args):
             f"Invalid lr scheduler '{args.lr_scheduler}'. Only MultiStepLR and CosineAnnealingLR are supported."
         )
 
+    resume_step = None
     if args.resume:
         checkpoint = torch.load(args.resume, map_location="cpu")
         model_without_ddp.load_state_dict(checkpoint["model"])
         optimizer.load_state_dict(checkpoint["optimizer"])
         lr_scheduler.load_state_dict(checkpoint["lr_scheduler"])
         args.start_epoch = checkpoint["epoch"] + 1
+        if "seed" in checkpoint:
+            # the resumed run continues the same shuffling and augmentations
+            args.seed = train_batch_sampler.seed = seeded_dataset.seed = checkpoint["seed"]
+            generator.manual_seed(args.seed)
+        if "step" in checkpoint:
+            # a mid-epoch checkpoint: its epoch continues at the next batch
+            resume_step = checkpoint["step"]
+            args.start_epoch = checkpoint["epoch"]
+        if scaler is not None and "scaler" in checkpoint:
+            scaler.load_state_dict(checkpoint["scaler"])
 
     if args.test_only:
-        evaluate(model, data_loader_test, device=device)
+        if args.amp_report:
+            report = compare_precision(
+                model, data_loader_test, device, amp_dtype=amp_dtype or torch.bfloat16, native=args.native_eval
+            )
+            print(
+                f"fp32: {report['fp32_seconds']:.1f}s, autocast: {report['amp_seconds']:.1f}s, "
+                f"speedup: {report['speedup']:.2f}x"
+            )
+            for iou_type, delta in report["stats_delta"].items():
+                print(f"{iou_type} stats delta (autocast - fp32): {[round(d, 4) for d in delta]}")
+            return
+        with profile_context(args, "eval") as profiler:
+            evaluate(
+                model,
+                data_loader_test,
+                device=device,
+                native=args.native_eval,
+                amp_dtype=amp_dtype,
+                profiler=profiler,
+            )
         return
 
+    eval_log_path = os.path.join(args.output_dir, "eval_log.jsonl") if args.output_dir else None
+    eval_process = None
+    eval_process_epoch = None
+
+    checkpoint_writer = None
+    if args.output_dir:
+        checkpoint_writer = CheckpointWriter(
+            args.output_dir, keep_last=args.keep_last, keep_best=args.keep_best, enabled=utils.is_main_process()
+        )
+        for logged_epoch, metric in read_evaluation_metrics(eval_log_path).items():
+            checkpoint_writer.set_metric(logged_epoch, metric)
+
+    step_checkpointer = None
+    if step_checkpoints:
+        step_checkpointer = StepCheckpointer(
+            checkpoint_writer,
+            every_steps=args.checkpoint_steps,
+            every_seconds=args.checkpoint_minutes * 60,
+            device=device,
+        )
+
+    telemetry = None
+    if args.telemetry:
+        telemetry_path = os.path.join(args.output_dir, f"telemetry.{args.telemetry}") if args.output_dir else None
+        telemetry = utils.StageTimer(
+            telemetry_path if utils.is_main_process() else None, synchronize=device.type == "cuda"
+        )
+
+    profiled_eval = False
+    if resume_step is not None:
+        utils.set_rng_state(resume_step["rng"])
     print("Start training")
     start_time = time.time()
     for epoch in range(args.start_epoch, args.epochs):
-        if args.distributed:
-            train_sampler.set_epoch(epoch)
-        train_one_epoch(model, optimizer, data_loader, device, epoch, args.print_freq)
-        lr_scheduler.step()
-        if args.output_dir:
-            checkpoint = {
-                "model": model_without_ddp.state_dict(),
-                "optimizer": optimizer.state_dict(),
-                "lr_scheduler": lr_scheduler.state_dict(),
-                "args": args,
-                "epoch": epoch,
-            }
-            utils.save_on_master(checkpoint, os.path.join(args.output_dir, f"model_{epoch}.pth"))
-            utils.save_on_master(checkpoint, os.path.join(args.output_dir, "checkpoint.pth"))
-
-        # evaluate after every epoch
-        evaluate(model, data_loader_test, device=device)
+        train_batch_sampler.set_epoch(epoch)
+        if seeded_dataset is not None:
+            seeded_dataset.set_epoch(epoch)
+        start_iteration = 0
+        warmup_state = None
+        if resume_step is not None and epoch == args.start_epoch:
+            train_batch_sampler.load_state_dict(resume_step["sampler"])
+            start_iteration = resume_step["iteration"]
+            warmup_state = resume_step["warmup_lr_scheduler"]
+
+        step_callback = None
+        # SIGTERM is deferred to the next optimizer step during the training loop and its epoch checkpoint
+        sigterm_context = contextlib.nullcontext()
+        if step_checkpointer is not None:
+            sigterm_context = step_checkpointer.deferred_sigterm()
+
+            def step_callback(iteration, warmup_lr_scheduler, epoch=epoch, start_iteration=start_iteration):
+                def get_step_checkpoint():
+                    checkpoint = get_checkpoint(model_without_ddp, optimizer, lr_scheduler, scaler, args, epoch)
+                    checkpoint["step"] = {
+                        "iteration": iteration,
+                        "sampler": train_batch_sampler.state_dict(iteration - start_iteration),
+                        "warmup_lr_scheduler": warmup_lr_scheduler.state_dict() if warmup_lr_scheduler else None,
+                        "rng": utils.get_rng_state(),
+                    }
+                    return checkpoint
+
+                step_checkpointer.step(get_step_checkpoint)
+
+        with sigterm_context:
+            with profile_context(args, "train" if epoch == args.start_epoch else None) as profiler:
+                train_one_epoch(
+                    model,
+                    optimizer,
+                    data_loader,
+                    device,
+                    epoch,
+                    args.print_freq,
+                    scaler,
+                    amp_dtype,
+                    args.accumulation_steps,
+                    args.lazy_logging,
+                    telemetry,
+                    profiler,
+                    start_iteration,
+                    warmup_state,
+                    step_callback,
+                    batch_transform,
+                )
+            lr_scheduler.step()
+
+            last_epoch = epoch == args.epochs - 1
+            run_eval = last_epoch or (epoch + 1) % args.eval_every == 0
+            if args.output_dir:
+                checkpoint = get_checkpoint(model_without_ddp, optimizer, lr_scheduler, scaler, args, epoch)
+                checkpoint_writer.save(checkpoint, epoch, await_metric=run_eval)
+
+        if not run_eval:
+            continue
+        # the intermediate evaluations use the subset, the last one the full test set
+        indices = None if last_epoch else subset_indices
+        if args.async_eval:
+            if utils.is_main_process():
+                # at most one evaluation runs next to training
+                if eval_process is not None:
+                    eval_process.join()
+                    metric = read_evaluation_metrics(eval_log_path).get(eval_process_epoch)
+                    checkpoint_writer.set_metric(eval_process_epoch, metric)
+                # the evaluation process reads the checkpoint file of this epoch
+                checkpoint_writer.flush()
+                eval_process = torch.multiprocessing.get_context("spawn").Process(
+                    target=evaluate_checkpoint,
+                    args=(args, checkpoint_writer.epoch_path(epoch), epoch, indices, eval_log_path),
+                )
+                eval_process.start()
+                eval_process_epoch = epoch
+        else:
+            data_loader_eval = data_loader_test if indices is None else data_loader_subset
+            with profile_context(args, "eval" if not profiled_eval else None) as profiler:
+                coco_evaluator = evaluate(
+                    model,
+                    data_loader_eval,
+                    device=device,
+                    native=args.native_eval,
+                    amp_dtype=amp_dtype,
+                    telemetry=telemetry,
+                    profiler=profiler,
+                )
+            profiled_eval = True
+            if eval_log_path and utils.is_main_process():
+                log_evaluation(eval_log_path, epoch, coco_evaluator, indices is not None)
+            if checkpoint_writer is not None:
+                checkpoint_writer.set_metric(epoch, get_evaluation_metric(coco_evaluator.summary_stats()))
+
+    if eval_process is not None:
+        eval_process.join()
+        checkpoint_writer.set_metric(eval_process_epoch, read_evaluation_metrics(eval_log_path).get(eval_process_epoch))
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
 
     total_time = time.time() - start_time
     total_time_str = str(datetime.timedelta(seconds=int(total_time)))
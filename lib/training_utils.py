@@ -3,6 +3,7 @@ import cv2
 import matplotlib.pyplot as plt
 import shutil
 from PIL import Image as Image
+from image_decoding import read_image
 from shared_utils import get_all_global_variable
 import sys
 sys.path.append('../utils')
@@ -124,6 +125,29 @@ def get_image_file_and_path_and_renderable_image_from_json(json_file, mode):
     image = cv2.imread(image_path)
     renderable_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     return image_file, image_path, renderable_image
+
+def get_image_file_and_path_and_reduced_image_from_json(json_file, mode, target_size):
+    """
+    Same as get_image_file_and_path_and_renderable_image_from_json, but decodes JPEG images directly at a reduced
+    resolution that is still at least target_size, see image_decoding.read_image.
+
+    Parameters:
+    json_file (str): The name of the JSON file containing the image information.
+    mode (str): Indicates whether the image information is for 'train' or 'test'.
+    target_size (tuple): The (height, width) the image is resized to afterwards.
+
+    Returns:
+    tuple: A tuple containing four elements:
+           - The name of the image file.
+           - The path to the image file.
+           - The image in RGB format, possibly at a reduced resolution.
+           - The (x, y) scale of the image relative to its full resolution, to apply to its annotations.
+    """
+    destination_path = train_img_dir if mode == "train" else test_img_dir
+    image_file = os.path.splitext(json_file)[0] + ".jpg"
+    image_path = os.path.join(destination_path, image_file)
+    image, scale = read_image(image_path, target_size)
+    return image_file, image_path, image, scale
         
 def display_image_with_bboxes_and_keypoints_cv2(image, bboxes, keypoints):
     """
@@ -1,3 +1,4 @@
+import math
 from typing import List, Tuple, Dict, Optional
 
 import torch
@@ -7,9 +8,11 @@ from torchvision.transforms import functional as F
 from torchvision.transforms import transforms as T
 
 
+_COCO_PERSON_FLIP_INDS = [0, 2, 1, 4, 3, 6, 5, 8, 7, 10, 9, 12, 11, 14, 13, 16, 15]
+
+
 def _flip_coco_person_keypoints(kps, width):
-    flip_inds = [0, 2, 1, 4, 3, 6, 5, 8, 7, 10, 9, 12, 11, 14, 13, 16, 15]
-    flipped_data = kps[:, flip_inds]
+    flipped_data = kps[:, _COCO_PERSON_FLIP_INDS]
     flipped_data[..., 0] = width - flipped_data[..., 0]
     # Maintain COCO convention that if visibility == 0, then x, y = 0
     inds = flipped_data[..., 2] == 0
@@ -281,3 +284,312 @@ class RandomPhotometricDistort(nn.Module):
                 image = F.to_pil_image(image)
 
         return image, target
+
+
+# Batch transforms: after PILToTensor in the data loader workers, collate_uint8_batch pads the uint8 images of
+# a batch into one (B, C, H, W) tensor, and the Batch* transforms below apply the augmentations to the whole
+# batch at once with per-sample random parameters, e.g. on the device of the model. The targets are updated with
+# tensor ops over the boxes, keypoints and masks of all the samples concatenated. split_batch returns the list of
+# images and targets the detection models take.
+
+
+def collate_uint8_batch(batch):
+    """
+    Collates (uint8 image, target) samples into ((images, image_sizes), targets).
+
+    images is a (B, C, H, W) tensor of the images padded with zeros to the largest height and width, image_sizes
+    the (height, width) of every image as a (B, 2) int64 tensor. The masks of the targets are padded the same way.
+    """
+    images, targets = tuple(zip(*batch))
+    image_sizes = torch.tensor([tuple(image.shape[-2:]) for image in images], dtype=torch.int64)
+    height, width = image_sizes.max(0).values.tolist()
+    if (image_sizes == image_sizes[0]).all():
+        return (torch.stack(images), image_sizes), targets
+    padded_images = images[0].new_zeros((len(images), images[0].shape[0], height, width))
+    for image, padded in zip(images, padded_images):
+        padded[:, : image.shape[-2], : image.shape[-1]].copy_(image)
+    for target in targets:
+        if "masks" in target:
+            masks = target["masks"]
+            target["masks"] = masks.new_zeros((masks.shape[0], height, width))
+            target["masks"][:, : masks.shape[-2], : masks.shape[-1]].copy_(masks)
+    return (padded_images, image_sizes), targets
+
+
+def split_batch(
+    images: Tensor, targets: List[Dict[str, Tensor]], image_sizes: Tensor
+) -> Tuple[List[Tensor], List[Dict[str, Tensor]]]:
+    """
+    Returns the images of a batch of collate_uint8_batch as a list of views without their padding, and the
+    targets with their masks cropped the same way.
+    """
+    sizes = image_sizes.tolist()
+    for target, (height, width) in zip(targets, sizes):
+        if "masks" in target:
+            target["masks"] = target["masks"][:, :height, :width]
+    return [image[:, :height, :width] for image, (height, width) in zip(images, sizes)], targets
+
+
+def _cat_targets(targets: List[Dict[str, Tensor]], key: str, device: torch.device) -> Tuple[Tensor, Tensor]:
+    # Concatenates one field of all the targets, with the index of the sample of every row
+    values = [target[key] for target in targets]
+    counts = torch.tensor([len(value) for value in values], device=device)
+    return torch.cat(values).to(device), torch.repeat_interleave(torch.arange(len(values), device=device), counts)
+
+
+def _split_targets(targets: List[Dict[str, Tensor]], key: str, values: Tensor) -> None:
+    for target, value in zip(targets, values.split([len(target[key]) for target in targets])):
+        target[key] = value
+
+
+def _check_float_batch(images: Tensor) -> None:
+    if images.ndimension() != 4:
+        raise ValueError(f"images should be 4 dimensional. Got {images.ndimension()} dimensions.")
+    if not images.is_floating_point():
+        raise ValueError(f"images should be a floating point tensor, see BatchConvertImageDtype. Got {images.dtype}.")
+
+
+class BatchCompose:
+    def __init__(self, transforms):
+        self.transforms = transforms
+
+    def __call__(self, images, targets, image_sizes):
+        for t in self.transforms:
+            images, targets = t(images, targets, image_sizes)
+        return images, targets
+
+
+class BatchConvertImageDtype(nn.Module):
+    def __init__(self, dtype: torch.dtype) -> None:
+        super().__init__()
+        self.dtype = dtype
+
+    def forward(
+        self, images: Tensor, targets: Optional[List[Dict[str, Tensor]]], image_sizes: Tensor
+    ) -> Tuple[Tensor, Optional[List[Dict[str, Tensor]]]]:
+        return F.convert_image_dtype(images, self.dtype), targets
+
+
+class BatchRandomHorizontalFlip(nn.Module):
+    """
+    Flips every image of a batch with probability p, within its own width.
+
+    keypoint_flip_inds is the order of the keypoints after a flip, e.g. left and right keypoints swapped.
+    With None, it is the one of the COCO person keypoints for 17 keypoints, and the same order otherwise.
+    """
+
+    def __init__(self, p: float = 0.5, keypoint_flip_inds: Optional[List[int]] = None) -> None:
+        super().__init__()
+        self.p = p
+        self.keypoint_flip_inds = keypoint_flip_inds
+
+    def forward(
+        self, images: Tensor, targets: Optional[List[Dict[str, Tensor]]], image_sizes: Tensor
+    ) -> Tuple[Tensor, Optional[List[Dict[str, Tensor]]]]:
+        batch_size, width = images.shape[0], images.shape[-1]
+        device = images.device
+        flip = torch.rand(batch_size, device=device) < self.p
+        widths = image_sizes[:, 1:].to(device)
+        # source column of every column, the padding columns stay in place
+        x = torch.arange(width, device=device)
+        columns = torch.where(flip[:, None] & (x < widths), widths - 1 - x, x)
+        images = images.gather(-1, columns[:, None, None, :].expand_as(images))
+
+        if targets is None:
+            return images, targets
+
+        boxes, index = _cat_targets(targets, "boxes", device)
+        box_widths = widths[index].to(boxes.dtype)
+        flipped = torch.stack(
+            [box_widths[:, 0] - boxes[:, 2], boxes[:, 1], box_widths[:, 0] - boxes[:, 0], boxes[:, 3]], dim=1
+        )
+        _split_targets(targets, "boxes", torch.where(flip[index, None], flipped, boxes))
+
+        if "keypoints" in targets[0]:
+            keypoints, index = _cat_targets(targets, "keypoints", device)
+            flip_inds = self.keypoint_flip_inds
+            if flip_inds is None:
+                flip_inds = _COCO_PERSON_FLIP_INDS if keypoints.shape[1] == 17 else list(range(keypoints.shape[1]))
+            flipped = keypoints[:, flip_inds]
+            flipped[..., 0] = widths[index].to(keypoints.dtype) - flipped[..., 0]
+            # Maintain COCO convention that if visibility == 0, then x, y = 0
+            flipped[flipped[..., 2] == 0] = 0
+            _split_targets(targets, "keypoints", torch.where(flip[index, None, None], flipped, keypoints))
+
+        if "masks" in targets[0]:
+            masks, index = _cat_targets(targets, "masks", device)
+            masks = masks.gather(-1, columns[index, None, :].expand_as(masks))
+            _split_targets(targets, "masks", masks)
+
+        return images, targets
+
+
+class BatchRandomZoomOut(nn.Module):
+    """
+    Zooms out of every image of a batch with probability 1 - p, as RandomZoomOut.
+
+    RandomZoomOut places an image on a canvas side_range times larger. Here, the canvas keeps the size of the
+    image and the image is scaled down in it instead, so that the batch keeps its shape. The detection models
+    resize their inputs to the same size either way, so the result is the same up to interpolation.
+    fill is the color of the canvas in the 0-255 range. The keypoints are moved with the boxes.
+    """
+
+    def __init__(
+        self, fill: Optional[List[float]] = None, side_range: Tuple[float, float] = (1.0, 4.0), p: float = 0.5
+    ):
+        super().__init__()
+        if fill is None:
+            fill = [0.0, 0.0, 0.0]
+        self.fill = fill
+        self.side_range = side_range
+        if side_range[0] < 1.0 or side_range[0] > side_range[1]:
+            raise ValueError(f"Invalid canvas side range provided {side_range}.")
+        self.p = p
+
+    def forward(
+        self, images: Tensor, targets: Optional[List[Dict[str, Tensor]]], image_sizes: Tensor
+    ) -> Tuple[Tensor, Optional[List[Dict[str, Tensor]]]]:
+        _check_float_batch(images)
+        batch_size, _, height, width = images.shape
+        device = images.device
+        dtype = images.dtype
+
+        zoom = torch.rand(batch_size, device=device) >= self.p
+        r = self.side_range[0] + torch.rand(batch_size, device=device, dtype=dtype) * (
+            self.side_range[1] - self.side_range[0]
+        )
+        scale = torch.where(zoom, 1.0 / r, torch.ones_like(r))[:, None]
+        sizes = image_sizes.to(device=device, dtype=dtype)
+        # (top, left) of the scaled down image in its canvas
+        offset = sizes * (1.0 - scale) * torch.rand(batch_size, 2, device=device, dtype=dtype)
+
+        # source pixel coordinates of the centers of the output pixels, normalized for grid_sample
+        source_x = (torch.arange(width, device=device, dtype=dtype) + 0.5 - offset[:, 1:]) / scale
+        source_y = (torch.arange(height, device=device, dtype=dtype) + 0.5 - offset[:, :1]) / scale
+        grid = torch.stack(
+            torch.broadcast_tensors((2 * source_x / width - 1)[:, None, :], (2 * source_y / height - 1)[:, :, None]),
+            dim=-1,
+        )
+        inside = ((source_x >= 0) & (source_x < sizes[:, 1:]))[:, None, None, :] & (
+            (source_y >= 0) & (source_y < sizes[:, :1])
+        )[:, None, :, None]
+        zoomed = torch.nn.functional.grid_sample(images, grid, padding_mode="border", align_corners=False)
+        fill = torch.tensor(self.fill, device=device, dtype=dtype).view(1, -1, 1, 1) / 255
+        images = torch.where(zoom[:, None, None, None], torch.where(inside, zoomed, fill), images)
+
+        if targets is None:
+            return images, targets
+
+        boxes, index = _cat_targets(targets, "boxes", device)
+        box_offset = offset[index].flip(-1).repeat(1, 2).to(boxes.dtype)
+        _split_targets(targets, "boxes", boxes * scale[index].to(boxes.dtype) + box_offset)
+
+        if "keypoints" in targets[0]:
+            keypoints, index = _cat_targets(targets, "keypoints", device)
+            xy = keypoints[..., :2] * scale[index, None].to(keypoints.dtype) + offset[index, None].flip(-1)
+            # Maintain COCO convention that if visibility == 0, then x, y = 0
+            xy = torch.where(keypoints[..., 2:] == 0, keypoints[..., :2], xy.to(keypoints.dtype))
+            _split_targets(targets, "keypoints", torch.cat([xy, keypoints[..., 2:]], -1))
+
+        if "masks" in targets[0]:
+            masks, index = _cat_targets(targets, "masks", device)
+            zoomed = torch.nn.functional.grid_sample(
+                masks[:, None].to(dtype), grid[index], mode="nearest", align_corners=False
+            )
+            _split_targets(targets, "masks", zoomed[:, 0].round().to(masks.dtype))
+
+        return images, targets
+
+
+def _rgb_to_grayscale(images: Tensor) -> Tensor:
+    r, g, b = images.unbind(dim=-3)
+    return (0.2989 * r + 0.587 * g + 0.114 * b).unsqueeze(dim=-3)
+
+
+def _blend(images: Tensor, other: Tensor, ratio: Tensor) -> Tensor:
+    return (ratio * images + (1.0 - ratio) * other).clamp(0.0, 1.0)
+
+
+class BatchRandomPhotometricDistort(nn.Module):
+    """
+    Applies the distortions of RandomPhotometricDistort to a batch of RGB images, with per-sample factors.
+
+    The hue is shifted by rotating the chroma in the YIQ color space, which is a matrix product per image,
+    instead of by a round trip through HSV.
+    """
+
+    def __init__(
+        self,
+        contrast: Tuple[float] = (0.5, 1.5),
+        saturation: Tuple[float] = (0.5, 1.5),
+        hue: Tuple[float] = (-0.05, 0.05),
+        brightness: Tuple[float] = (0.875, 1.125),
+        p: float = 0.5,
+    ):
+        super().__init__()
+        self.contrast = contrast
+        self.saturation = saturation
+        self.hue = hue
+        self.brightness = brightness
+        self.p = p
+
+    def _sample(self, value_range: Tuple[float, float], apply: Tensor, default: float, dtype: torch.dtype) -> Tensor:
+        # one factor per image, the default where the distortion is not applied
+        factor = torch.empty(apply.shape, device=apply.device, dtype=dtype).uniform_(value_range[0], value_range[1])
+        return torch.where(apply, factor, torch.full_like(factor, default)).view(-1, 1, 1, 1)
+
+    def forward(
+        self, images: Tensor, targets: Optional[List[Dict[str, Tensor]]], image_sizes: Tensor
+    ) -> Tuple[Tensor, Optional[List[Dict[str, Tensor]]]]:
+        _check_float_batch(images)
+        if images.shape[1] != 3:
+            raise ValueError(f"images should have 3 channels. Got {images.shape[1]} channels.")
+        batch_size, _, height, width = images.shape
+        device = images.device
+        dtype = images.dtype
+
+        r = torch.rand(batch_size, 7, device=device)
+        brightness = self._sample(self.brightness, r[:, 0] < self.p, 1.0, dtype)
+        contrast = self._sample(self.contrast, r[:, 2] < self.p, 1.0, dtype)
+        contrast_before = (r[:, 1] < 0.5).view(-1, 1, 1, 1)
+        saturation = self._sample(self.saturation, r[:, 3] < self.p, 1.0, dtype)
+        hue = self._sample(self.hue, r[:, 4] < self.p, 0.0, dtype)
+
+        # the contrast blends with the mean gray level of the image, without its padding
+        valid = (torch.arange(height, device=device)[:, None] < image_sizes[:, :1, None].to(device)) & (
+            torch.arange(width, device=device) < image_sizes[:, 1:, None].to(device)
+        )
+        valid = valid[:, None].to(dtype)
+        num_pixels = valid.sum(dim=(-3, -2, -1), keepdim=True)
+
+        def adjust_contrast(images, factor):
+            mean = (_rgb_to_grayscale(images) * valid).sum(dim=(-3, -2, -1), keepdim=True) / num_pixels
+            return _blend(images, mean, factor)
+
+        images = (images * brightness).clamp(0.0, 1.0)
+        images = adjust_contrast(images, torch.where(contrast_before, contrast, torch.ones_like(contrast)))
+        images = _blend(images, _rgb_to_grayscale(images), saturation)
+
+        rgb_to_yiq = torch.tensor(
+            [[0.299, 0.587, 0.114], [0.596, -0.274, -0.322], [0.211, -0.523, 0.312]], device=device, dtype=torch.float
+        )
+        angle = 2 * math.pi * hue.view(-1).float()
+        cos, sin = torch.cos(angle), torch.sin(angle)
+        rotation = torch.zeros(batch_size, 3, 3, device=device)
+        rotation[:, 0, 0] = 1.0
+        rotation[:, 1, 1] = rotation[:, 2, 2] = cos
+        rotation[:, 1, 2] = -sin
+        rotation[:, 2, 1] = sin
+        matrix = (torch.linalg.inv(rgb_to_yiq) @ rotation @ rgb_to_yiq).to(dtype)
+        images = torch.einsum("bij,bjhw->bihw", matrix, images).clamp(0.0, 1.0)
+
+        images = adjust_contrast(images, torch.where(contrast_before, torch.ones_like(contrast), contrast))
+
+        permutation = torch.where(
+            (r[:, 6] < self.p)[:, None],
+            torch.rand(batch_size, 3, device=device).argsort(dim=1),
+            torch.arange(3, device=device),
+        )
+        images = images.gather(1, permutation[:, :, None, None].expand_as(images))
+
+        return images, targets
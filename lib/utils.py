@@ -1,11 +1,16 @@
+import csv
 import datetime
 import errno
+import json
 import os
+import random
 import time
 from collections import defaultdict, deque
 
+import numpy as np
 import torch
 import torch.distributed as dist
+import torch.utils.data
 
 
 class SmoothedValue:
@@ -169,7 +174,9 @@ class MetricLogger:
             )
         MB = 1024.0 * 1024.0
         for obj in iterable:
-            data_time.update(time.time() - end)
+            # the wait for obj only, without the logging of the previous iteration
+            self.data_wait = time.time() - end
+            data_time.update(self.data_wait)
             yield obj
             iter_time.update(time.time() - end)
             if i % print_freq == 0 or i == len(iterable) - 1:
@@ -200,10 +207,179 @@ class MetricLogger:
         print(f"{header} Total time: {total_time_str} ({total_time / len(iterable):.4f} s / it)")
 
 
+class StageTimer:
+    """Record the wall time of the stages of every iteration of a training or
+    evaluation loop, as a JSONL or CSV telemetry file, and summarize it per epoch.
+
+    Call lap(stage) at the end of every stage: the time since the previous lap is
+    added to that stage. The first lap of an iteration measures the wait for data,
+    see lap for excluding the logging that runs before it.
+    Call end_iteration() at the end of every iteration, and start_epoch/end_epoch
+    around every loop. end_epoch returns the p50/p95/p99 of every stage, in seconds.
+
+    Args:
+        path (str, optional): the telemetry file, CSV if it ends with ".csv", JSONL otherwise.
+            The epoch summaries of a CSV file go to a sibling "_summary.csv" file.
+            Without a path, the records are only kept for the epoch summary.
+        synchronize (bool): synchronize CUDA before every lap, so that the asynchronous work
+            is attributed to the stage that launched it.
+        enabled (bool): with False, every method does nothing.
+    """
+
+    STAGES = ["data", "h2d", "augment", "forward", "logging", "backward", "optimizer", "evaluator"]
+
+    def __init__(self, path=None, synchronize=False, enabled=True):
+        self.path = path
+        self.synchronize = synchronize
+        self.enabled = enabled
+        self.epoch = None
+        self.phase = None
+        self.records = []
+        self._current = {}
+        self._last = time.perf_counter()
+
+    def start_epoch(self, epoch, phase):
+        self.epoch = epoch
+        self.phase = phase
+        self.records = []
+        self._current = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage, elapsed=None):
+        """With elapsed, only the last elapsed seconds since the previous lap are added
+        to stage, and the time before them to "logging", e.g. for the loader wait
+        measured by MetricLogger.log_every after it printed the previous iteration."""
+        if not self.enabled:
+            return
+        if self.synchronize and torch.cuda.is_available():
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        total = now - self._last
+        if elapsed is not None:
+            elapsed = min(max(elapsed, 0.0), total)
+            self._current["logging"] = self._current.get("logging", 0.0) + total - elapsed
+            total = elapsed
+        self._current[stage] = self._current.get(stage, 0.0) + total
+        self._last = now
+
+    def end_iteration(self):
+        if not self.enabled:
+            return
+        record = {"phase": self.phase, "epoch": self.epoch, "iteration": len(self.records)}
+        record.update(self._current)
+        record["total"] = sum(self._current.values())
+        self.records.append(record)
+        self._current = {}
+
+    def summary(self):
+        summary = {}
+        for stage in self.STAGES + ["total"]:
+            values = np.array([record[stage] for record in self.records if stage in record])
+            if len(values) == 0:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]).tolist()
+            summary[stage] = {"p50": p50, "p95": p95, "p99": p99, "mean": float(values.mean())}
+        return summary
+
+    def end_epoch(self):
+        if not self.enabled or not self.records:
+            return {}
+        summary = self.summary()
+        print(
+            f"{self.phase} stage times (ms) p50/p95/p99: "
+            + "  ".join(
+                f"{stage}: {s['p50'] * 1000:.1f}/{s['p95'] * 1000:.1f}/{s['p99'] * 1000:.1f}"
+                for stage, s in summary.items()
+            )
+        )
+        if self.path:
+            self._write(summary)
+        return summary
+
+    def _write(self, summary):
+        if self.path.endswith(".csv"):
+            columns = ["phase", "epoch", "iteration"] + self.STAGES + ["total"]
+            _append_csv(self.path, columns, self.records)
+            rows = [dict(phase=self.phase, epoch=self.epoch, stage=stage, **s) for stage, s in summary.items()]
+            summary_path = self.path[: -len(".csv")] + "_summary.csv"
+            _append_csv(summary_path, ["phase", "epoch", "stage", "p50", "p95", "p99", "mean"], rows)
+        else:
+            with open(self.path, "a") as f:
+                for record in self.records:
+                    f.write(json.dumps(record) + "\n")
+                f.write(json.dumps({"phase": self.phase, "epoch": self.epoch, "summary": summary}) + "\n")
+
+
+def _append_csv(path, columns, rows):
+    write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        if write_header:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
 def collate_fn(batch):
     return tuple(zip(*batch))
 
 
+def get_rng_state():
+    """
+    Returns the states of the Python, NumPy and torch (CPU and CUDA) random number generators.
+    """
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    """
+    Restores random number generator states returned by get_rng_state.
+    """
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+class SeededDataset(torch.utils.data.Dataset):
+    """
+    Wraps a dataset so that the random transforms of every sample are seeded by (seed, epoch, index).
+
+    The augmentation of a sample then does not depend on the DataLoader worker that loads it, nor on the
+    samples that worker loaded before, so that a resumed epoch augments its remaining batches as the
+    interrupted run did. The random generator states of the process are restored after every sample.
+    Call set_epoch before every epoch.
+    """
+
+    def __init__(self, dataset, seed):
+        self.dataset = dataset
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        sample_seed = int(np.random.SeedSequence([self.seed, self.epoch, idx]).generate_state(1)[0])
+        python_state, numpy_state = random.getstate(), np.random.get_state()
+        with torch.random.fork_rng(devices=[]):
+            random.seed(sample_seed)
+            np.random.seed(sample_seed)
+            # only the CPU generator, the CUDA ones keep their state when the samples load in this process
+            torch.default_generator.manual_seed(sample_seed)
+            try:
+                return self.dataset[idx]
+            finally:
+                random.setstate(python_state)
+                np.random.set_state(numpy_state)
+
+
 def mkdir(path):
     try:
         os.makedirs(path)
@@ -1,8 +1,8 @@
 import os
-import json
 import cv2
 import matplotlib.pyplot as plt
 import numpy as np
+from annotation_index import AnnotationIndex
 
 # Directory paths
 dest_annotation_dir = '/home/citiai-cygnus/RollerDetection_HoangKhanh/roller_dataset/horizontal_flip_train/annotations'
@@ -12,13 +12,13 @@ output_dir = '/home/citiai-cygnus/RollerDetection_HoangKhanh/roller_dataset/visu
 # Create output directory if it doesn't exist
 os.makedirs(output_dir, exist_ok=True)
 
+# Boxes written by the augmentation are already in [xmin, ymin, xmax, ymax] format
+index = AnnotationIndex.build(dest_annotation_dir, bbox_format="xyxy")
+
 # Iterate through files in dest_annotation_dir (assuming both annotation and image filenames match)
-for json_file in os.listdir(dest_annotation_dir):
+for json_file in index.file_names.tolist():
     if json_file.endswith('.json'):
-        # Load JSON annotation file
-        json_path = os.path.join(dest_annotation_dir, json_file)
-        with open(json_path, 'r') as f:
-            data = json.load(f)
+        rows = index.rows_of(json_file)
         
         # Find corresponding image filename with .jpg extension
         image_filename = json_file[:-5] + '.jpg'  # Replace .json with .jpg
@@ -35,24 +35,15 @@ for json_file in os.listdir(dest_annotation_dir):
             # Albumentation format (during augmentation): same as OpenCV 
             
             # Draw bounding box on the image
-            for annotation in data['annotations']:
-                if 'bbox' in annotation and 'keypoints' in annotation:
-                    bbox = annotation['bbox']
-                    keypoints = annotation['keypoints']
-                    
-                    # Draw bounding box
-                    # For visualizing data directly
-                    # cv2.rectangle(image, (int(bbox[0]), int(bbox[1])), (int(bbox[0])+int(bbox[2]), int(bbox[1])+int(bbox[3])), (255, 0, 0), 1)
-                    # For visualizing data after augmentation
-                    cv2.rectangle(image, (int(bbox[0]), int(bbox[1])), (int(bbox[2]), int(bbox[3])), (255, 0, 0), 1)
-                    
-                    # Draw keypoints
-                    for i in range(0, len(keypoints), 3):
-                        x = int(keypoints[i])
-                        y = int(keypoints[i+1])
-                        visibility = keypoints[i+2]
-                        if visibility > 0:
-                            cv2.circle(image, (x, y), 1, (0, 255, 0), -1)
+            for bbox, keypoints in zip(index.boxes[rows], index.keypoints[rows]):
+                # Draw bounding box
+                # For visualizing data directly, build the index with bbox_format="xywh"
+                cv2.rectangle(image, (int(bbox[0]), int(bbox[1])), (int(bbox[2]), int(bbox[3])), (255, 0, 0), 1)
+                
+                # Draw keypoints
+                for x, y, visibility in keypoints:
+                    if visibility > 0:
+                        cv2.circle(image, (int(x), int(y)), 1, (0, 255, 0), -1)
             
             # Save the modified image with annotations
             output_image_path = os.path.join(output_dir, image_filename)
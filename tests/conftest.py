@@ -0,0 +1,71 @@
+import os
+import sys
+
+import pytest
+
+# the tests import the library package-style (lib.*), as the notebook does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_synthetic_coco(num_images=12, seed=0):
+    """
+    Returns a single-category COCO ground truth with one keypoint per roller, and predictions for every image
+    in the format of the model output (xyxy boxes), as numpy arrays: matched and jittered rollers, missed ones
+    and false positives, over all the COCO area ranges, with crowd regions and unlabeled keypoints.
+    """
+    import numpy as np
+    from pycocotools.coco import COCO
+
+    rng = np.random.default_rng(seed)
+    images, annotations, predictions = [], [], {}
+    for image_id in range(1, num_images + 1):
+        images.append({"id": image_id, "file_name": f"{image_id:06d}.jpg", "width": 640, "height": 480})
+        boxes, keypoints = [], []
+        for _ in range(rng.integers(0, 5)):
+            w, h = rng.uniform(5, 300, 2)
+            x, y = rng.uniform(0, 640 - w), rng.uniform(0, 480 - h)
+            kx, ky = x + rng.uniform(0, w), y + rng.uniform(0, h)
+            visible = rng.random() > 0.15
+            annotations.append(
+                {
+                    "id": len(annotations) + 1,
+                    "image_id": image_id,
+                    "category_id": 1,
+                    "bbox": [x, y, w, h],
+                    "area": w * h,
+                    "iscrowd": int(rng.random() < 0.1),
+                    "num_keypoints": int(visible),
+                    "keypoints": [kx, ky, 2] if visible else [0, 0, 0],
+                }
+            )
+            if rng.random() < 0.8:
+                dx, dy, dw, dh = rng.normal(0, 0.1, 4) * [w, h, w, h]
+                boxes.append([x + dx, y + dy, x + dx + w + dw, y + dy + h + dh])
+                keypoints.append([[kx + rng.normal(0, 3), ky + rng.normal(0, 3), 1]])
+        for _ in range(rng.integers(0, 3)):
+            w, h = rng.uniform(5, 300, 2)
+            x, y = rng.uniform(0, 640 - w), rng.uniform(0, 480 - h)
+            boxes.append([x, y, x + w, y + h])
+            keypoints.append([[x + rng.uniform(0, w), y + rng.uniform(0, h), 1]])
+        predictions[image_id] = {
+            "boxes": np.asarray(boxes, dtype=np.float32).reshape(-1, 4),
+            "scores": rng.random(len(boxes)).astype(np.float32),
+            "labels": np.ones(len(boxes), dtype=np.int64),
+            "keypoints": np.asarray(keypoints, dtype=np.float32).reshape(-1, 1, 3),
+        }
+
+    coco_gt = COCO()
+    coco_gt.dataset = {
+        "images": images,
+        "annotations": annotations,
+        "categories": [{"id": 1, "name": "roller", "keypoints": ["center"], "skeleton": []}],
+    }
+    coco_gt.createIndex()
+    return coco_gt, predictions
+
+
+@pytest.fixture
+def synthetic_coco():
+    pytest.importorskip("numpy")
+    pytest.importorskip("pycocotools")
+    return make_synthetic_coco()
@@ -0,0 +1,30 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("pycocotools")
+
+from lib.coco.coco_eval import CocoEvaluator  # noqa: E402
+
+
+def evaluate(coco_gt, predictions, single_pass, batch_size=3):
+    evaluator = CocoEvaluator(coco_gt, ["bbox", "keypoints"], kpt_oks_sigmas=np.array([0.1]), single_pass=single_pass)
+    image_ids = sorted(predictions)
+    for start in range(0, len(image_ids), batch_size):
+        batch = image_ids[start : start + batch_size]
+        evaluator.update({i: {k: torch.from_numpy(v) for k, v in predictions[i].items()} for i in batch})
+    evaluator.synchronize_between_processes()
+    evaluator.accumulate()
+    evaluator.summarize()
+    return evaluator.summary_stats()
+
+
+def test_single_pass_matches_per_batch_evaluation(synthetic_coco):
+    coco_gt, predictions = synthetic_coco
+    per_batch = evaluate(coco_gt, predictions, single_pass=False)
+    single_pass = evaluate(coco_gt, predictions, single_pass=True)
+
+    assert set(single_pass) == {"bbox", "keypoints"}
+    for iou_type, stats in per_batch.items():
+        np.testing.assert_allclose(single_pass[iou_type], stats, atol=1e-12)
+    assert per_batch["bbox"][0] > 0
@@ -0,0 +1,55 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+
+from lib.group_by_aspect_ratio import GroupedBatchPlanSampler, GroupedBatchSampler  # noqa: E402
+
+
+class PermutationSampler(torch.utils.data.Sampler):
+    def __init__(self, permutation):
+        self.permutation = permutation
+
+    def __iter__(self):
+        return iter(self.permutation.tolist())
+
+    def __len__(self):
+        return len(self.permutation)
+
+
+def reference_batches(group_ids, batch_size, permutation):
+    sampler = GroupedBatchSampler(PermutationSampler(permutation), group_ids.tolist(), batch_size)
+    return [list(batch) for batch in sampler]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_plan_matches_grouped_batch_sampler(seed):
+    rng = np.random.default_rng(seed)
+    num_samples = int(rng.integers(1, 80))
+    batch_size = int(rng.integers(1, 7))
+    _, group_ids = np.unique(rng.integers(0, 4, num_samples), return_inverse=True)
+    sampler = GroupedBatchPlanSampler(group_ids.tolist(), batch_size, seed=seed)
+    for epoch in range(3):
+        sampler.set_epoch(epoch)
+        permutation = np.random.default_rng([seed, epoch]).permutation(num_samples)
+        expected = reference_batches(group_ids, batch_size, permutation)
+        assert list(sampler) == expected
+        assert len(sampler) == len(expected)
+
+
+def test_plan_without_shuffle_matches_sequential_order():
+    group_ids = np.array([0, 1, 1, 0, 2, 1, 0, 0, 2, 1, 1])
+    sampler = GroupedBatchPlanSampler(group_ids.tolist(), 2, shuffle=False)
+    assert list(sampler) == reference_batches(group_ids, 2, np.arange(len(group_ids)))
+
+
+def test_resume_continues_the_plan():
+    group_ids = np.arange(40) % 3
+    sampler = GroupedBatchPlanSampler(group_ids.tolist(), 4, seed=7)
+    sampler.set_epoch(2)
+    batches = list(sampler)
+    resumed = GroupedBatchPlanSampler(group_ids.tolist(), 4, seed=0)
+    resumed.load_state_dict(sampler.state_dict(num_consumed=5))
+    assert list(resumed) == batches[5:]
+    assert len(resumed) == len(batches) - 5
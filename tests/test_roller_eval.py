@@ -0,0 +1,47 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("pycocotools")
+
+from lib.coco.roller_eval import RollerEvaluator  # noqa: E402
+
+
+def as_tensors(predictions):
+    return {image_id: {k: torch.from_numpy(v) for k, v in p.items()} for image_id, p in predictions.items()}
+
+
+def batches(predictions, batch_size):
+    image_ids = sorted(predictions)
+    for start in range(0, len(image_ids), batch_size):
+        yield {image_id: predictions[image_id] for image_id in image_ids[start : start + batch_size]}
+
+
+@pytest.mark.parametrize("num_images", [5, 100])
+def test_cross_check_agrees_with_pycocotools(synthetic_coco, num_images):
+    coco_gt, predictions = synthetic_coco
+    evaluator = RollerEvaluator(coco_gt, ["bbox", "keypoints"], kpt_oks_sigmas=np.array([0.1]))
+    for batch in batches(as_tensors(predictions), 4):
+        evaluator.update(batch)
+    evaluator.synchronize_between_processes()
+
+    report = evaluator.cross_check(num_images=num_images)
+
+    assert set(report) == {"bbox", "keypoints"}
+    for native, reference in report.values():
+        np.testing.assert_allclose(native, reference, atol=1e-6)
+    # the sample has detections and ground truth, so the stats are not all -1
+    assert report["bbox"][1][0] > 0
+
+
+def test_accumulate_matches_cross_check(synthetic_coco):
+    coco_gt, predictions = synthetic_coco
+    evaluator = RollerEvaluator(coco_gt, ["bbox", "keypoints"], kpt_oks_sigmas=np.array([0.1]))
+    evaluator.update(as_tensors(predictions))
+    evaluator.synchronize_between_processes()
+    evaluator.accumulate()
+
+    report = evaluator.cross_check(num_images=len(predictions))
+
+    for iou_type, (_, reference) in report.items():
+        np.testing.assert_allclose(evaluator.stats[iou_type], reference, atol=1e-6)